@@ -3,9 +3,11 @@ Flask 主应用
 任务拆解工具后端 API
 """
 import os
+import json
+import time
 import uuid
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -18,6 +20,21 @@ from models.schema import (
 )
 from services.ai_service import get_ai_service
 from services.quick_task_service import get_quick_task_service
+from services.http_client import get_http_client_pool
+from services.llm_cache import get_llm_cache
+from services.llm_replay import get_llm_recorder
+from services.token_budget import get_token_budgeter
+from services.single_flight import get_single_flight
+from services.structured_output import get_structured_output
+from services.rate_limiter import get_rate_limiter
+from services.circuit_breaker import get_circuit_breaker
+from services.hedging import get_hedger
+from services.metrics import get_llm_metrics
+from services.job_service import get_job_service, FINISHED_STATUSES
+from services.storage import get_store
+from services.logger import get_logger
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
@@ -27,11 +44,11 @@ app = Flask(__name__)
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
 CORS(app, resources={r"/*": {"origins": cors_origins}})
 
-# 内存存储（生产环境应使用数据库）
-projects_storage = {}
+# 项目存储（默认 SQLite，多个 worker 进程共享；STORAGE_BACKEND=memory 时为进程内存储）
+projects_storage = get_store("projects")
 
 # 快速任务存储
-quick_tasks_storage = {}
+quick_tasks_storage = get_store("quick_tasks")
 
 
 @app.route("/", methods=["GET"])
@@ -41,10 +58,25 @@ def health_check():
         "status": "ok",
         "service": "Task Breakdown API",
         "version": "1.0.0",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "http_pool": get_http_client_pool().get_stats(),
+        "llm_cache": get_llm_cache().get_stats(),
+        "llm_single_flight": get_single_flight().get_stats(),
+        "structured_output": get_structured_output().get_stats(),
+        "llm_rate_limit": get_rate_limiter().get_stats(),
+        "llm_circuit_breaker": get_circuit_breaker().get_stats(),
+        "llm_hedging": get_hedger().get_stats(),
+        "llm_replay": get_llm_recorder().get_stats(),
+        "llm_token_budget": get_token_budgeter().get_stats()
     })
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 指标：各 Agent 的 LLM 调用次数、耗时、token 用量、费用，以及限流/熔断/对冲状态"""
+    return Response(get_llm_metrics().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.route("/api/breakdown", methods=["POST"])
 def create_task_breakdown():
     """
@@ -66,23 +98,19 @@ def create_task_breakdown():
         }
     }
     """
-    print("\n" + "="*50)
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 收到 /api/breakdown 请求")
-    print("="*50)
-    print(f"请求方法: {request.method}")
-    print(f"请求来源: {request.remote_addr}")
-    print(f"请求头: {dict(request.headers)}")
+    logger.info("收到 /api/breakdown 请求", extra={"method": request.method, "remote_addr": request.remote_addr})
+    logger.debug("请求头: %s", request.headers)
 
     try:
         # 解析请求数据
         data = request.get_json()
-        print(f"[DEBUG] 收到请求数据: {data}")  # 调试日志
+        logger.debug("收到请求数据: %s", data)
 
         if not data or "form_data" not in data:
             return jsonify({"error": "缺少 form_data 参数"}), 400
 
         form_data = data["form_data"]
-        print(f"[DEBUG] 表单数据: {form_data}")  # 调试日志
+        logger.debug("表单数据: %s", form_data)
 
         # 验证必填字段
         required_fields = ["goal", "daily_hours"]
@@ -91,39 +119,27 @@ def create_task_breakdown():
                 return jsonify({"error": f"缺少必填字段: {field}"}), 400
 
         # 调用 AI 服务生成任务拆解
-        print(f"[DEBUG] 准备调用 AI 服务...")  # 调试
+        logger.debug("准备调用 AI 服务...")
         ai_service = get_ai_service()
-        print(f"[DEBUG] AI 服务实例已创建")  # 调试
+        logger.debug("AI 服务实例已创建")
 
         # 检查是否配置了 API Key
         import os
         if not os.getenv("SILICONFLOW_API_KEY"):
-            print("[WARNING] 未配置 SILICONFLOW_API_KEY，使用模拟数据")
+            logger.warning("未配置 SILICONFLOW_API_KEY，使用模拟数据")
             result = _get_mock_result(form_data)
         else:
             result = ai_service.generate_task_breakdown(form_data)
-        print(f"[DEBUG] 任务拆解完成")  # 调试
+        logger.debug("任务拆解完成")
 
-        # 打印任务拆解结果
-        print(f"\n[DEBUG] ========== 任务拆解结果 ==========")
-        print(f"[DEBUG] project_id: {result.get('project_id')}")
-        print(f"[DEBUG] analysis: {result.get('analysis')}")
-        print(f"[DEBUG] tasks 数量: {len(result.get('tasks', {}))}")
-        print(f"[DEBUG] tasks 内容: {result.get('tasks')}")
-        print(f"[DEBUG] follow_up_questions: {result.get('follow_up_questions')}")
-        print(f"[DEBUG] =====================================\n")
+        # 任务拆解结果（完整内容很大，只在 DEBUG 级别输出）
+        logger.debug("任务拆解结果: analysis=%s, tasks=%s, follow_up_questions=%s",
+                     result.get('analysis'), result.get('tasks'), result.get('follow_up_questions'),
+                     extra={"project_id": result.get('project_id')})
 
         # 存储项目数据
         project_id = result["project_id"]
-        projects_storage[project_id] = {
-            "form_data": form_data,
-            "analysis": result.get("analysis", {}),
-            "tasks": result["tasks"],
-            "follow_up_questions": result["follow_up_questions"],
-            "answers": {},
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
+        _save_project(project_id, form_data, result)
 
         response_data = {
             "success": True,
@@ -134,27 +150,95 @@ def create_task_breakdown():
                 "created_at": datetime.now().isoformat()
             }
         }
-        print(f"[DEBUG] ========== 返回给客户端的数据 ==========")
-        print(f"[DEBUG] success: {response_data['success']}")
-        print(f"[DEBUG] project_id: {response_data['data']['project_id']}")
-        print(f"[DEBUG] tasks: {response_data['data']['tasks']}")
-        print(f"[DEBUG] follow_up_questions: {response_data['data']['follow_up_questions']}")
-        print(f"[DEBUG] ===========================================\n")
+        logger.info("任务拆解完成", extra={"project_id": project_id, "task_levels": len(result.get('tasks', {}))})
 
         return jsonify(response_data)
 
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 详细错误信息:")
-        print(f"[ERROR] {str(e)}")
-        print(f"[ERROR] Traceback:")
-        traceback.print_exc()
+        logger.exception("任务拆解失败: %s", e)
         return jsonify({
             "error": str(e),
             "message": "任务拆解失败，请稍后重试"
         }), 500
 
 
+@app.route("/api/breakdown/stream", methods=["POST"])
+def stream_task_breakdown():
+    """
+    创建任务拆解（SSE 流式版本）
+
+    POST /api/breakdown/stream
+    请求体与 /api/breakdown 相同，响应为 text/event-stream：
+        event: analysis   Agent 1-3 各自完成时推送 {"field", "value"}
+        event: monthly / weekly / daily   拆解结果的每个条目 {"key", "tasks"}
+        event: questions  补充问题列表
+        event: done       {"project_id", "created_at"}，项目已保存
+        event: error      {"error", "message"}
+    每个事件的 data 都带有 elapsed_ms（距请求开始的毫秒数），便于统计首个结果耗时。
+    """
+    logger.info("收到 /api/breakdown/stream 请求", extra={"remote_addr": request.remote_addr})
+
+    data = request.get_json(silent=True)
+    if not data or "form_data" not in data:
+        return jsonify({"error": "缺少 form_data 参数"}), 400
+
+    form_data = data["form_data"]
+    required_fields = ["goal", "daily_hours"]
+    for field in required_fields:
+        if field not in form_data or not form_data[field]:
+            return jsonify({"error": f"缺少必填字段: {field}"}), 400
+
+    def generate():
+        started = time.monotonic()
+
+        def sse(event: str, payload) -> str:
+            body = {"elapsed_ms": int((time.monotonic() - started) * 1000)}
+            body.update(payload if isinstance(payload, dict) else {"data": payload})
+            return f"event: {event}\ndata: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+        try:
+            if not os.getenv("SILICONFLOW_API_KEY"):
+                logger.warning("未配置 SILICONFLOW_API_KEY，使用模拟数据")
+                events = _iter_mock_events(_get_mock_result(form_data))
+            else:
+                events = get_ai_service().iter_task_breakdown(form_data)
+
+            for event, payload in events:
+                if event == "done":
+                    _save_project(payload["project_id"], form_data, payload)
+                    yield sse("done", {
+                        "project_id": payload["project_id"],
+                        "created_at": datetime.now().isoformat()
+                    })
+                else:
+                    yield sse(event, payload)
+        except Exception as e:
+            logger.exception("流式任务拆解失败: %s", e)
+            yield sse("error", {"error": str(e), "message": "任务拆解失败，请稍后重试"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 禁用 nginx 缓冲，保证事件即时送达
+        }
+    )
+
+
+def _save_project(project_id: str, form_data: dict, result: dict):
+    """保存新生成的项目"""
+    projects_storage.put(project_id, {
+        "form_data": form_data,
+        "analysis": result.get("analysis", {}),
+        "tasks": result["tasks"],
+        "follow_up_questions": result["follow_up_questions"],
+        "answers": {},
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat()
+    })
+
+
 @app.route("/api/projects/<project_id>", methods=["GET"])
 def get_project(project_id: str):
     """
@@ -188,16 +272,16 @@ def update_answers(project_id: str):
         }
     }
     """
-    project = projects_storage.get(project_id)
-    if not project:
-        return jsonify({"error": "项目不存在"}), 404
-
     try:
         data = request.get_json()
         answers = data.get("answers", {})
 
-        project["answers"] = {**project["answers"], **answers}
-        project["updated_at"] = datetime.now().isoformat()
+        def merge_answers(project):
+            project["answers"] = {**project["answers"], **answers}
+            project["updated_at"] = datetime.now().isoformat()
+
+        if projects_storage.update(project_id, merge_answers) is None:
+            return jsonify({"error": "项目不存在"}), 404
 
         return jsonify({
             "success": True,
@@ -229,39 +313,51 @@ def regenerate_tasks(project_id: str):
         data = request.get_json()
         answers = data.get("answers", {})
 
-        # 调用 AI 服务重新生成（传入之前的补充问题以避免重复）
-        ai_service = get_ai_service()
-        result = ai_service.regenerate_with_answers(
-            form_data=project["form_data"],
-            answers={**project["answers"], **answers},
-            previous_tasks=project["tasks"],
-            analysis=project.get("analysis", {}),
-            previous_questions=project.get("follow_up_questions", [])
-        )
-
-        # 更新项目数据
-        project["tasks"] = result["tasks"]
-        project["follow_up_questions"] = result.get("follow_up_questions", project["follow_up_questions"])
-        project["answers"] = {**project["answers"], **answers}
-        project["updated_at"] = datetime.now().isoformat()
+        result = _run_regenerate(project, answers)
 
         return jsonify({
             "success": True,
-            "data": {
-                "project_id": project_id,
-                "tasks": result["tasks"],
-                "follow_up_questions": result.get("follow_up_questions", []),
-                "updated_at": datetime.now().isoformat()
-            }
+            "data": _apply_regenerate_result(project_id, answers, result)
         })
 
     except Exception as e:
-        import traceback
-        print(f"[ERROR] regenerate_tasks exception: {e}")
-        traceback.print_exc()
+        logger.exception("regenerate_tasks exception: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+def _run_regenerate(project: dict, answers: dict) -> dict:
+    """调用 AI 服务重新生成（传入之前的补充问题以避免重复）"""
+    ai_service = get_ai_service()
+    return ai_service.regenerate_with_answers(
+        form_data=project["form_data"],
+        answers={**project["answers"], **answers},
+        previous_tasks=project["tasks"],
+        analysis=project.get("analysis", {}),
+        previous_questions=project.get("follow_up_questions", []),
+        previous_answers=project["answers"]
+    )
+
+
+def _apply_regenerate_result(project_id: str, answers: dict, result: dict) -> dict:
+    """把重新生成的结果写回项目，返回给客户端的数据"""
+    def apply(project):
+        project["tasks"] = result["tasks"]
+        project["follow_up_questions"] = result.get("follow_up_questions", project["follow_up_questions"])
+        project["answers"] = {**project["answers"], **answers}
+        project["updated_at"] = datetime.now().isoformat()
+
+    # 生成期间项目可能已被其他 worker 修改，写回时重新读取并原子更新
+    if projects_storage.update(project_id, apply) is None:
+        raise KeyError(f"项目不存在: {project_id}")
+
+    return {
+        "project_id": project_id,
+        "tasks": result["tasks"],
+        "follow_up_questions": result.get("follow_up_questions", []),
+        "updated_at": datetime.now().isoformat()
+    }
+
+
 @app.route("/api/projects", methods=["GET"])
 def list_projects():
     """
@@ -277,11 +373,166 @@ def list_projects():
                 "goal": p["form_data"].get("goal"),
                 "created_at": p["created_at"]
             }
-            for pid, p in projects_storage.items()
+            for pid, p in projects_storage.list()
         ]
     })
 
 
+# ==================== 后台任务 API ====================
+
+@app.route("/api/jobs/breakdown", methods=["POST"])
+def submit_breakdown_job():
+    """
+    提交任务拆解后台任务（请求体与 /api/breakdown 相同）
+
+    POST /api/jobs/breakdown
+    返回 202 和 job_id，通过 GET /api/jobs/{job_id} 轮询或
+    GET /api/jobs/{job_id}/events 订阅状态；成功后 result 与 /api/breakdown 的 data 相同。
+    """
+    data = request.get_json(silent=True)
+    if not data or "form_data" not in data:
+        return jsonify({"error": "缺少 form_data 参数"}), 400
+
+    form_data = data["form_data"]
+    required_fields = ["goal", "daily_hours"]
+    for field in required_fields:
+        if field not in form_data or not form_data[field]:
+            return jsonify({"error": f"缺少必填字段: {field}"}), 400
+
+    job_service = get_job_service()
+
+    def run(job):
+        if not os.getenv("SILICONFLOW_API_KEY"):
+            logger.warning("未配置 SILICONFLOW_API_KEY，使用模拟数据")
+            return _get_mock_result(form_data)
+        result = None
+        for event, payload in get_ai_service().iter_task_breakdown(form_data):
+            if event == "done":
+                result = payload
+            elif event == "analysis":
+                job_service.set_progress(job, f"analysis:{payload['field']}")
+            else:
+                job_service.set_progress(job, event)
+        return result
+
+    def on_success(result):
+        _save_project(result["project_id"], form_data, result)
+        return {
+            "project_id": result["project_id"],
+            "tasks": result["tasks"],
+            "follow_up_questions": result["follow_up_questions"],
+            "created_at": datetime.now().isoformat()
+        }
+
+    job = job_service.submit("breakdown", run, on_success)
+    return _job_accepted(job)
+
+
+@app.route("/api/jobs/projects/<project_id>/regenerate", methods=["POST"])
+def submit_regenerate_job(project_id: str):
+    """
+    提交重新生成后台任务（请求体与 /api/projects/{project_id}/regenerate 相同）
+
+    POST /api/jobs/projects/{project_id}/regenerate
+    """
+    project = projects_storage.get(project_id)
+    if not project:
+        return jsonify({"error": "项目不存在"}), 404
+
+    data = request.get_json(silent=True) or {}
+    answers = data.get("answers", {})
+
+    job = get_job_service().submit(
+        "regenerate",
+        lambda job: _run_regenerate(project, answers),
+        lambda result: _apply_regenerate_result(project_id, answers, result)
+    )
+    return _job_accepted(job)
+
+
+@app.route("/api/jobs", methods=["GET"])
+def job_stats():
+    """
+    后台任务队列统计（队列深度、各状态任务数）
+
+    GET /api/jobs
+    """
+    return jsonify({"success": True, "data": get_job_service().get_stats()})
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    查询后台任务状态
+
+    GET /api/jobs/{job_id}
+    """
+    snapshot = get_job_service().snapshot(job_id)
+    if not snapshot:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify({"success": True, "data": snapshot[1]})
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id: str):
+    """
+    取消后台任务
+
+    DELETE /api/jobs/{job_id}
+    """
+    job_service = get_job_service()
+    job = job_service.cancel(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify({"success": True, "data": job_service.snapshot(job_id)[1]})
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def subscribe_job(job_id: str):
+    """
+    订阅后台任务状态（SSE），每次状态变化推送一次 status 事件，任务结束后关闭
+
+    GET /api/jobs/{job_id}/events
+    """
+    job_service = get_job_service()
+    if not job_service.get(job_id):
+        return jsonify({"error": "任务不存在"}), 404
+
+    def generate():
+        version = None
+        while True:
+            snapshot = job_service.snapshot(job_id)
+            if not snapshot:
+                return
+            if snapshot[0] != version:
+                version, data = snapshot
+                yield f"event: status\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if data["status"] in FINISHED_STATUSES:
+                    return
+            else:
+                # 心跳，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+            job_service.wait_for_update(job_id, version)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _job_accepted(job):
+    """返回 202 Accepted"""
+    return jsonify({
+        "success": True,
+        "data": {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}"
+        }
+    }), 202
+
+
 # ==================== 快速任务模式 API ====================
 
 @app.route("/api/quick-task/generate", methods=["POST"])
@@ -295,8 +546,7 @@ def generate_quick_task():
         "time_estimate": "2-4小时"  // 可选
     }
     """
-    print("\n" + "="*50)
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 收到 /api/quick-task/generate 请求")
+    logger.info("收到 /api/quick-task/generate 请求", extra={"remote_addr": request.remote_addr})
 
     try:
         data = request.get_json()
@@ -306,7 +556,7 @@ def generate_quick_task():
         idea = data.get("idea")
         time_estimate = data.get("time_estimate")
 
-        print(f"[DEBUG] idea: {idea}")
+        logger.debug("idea: %s", idea)
 
         # 调用快速任务服务
         quick_task_service = get_quick_task_service()
@@ -314,11 +564,11 @@ def generate_quick_task():
 
         # 存储快速任务
         task_id = f"qt-{uuid.uuid4().hex[:8]}"
-        quick_tasks_storage[task_id] = {
+        quick_tasks_storage.put(task_id, {
             "idea": idea,
             "result": result,
             "created_at": datetime.now().isoformat()
-        }
+        })
 
         return jsonify({
             "success": True,
@@ -329,9 +579,7 @@ def generate_quick_task():
         })
 
     except Exception as e:
-        import traceback
-        print(f"[ERROR] 快速任务生成失败: {e}")
-        traceback.print_exc()
+        logger.exception("快速任务生成失败: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -365,21 +613,21 @@ def update_checkpoint_status(task_id: str, step_id: str):
         "status": "completed"  # pending/in_progress/completed/skipped
     }
     """
-    task = quick_tasks_storage.get(task_id)
-    if not task:
-        return jsonify({"error": "任务不存在"}), 404
-
     try:
         data = request.get_json()
         new_status = data.get("status")
 
-        # 更新对应步骤的状态
-        for cp in task["result"]["checkpoints"]:
-            if cp["id"] == step_id:
-                cp["status"] = new_status
-                break
+        def set_status(task):
+            # 更新对应步骤的状态
+            for cp in task["result"]["checkpoints"]:
+                if cp["id"] == step_id:
+                    cp["status"] = new_status
+                    break
+
+            task["updated_at"] = datetime.now().isoformat()
 
-        task["updated_at"] = datetime.now().isoformat()
+        if quick_tasks_storage.update(task_id, set_status) is None:
+            return jsonify({"error": "任务不存在"}), 404
 
         return jsonify({
             "success": True,
@@ -408,7 +656,7 @@ def list_quick_tasks():
                 "checkpoints_count": t["result"]["meta"]["total_checkpoints"],
                 "created_at": t["created_at"]
             }
-            for tid, t in quick_tasks_storage.items()
+            for tid, t in quick_tasks_storage.list()
         ]
     })
 
@@ -469,15 +717,26 @@ def _get_mock_result(form_data: dict) -> dict:
                     "周四": [{"id": "d1-4", "title": "实践练习2", "description": "完成第二个小练习", "estimated_hours": daily_hours}],
                     "周五": [{"id": "d1-5", "title": "周总结", "description": "总结本周所学内容", "estimated_hours": daily_hours}],
                 }
-            },
-            "follow_up_questions": [
-                {"id": "q1", "question": "你希望重点学习哪个方面？", "type": "text"},
-                {"id": "q2", "question": "你有多少时间可以投入？", "type": "single", "options": ["1小时以下", "1-2小时", "2-4小时", "4小时以上"]}
-            ]
-        }
+            }
+        },
+        "follow_up_questions": [
+            {"id": "q1", "question": "你希望重点学习哪个方面？", "type": "text"},
+            {"id": "q2", "question": "你有多少时间可以投入？", "type": "single", "options": ["1小时以下", "1-2小时", "2-4小时", "4小时以上"]}
+        ]
     }
 
 
+def _iter_mock_events(result: dict):
+    """把模拟数据按流式接口的事件顺序逐条产出"""
+    for field, value in result["analysis"].items():
+        yield "analysis", {"field": field, "value": value}
+    for level in ("monthly", "weekly", "daily"):
+        for key, value in result["tasks"].get(level, {}).items():
+            yield level, {"key": key, "tasks": value}
+    yield "questions", result["follow_up_questions"]
+    yield "done", result
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
     debug = os.getenv("FLASK_DEBUG", "True").lower() == "true"
@@ -0,0 +1,138 @@
+"""
+ASGI 入口文件
+用于 uvicorn 部署：
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+任务拆解和快速任务生成由 asyncio 版服务处理，一个事件循环即可承载大量并发的 LLM 调用；
+其余接口仍交给 Flask 应用（通过 asgiref 的 WsgiToAsgi 适配，运行在线程池中）。
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, cors_origins, quick_tasks_storage, _get_mock_result, _save_project
+from services.async_ai_service import get_async_ai_service
+from services.async_quick_task_service import get_async_quick_task_service
+from services.http_client import get_http_client_pool
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+flask_application = WsgiToAsgi(app)
+
+
+async def _read_json(receive) -> dict | None:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def _send_json(scope, send, payload: dict, status: int = 200):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    # 与 Flask-CORS 的配置保持一致（预检请求仍由 Flask 处理）
+    origin = dict(scope.get("headers", [])).get(b"origin", b"").decode()
+    if origin in cors_origins:
+        headers.append((b"access-control-allow-origin", origin.encode()))
+        headers.append((b"vary", b"Origin"))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def create_task_breakdown(scope, receive, send):
+    """POST /api/breakdown（请求与响应格式与 Flask 版相同）"""
+    data = await _read_json(receive)
+    if not data or "form_data" not in data:
+        return await _send_json(scope, send, {"error": "缺少 form_data 参数"}, 400)
+
+    form_data = data["form_data"]
+    for field in ("goal", "daily_hours"):
+        if field not in form_data or not form_data[field]:
+            return await _send_json(scope, send, {"error": f"缺少必填字段: {field}"}, 400)
+
+    try:
+        if not os.getenv("SILICONFLOW_API_KEY"):
+            logger.warning("未配置 SILICONFLOW_API_KEY，使用模拟数据")
+            result = _get_mock_result(form_data)
+        else:
+            result = await get_async_ai_service().generate_task_breakdown(form_data)
+
+        project_id = result["project_id"]
+        # SQLite 写入是阻塞操作，放到线程中执行
+        await asyncio.to_thread(_save_project, project_id, form_data, result)
+    except Exception as e:
+        logger.error("任务拆解失败: %s", e)
+        return await _send_json(scope, send, {"error": str(e), "message": "任务拆解失败，请稍后重试"}, 500)
+
+    await _send_json(scope, send, {
+        "success": True,
+        "data": {
+            "project_id": project_id,
+            "tasks": result["tasks"],
+            "follow_up_questions": result["follow_up_questions"],
+            "created_at": datetime.now().isoformat()
+        }
+    })
+
+
+async def generate_quick_task(scope, receive, send):
+    """POST /api/quick-task/generate（请求与响应格式与 Flask 版相同）"""
+    data = await _read_json(receive)
+    if not data or "idea" not in data:
+        return await _send_json(scope, send, {"error": "缺少 idea 参数"}, 400)
+
+    idea = data.get("idea")
+    try:
+        result = await get_async_quick_task_service().generate_checkpoints(idea, data.get("time_estimate"))
+        task_id = f"qt-{uuid.uuid4().hex[:8]}"
+        await asyncio.to_thread(quick_tasks_storage.put, task_id, {
+            "idea": idea,
+            "result": result,
+            "created_at": datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error("快速任务生成失败: %s", e)
+        return await _send_json(scope, send, {"error": str(e)}, 500)
+
+    await _send_json(scope, send, {"success": True, "data": {"task_id": task_id, **result}})
+
+
+ASYNC_ROUTES = {
+    ("POST", "/api/breakdown"): create_task_breakdown,
+    ("POST", "/api/quick-task/generate"): generate_quick_task,
+}
+
+
+async def application(scope, receive, send):
+    """ASGI 应用：异步路由优先，其余请求交给 Flask"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await get_http_client_pool().aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            return await handler(scope, receive, send)
+
+    await flask_application(scope, receive, send)
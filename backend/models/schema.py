@@ -122,3 +122,77 @@ class QuickTaskResponse(BaseModel):
 class QuickTaskRequest(BaseModel):
     """快速任务请求"""
     idea: str = Field(..., description="用户想法")
+
+
+# ==================== 模型输出 Schema（结构化输出） ====================
+
+class BreakdownMonth(BaseModel):
+    """Agent 6 输出：月度目标"""
+    goal: str = Field(..., description="月度目标概述")
+    output: str = Field(default="", description="该月的最终产出")
+    weeks: List[str] = Field(default_factory=list, description="包含的周次")
+
+
+class BreakdownWeek(BaseModel):
+    """Agent 6 输出：周度目标"""
+    goal: str = Field(..., description="本周目标")
+    output: str = Field(default="", description="本周明确产出")
+    focus: str = Field(default="", description="本周重点领域")
+
+
+class BreakdownDay(BaseModel):
+    """Agent 6 输出：日度任务"""
+    title: str = Field(..., description="任务标题")
+    description: str = Field(default="", description="具体做什么")
+    hours: float = Field(default=1, description="预计小时数")
+    output: str = Field(default="", description="当天产出")
+
+
+class BreakdownResult(BaseModel):
+    """Agent 6 输出：月度→周度→日度任务计划"""
+    project_name: str = Field(default="", description="项目名称")
+    overview: str = Field(default="", description="项目概述")
+    monthly: dict[str, BreakdownMonth] = Field(default_factory=dict, description="如 第1个月")
+    weekly: dict[str, BreakdownWeek] = Field(default_factory=dict, description="如 第1周")
+    daily: dict[str, dict[str, BreakdownDay]] = Field(default_factory=dict, description="如 第1周 → Day1")
+
+
+class BreakdownSkeleton(BaseModel):
+    """分层拆解第一步：月度→周度骨架（不含日任务）"""
+    project_name: str = Field(default="", description="项目名称")
+    overview: str = Field(default="", description="项目概述")
+    monthly: dict[str, BreakdownMonth] = Field(default_factory=dict, description="如 第1个月")
+    weekly: dict[str, BreakdownWeek] = Field(default_factory=dict, description="如 第1周")
+
+
+class RegenerateScope(BaseModel):
+    """增量重新生成：补充信息影响到的周次"""
+    weeks: List[str] = Field(default_factory=list, description="需要调整的周，如 第2周")
+    reason: str = Field(default="", description="判断依据")
+
+
+class PatchTask(BaseModel):
+    """补丁操作中的任务字段（replace 时只给出要修改的字段）"""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    output: Optional[str] = None
+    estimated_hours: Optional[float] = None
+
+
+class TaskPatchOp(BaseModel):
+    """补丁操作：add / replace / remove"""
+    op: str = Field(..., description="add / replace / remove")
+    id: str = Field(default="", description="replace/remove 的任务id")
+    after: str = Field(default="", description="add 插入到该任务id之后")
+    task: Optional[PatchTask] = None
+
+
+class TaskPatch(BaseModel):
+    """补丁式重新生成：只输出对已有任务的改动"""
+    ops: List[TaskPatchOp] = Field(default_factory=list)
+    reason: str = Field(default="", description="改动说明")
+
+
+class RawCheckpointList(BaseModel):
+    """Agent A 输出：节点框架"""
+    raw_checkpoints: List[RawCheckpoint] = Field(default_factory=list)
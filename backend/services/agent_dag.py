@@ -0,0 +1,123 @@
+"""
+Agent 调度器 - 按依赖关系（DAG）调度多个 Agent
+
+每个 Agent 声明自己依赖的输入，输入一旦就绪立即开始执行，不再按固定阶段等待整批完成。
+流式 Agent 还可以在完成前通过 emit 推送中间结果（如边生成边解析出的任务条目）。
+"""
+import queue
+import time
+import concurrent.futures
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class AgentNode:
+    """DAG 中的一个 Agent"""
+
+    def __init__(self, name: str, fn: Callable[..., Any], inputs: Tuple[str, ...] = (), streaming: bool = False):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        # 流式 Agent 额外接收 emit 关键字参数，用于推送中间结果
+        self.streaming = streaming
+
+
+class AgentDAG:
+    """Agent 依赖图
+
+    用法：
+        dag = AgentDAG()
+        dag.add("a", lambda: ...)
+        dag.add("b", lambda a: ..., inputs=("a",))   # 以输入名作为关键字参数传入
+        dag.add("c", lambda a, emit: ..., inputs=("a",), streaming=True)
+        for name, event, value in dag.run():
+            ...   # event 为 "emit"（中间结果）或 "done"（按完成顺序产出每个 Agent 的结果）
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.nodes: Dict[str, AgentNode] = {}
+        # 每个节点的开始/结束时间（相对 run 开始的秒数），用于分析关键路径
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        inputs: Tuple[str, ...] = (),
+        streaming: bool = False
+    ) -> "AgentDAG":
+        if name in self.nodes:
+            raise ValueError(f"重复的 Agent 名称: {name}")
+        self.nodes[name] = AgentNode(name, fn, inputs, streaming)
+        return self
+
+    def _validate(self):
+        """检查依赖是否存在、是否有环"""
+        for node in self.nodes.values():
+            for dep in node.inputs:
+                if dep not in self.nodes:
+                    raise ValueError(f"Agent {node.name} 依赖不存在的输入: {dep}")
+
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Agent 依赖存在环: {name}")
+            visiting.add(name)
+            for dep in self.nodes[name].inputs:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.nodes:
+            visit(name)
+
+    def run(self) -> Iterator[Tuple[str, str, Any]]:
+        """执行 DAG，产出 (名称, "emit"/"done", 值)；任一 Agent 抛出异常时立即向上抛出
+
+        同一 Agent 的 emit 一定在它的 done 之前产出。
+        """
+        self._validate()
+        results: Dict[str, Any] = {}
+        started: List[str] = []
+        done_queue: "queue.Queue" = queue.Queue()
+        run_start = time.monotonic()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers or len(self.nodes) or 1)
+
+        def execute(node: AgentNode):
+            self.timings[node.name] = {"start": time.monotonic() - run_start}
+            kwargs = {dep: results[dep] for dep in node.inputs}
+            if node.streaming:
+                kwargs["emit"] = lambda value: done_queue.put((node.name, "emit", value))
+            try:
+                return node.fn(**kwargs)
+            finally:
+                self.timings[node.name]["end"] = time.monotonic() - run_start
+
+        def start_ready():
+            for node in self.nodes.values():
+                if node.name in started or not all(dep in results for dep in node.inputs):
+                    continue
+                started.append(node.name)
+                future = executor.submit(execute, node)
+                future.add_done_callback(lambda f, name=node.name: done_queue.put((name, "done", f)))
+
+        failed = False
+        try:
+            start_ready()
+            while len(results) < len(self.nodes):
+                name, event, payload = done_queue.get()
+                if event == "emit":
+                    yield name, event, payload
+                    continue
+                results[name] = payload.result()
+                yield name, event, results[name]
+                start_ready()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # 失败或调用方提前停止迭代时不等待其余 Agent
+            executor.shutdown(wait=not failed and len(results) == len(self.nodes), cancel_futures=True)
@@ -4,11 +4,27 @@ AI 服务 - 使用硅基流动模型生成任务拆解
 import os
 import json
 import uuid
-import ssl
 from typing import List, Dict, Any
-from openai import OpenAI
 from dotenv import load_dotenv
-import httpx
+
+from services.http_client import get_openai_client
+from services.llm_cache import get_llm_cache, make_cache_key
+from services.single_flight import get_single_flight
+from services.hedging import get_hedger
+from services.agent_dag import AgentDAG
+from services.json_stream import IncrementalJSONParser
+from services.json_repair import repair_json
+from services.rate_limiter import backoff_delay
+from services.circuit_breaker import CircuitOpenError
+from services.structured_output import create_chat_completion, loads_json_object
+from services.token_budget import OutputTruncatedError, get_token_budgeter
+from services.task_tree import (
+    PatchError, apply_patch, merge_weeks, month_number, month_of_week, plan_listing, plan_outline, plan_weeks, week_number
+)
+from models.schema import BreakdownResult, BreakdownSkeleton, RegenerateScope, TaskPatch
+from services.logger import get_logger, lazy
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
@@ -18,29 +34,19 @@ class AIService:
 
     def __init__(self):
         api_key = os.getenv("SILICONFLOW_API_KEY")
-        print(f"[DEBUG] API Key configured: {bool(api_key)}")  # 调试
-        print(f"[DEBUG] API Key prefix: {api_key[:8] if api_key else 'None'}...")  # 调试
-
-        # 创建自定义 httpx 客户端，禁用 SSL 证书吊销检查（Windows 上的问题）
-        # 在生产环境中，应该正确配置证书而不是禁用验证
-        try:
-            # 尝试创建一个带有自定义 SSL 上下文的客户端
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"),
-                http_client=httpx.Client(
-                    verify=False,  # 临时禁用 SSL 验证以解决 Windows 上的连接问题
-                    timeout=120.0
-                )
-            )
-            print("[DEBUG] 使用自定义 HTTP 客户端（SSL 验证已禁用）")
-        except Exception as e:
-            print(f"[WARNING] 自定义 HTTP 客户端创建失败: {e}")
-            print("[DEBUG] 使用默认 HTTP 客户端")
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1")
-            )
+        logger.debug("API Key configured: %s", bool(api_key))
+        logger.debug("API Key prefix: %s...", api_key[:8] if api_key else 'None')
+
+        # 使用进程级共享的连接池客户端，复用 keep-alive 连接，避免每次调用重新握手
+        self.client = get_openai_client()
+        # 相同提示词的响应缓存（仅对显式开启 use_cache 的 Agent 生效）
+        self.cache = get_llm_cache()
+        # 并发的相同请求只向上游发送一次
+        self.single_flight = get_single_flight()
+        # 分析类 Agent 的慢请求对冲
+        self.hedger = get_hedger()
+        # 按 Agent 和计划周期设置 max_tokens 和超时
+        self.token_budget = get_token_budgeter()
 
         # 不同Agent使用不同的模型
         # 前3个分析Agent使用快速模型
@@ -48,15 +54,43 @@ class AIService:
         # 后2个生成Agent使用思考模型
         self.model_generation = os.getenv("MODEL_GENERATION", "moonshotai/Kimi-K2-Thinking")
 
-        print(f"[DEBUG] Analysis model (Agent 1-3): {self.model_analysis}")  # 调试
-        print(f"[DEBUG] Generation model (Agent 4-5): {self.model_generation}")  # 调试
+        # 分析阶段模式：separate 为 Agent 1-3 各自调用；fused 为一次调用同时返回所有分析字段
+        self.analysis_mode = os.getenv("ANALYSIS_MODE", "separate").lower()
+        # 推测执行：拆解 Agent 不等待分析阶段，使用本地推导的分析结果立即开始
+        self.speculative_breakdown = os.getenv("BREAKDOWN_SPECULATIVE", "false").lower() == "true"
+        # Agent 3 默认使用本地规则计算时间跨度；llm 模式下始终调用模型
+        self.time_span_mode = os.getenv("TIME_SPAN_MODE", "local").lower()
+        # 本地规则无法确定（无截止日期、日期无效等）时是否再调用模型
+        self.time_span_llm_fallback = os.getenv("TIME_SPAN_LLM_FALLBACK", "false").lower() == "true"
+        # 拆解 Agent 使用流式输出：边接收边解析，每个月/周/日条目闭合即推送
+        self.streaming = os.getenv("LLM_STREAMING", "false").lower() == "true"
+        # 拆解方式：single 为一次调用生成全部月/周/日；map_reduce 先生成月/周骨架，再按月并行展开日任务
+        self.breakdown_mode = os.getenv("BREAKDOWN_MODE", "single").lower()
+        # map_reduce 只用于不少于该周数的计划，较短的计划一次调用即可生成
+        self.map_reduce_min_weeks = int(os.getenv("BREAKDOWN_MAP_REDUCE_MIN_WEEKS", "8"))
+        # 按月展开日任务的并发数
+        self.map_concurrency = max(1, int(os.getenv("BREAKDOWN_MAP_CONCURRENCY", "4")))
+        # 重新生成：full 为整体重新生成；delta 只重新生成补充信息影响到的周（及其所属月份）；
+        # patch 只让模型输出对已有任务的增删改操作
+        self.regenerate_mode = os.getenv("REGENERATE_MODE", "full").lower()
+        # delta 模式下受影响的周超过该比例时改为整体重新生成
+        self.regenerate_delta_max_ratio = float(os.getenv("REGENERATE_DELTA_MAX_RATIO", "0.5"))
+
+        logger.debug("Analysis model (Agent 1-3): %s", self.model_analysis)
+        logger.debug("Generation model (Agent 4-5): %s", self.model_generation)
 
     def _call_llm(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         model: str | None = None,
-        max_retries: int = 3
+        max_retries: int = 3,
+        use_cache: bool = False,
+        response_model=None,
+        hedge: bool = False,
+        agent: str | None = None,
+        weeks: int = 0,
+        allow_truncated: bool = True
     ) -> str:
         """调用 LLM
 
@@ -65,127 +99,445 @@ class AIService:
             temperature: 温度参数
             model: 指定模型，None则使用默认生成模型
             max_retries: 最大重试次数
+            use_cache: 是否使用响应缓存（适合低温度、输入确定的分析类 Agent）
+            response_model: 期望输出的 pydantic 模型，模型支持时使用 JSON 模式/按 schema 约束解码
+            hedge: 是否允许对冲请求（LLM_HEDGE_ENABLED 开启时生效，适合输出很短的分析类 Agent）
+            agent: Agent 名称，用于调用指标（/metrics）的标签和输出 token 预算
+            weeks: 本次输出覆盖的周数，拆解类 Agent 的 max_tokens 和超时随之增长
+            allow_truncated: False 时按上限重新请求后输出仍被截断则抛出 OutputTruncatedError，而不是返回截断的输出
         """
         if model is None:
             model = self.model_generation
 
+        budget = self.token_budget.plan(agent, model, messages, weeks)
+        request_key = make_cache_key(model, messages, temperature, budget.max_tokens)
+        if use_cache:
+            cached = self.cache.get(request_key)
+            if cached is not None:
+                logger.debug("命中 LLM 缓存: %s", model)
+                return cached
+
+        def fetch() -> str:
+            if hedge:
+                content = self.hedger.call(
+                    model,
+                    lambda m: self._call_llm_upstream(
+                        messages, temperature, m, budget, max_retries, response_model, agent, allow_truncated
+                    )
+                )
+            else:
+                content = self._call_llm_upstream(
+                    messages, temperature, model, budget, max_retries, response_model, agent, allow_truncated
+                )
+            if use_cache:
+                self.cache.set(request_key, content)
+            return content
+
+        # 相同请求正在进行时直接等待并共享其结果
+        return self.single_flight.do(request_key, fetch)
+
+    def _call_llm_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        model: str,
+        budget,
+        max_retries: int,
+        response_model=None,
+        agent: str | None = None,
+        allow_truncated: bool = True
+    ) -> str:
+        """实际请求上游模型（带重试）
+
+        输出因达到预算的 max_tokens 被截断时，按上限重新请求（计入重试次数）；已按上限请求或没有剩余次数时，
+        返回截断的输出，allow_truncated 为 False 时抛出 OutputTruncatedError。
+        """
         import time
         from openai import APIConnectionError, APIError, RateLimitError
 
-        # 思考模型需要更长时间，设置 10 分钟超时
-        timeout_val = 600.0 if "Thinking" in model or "thinking" in model else 120.0
-
         last_error = None
         for attempt in range(max_retries):
             try:
-                print(f"[DEBUG] 调用 AI 模型: {model} (尝试 {attempt + 1}/{max_retries})")  # 调试
-                # 根据模型类型设置不同的 max_tokens
-                # Thinking 模型可能需要更多 tokens
-                if "Thinking" in model or "thinking" in model:
-                    max_t = 16384
-                else:
-                    max_t = 8192
-                response = self.client.chat.completions.create(
+                logger.debug("调用 AI 模型: %s (尝试 %s/%s)", model, attempt + 1, max_retries)
+                response = create_chat_completion(
+                    self.client,
+                    response_model=response_model,
+                    agent=agent,
+                    attempt=attempt + 1,
                     model=model,
                     messages=messages,
                     temperature=temperature,
-                    max_tokens=max_t,
-                    timeout=timeout_val,
+                    max_tokens=budget.max_tokens,
+                    timeout=budget.timeout,
                 )
-                print(f"[DEBUG] AI 响应成功")  # 调试
+                logger.debug("AI 响应成功")
+                finish_reason = getattr(response.choices[0], "finish_reason", None)
+                self.token_budget.record(agent, model, budget, getattr(response, "usage", None), finish_reason)
+                if finish_reason == "length" and budget.max_tokens < budget.cap and attempt < max_retries - 1:
+                    logger.warning("%s 的输出被截断，按上限 %s 重新请求", agent, budget.cap)
+                    budget = budget._replace(
+                        max_tokens=budget.cap, timeout=self.token_budget.default_limits(model)[1]
+                    )
+                    continue
+                if finish_reason == "length" and not allow_truncated:
+                    raise OutputTruncatedError(f"{agent} 的输出达到 max_tokens={budget.max_tokens} 被截断")
                 return response.choices[0].message.content
+            except (CircuitOpenError, OutputTruncatedError):
+                # 熔断期间不再重试，由调用方改用默认结果；截断已按上限重新请求过，由调用方决定如何回退
+                raise
             except APIConnectionError as e:
                 last_error = e
-                print(f"[ERROR] 连接错误 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
+                logger.error("连接错误 (尝试 %s/%s): %s", attempt + 1, max_retries, e)
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # 指数退避: 1s, 2s, 4s
-                    print(f"[INFO] 等待 {wait_time} 秒后重试...")
+                    wait_time = backoff_delay(attempt)  # 带抖动的指数退避，避免多个线程同时重试
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
                     time.sleep(wait_time)
             except RateLimitError as e:
                 last_error = e
-                print(f"[ERROR] API 速率限制: {str(e)}")
-                if attempt < max_retries - 1:
-                    wait_time = 5  # 速率限制时等待更长时间
-                    print(f"[INFO] 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
+                logger.error("API 速率限制: %s", e)
+                # 不在这里 sleep：限流器已按 Retry-After 暂停该模型，下一次尝试会在获取许可时排队
             except APIError as e:
                 last_error = e
-                print(f"[ERROR] API 错误: {str(e)}")
+                logger.error("API 错误: %s", e)
                 # API 错误通常是服务器问题，值得重试
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    print(f"[INFO] 等待 {wait_time} 秒后重试...")
+                    wait_time = backoff_delay(attempt)
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
                     time.sleep(wait_time)
             except Exception as e:
                 # 其他类型的错误（如超时、网络中断）也值得重试
                 last_error = e
-                print(f"[ERROR] 未知错误 (尝试 {attempt + 1}/{max_retries}): {type(e).__name__} - {str(e)}")
+                logger.error("未知错误 (尝试 %s/%s): %s - %s", attempt + 1, max_retries, type(e).__name__, e)
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    print(f"[INFO] 等待 {wait_time} 秒后重试...")
+                    wait_time = backoff_delay(attempt)
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
                     time.sleep(wait_time)
 
         # 所有重试都失败后，抛出最后一个错误
-        print(f"[ERROR] AI 调用失败：已重试 {max_retries} 次，仍然失败")
+        logger.error("AI 调用失败：已重试 %s 次，仍然失败", max_retries)
         raise RuntimeError(f"AI 调用失败: {str(last_error)}")
 
-    def generate_task_breakdown(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
-        """生成任务拆解 - 多Agent并行工作"""
-        print(f"[DEBUG] 开始多Agent任务拆解")
+    def _call_llm_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        model: str | None = None,
+        max_retries: int = 3,
+        response_model=None,
+        agent: str | None = None,
+        weeks: int = 0
+    ):
+        """流式调用 LLM，逐段产出模型输出的文本
+
+        只有在尚未收到任何内容时才会重试；输出中途断开时异常直接抛给调用方，
+        由调用方决定如何使用已经收到的部分。流式调用不经过缓存和请求合并。
+        """
+        import time
 
-        # 并行调用多个Agent
-        import concurrent.futures
+        if model is None:
+            model = self.model_generation
+        budget = self.token_budget.plan(agent, model, messages, weeks)
 
-        # 第一阶段：3个分析Agent并行工作
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_type = executor.submit(self._agent_task_type, form_data)
-            future_experience = executor.submit(self._agent_experience, form_data)
-            future_time = executor.submit(self._agent_time_span, form_data)
-
-            task_type_result = future_type.result()
-            experience_result = future_experience.result()
-            time_result = future_time.result()
-
-        print(f"[DEBUG] 分析Agent完成:")
-        print(f"  - 任务类型: {task_type_result}")
-        print(f"  - 经验水平: {experience_result}")
-        print(f"  - 时间跨度: {time_result}")
-
-        # 汇总分析结果
-        analysis = {
-            "task_type": task_type_result,
-            "experience_level": experience_result,
-            "time_span": time_result
-        }
+        last_error = None
+        for attempt in range(max_retries):
+            received = False
+            output_chars = 0
+            finish_reason = None
+            try:
+                logger.debug("流式调用 AI 模型: %s (尝试 %s/%s)", model, attempt + 1, max_retries)
+                stream = create_chat_completion(
+                    self.client,
+                    response_model=response_model,
+                    agent=agent,
+                    attempt=attempt + 1,
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=budget.max_tokens,
+                    timeout=budget.timeout,
+                    stream=True,
+                )
+                with stream:
+                    for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+                        # 思考模型的推理过程在 reasoning_content 中，content 为 None
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            received = True
+                            output_chars += len(content)
+                            yield content
+                logger.debug("AI 流式响应完成")
+                # 流式响应没有 usage，按输出长度估算（不含思考模型的推理过程）
+                self.token_budget.record(agent, model, budget, None, finish_reason, completion_tokens=output_chars // 2)
+                return
+            except Exception as e:
+                if received or isinstance(e, CircuitOpenError):
+                    raise
+                last_error = e
+                logger.error("流式调用失败 (尝试 %s/%s): %s - %s", attempt + 1, max_retries, type(e).__name__, e)
+                if attempt < max_retries - 1:
+                    wait_time = backoff_delay(attempt)
+                    logger.info("等待 %.1f 秒后重试...", wait_time)
+                    time.sleep(wait_time)
 
-        # 第二阶段：任务拆解Agent和问题生成Agent并行工作
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            future_tasks = executor.submit(self._agent_breakdown, form_data, analysis)
-            future_questions = executor.submit(self._agent_questions, form_data, analysis)
+        logger.error("AI 流式调用失败：已重试 %s 次，仍然失败", max_retries)
+        raise RuntimeError(f"AI 调用失败: {str(last_error)}")
 
-            tasks = future_tasks.result()
-            questions_result = future_questions.result()
+    def generate_task_breakdown(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
+        """生成任务拆解 - 多Agent并行工作"""
+        result = None
+        for event, data in self.iter_task_breakdown(form_data):
+            if event == "done":
+                result = data
+        return result
+
+    def iter_task_breakdown(self, form_data: Dict[str, Any]):
+        """生成任务拆解（事件流版本）
 
-        print(f"[DEBUG] 生成Agent完成:")
-        print(f"  - tasks keys: {list(tasks.keys())}")
-        print(f"  - monthly 任务数: {len(tasks.get('monthly', {}))}")
-        print(f"  - weekly 任务数: {len(tasks.get('weekly', {}))}")
-        print(f"  - daily 任务数: {len(tasks.get('daily', {}))}")
-        print(f"  - questions 数量: {len(questions_result)}")
+        各 Agent 按依赖关系调度（见 _build_agent_dag），每个 Agent 一完成就产出事件，
+        供 SSE 接口边生成边推送：
+            ("analysis", {"field": ..., "value": ...})  Agent 1-3 各自完成时
+            ("monthly" / "weekly" / "daily", {"key": ..., "tasks": ...})  拆解结果的每个条目
+            ("questions", [...])  补充问题
+            ("done", {...})  与 generate_task_breakdown 返回值相同的完整结果
+        """
+        logger.debug("开始多Agent任务拆解")
+
+        dag = self._build_agent_dag(form_data)
+        analysis = {}
+        tasks = {}
+        questions_result = []
+
+        # 流式拆解时条目在 emit 中已经推送过，完成时不再重复推送
+        streamed = set()
+
+        for name, event, value in dag.run():
+            if event == "emit":
+                streamed.add((value["level"], value["key"]))
+                yield value["level"], {"key": value["key"], "tasks": value["tasks"]}
+            elif name in ("task_type", "experience_level", "time_span"):
+                yield "analysis", {"field": name, "value": value}
+            elif name == "analysis":
+                # 融合模式下三个字段在这里一次性产出
+                for field in ("task_type", "experience_level", "time_span"):
+                    if field not in dag.nodes:
+                        yield "analysis", {"field": field, "value": value[field]}
+                analysis = value
+                logger.debug("分析Agent完成: 任务类型=%s, 经验水平=%s, 时间跨度=%s",
+                             analysis['task_type'], analysis['experience_level'], analysis['time_span'])
+            elif name == "tasks":
+                tasks = value
+                for level in ("monthly", "weekly", "daily"):
+                    for key, entry in tasks.get(level, {}).items():
+                        if (level, key) not in streamed:
+                            yield level, {"key": key, "tasks": entry}
+            elif name == "questions":
+                questions_result = value
+                yield "questions", questions_result
+
+        logger.info(
+            "任务拆解完成",
+            extra={
+                "monthly": len(tasks.get('monthly', {})),
+                "weekly": len(tasks.get('weekly', {})),
+                "daily": len(tasks.get('daily', {})),
+                "questions": len(questions_result),
+            }
+        )
+        logger.debug("Agent 耗时(秒): %s", lazy(lambda: ", ".join(
+            f"{name} {t['start']:.1f}→{t.get('end', 0):.1f}" for name, t in dag.timings.items()
+        )))
 
         # 组装结果
         project_id = str(uuid.uuid4())
 
-        return {
+        yield "done", {
             "project_id": project_id,
             "analysis": analysis,
             "tasks": tasks,
             "follow_up_questions": questions_result
         }
 
+    def _build_agent_dag(self, form_data: Dict[str, Any]) -> AgentDAG:
+        """构建任务拆解的 Agent 依赖图
+
+        analysis ← task_type / experience_level / time_span（融合模式下为单个 Agent）
+        tasks    ← analysis（推测模式下不依赖任何输入，用本地推导的分析结果立即开始）
+        questions ← analysis
+        """
+        dag = AgentDAG()
+        if self.analysis_mode == "fused":
+            dag.add("analysis", lambda: self._agent_analysis_fused(form_data))
+        else:
+            dag.add("task_type", lambda: self._agent_task_type(form_data))
+            dag.add("experience_level", lambda: self._agent_experience(form_data))
+            dag.add("time_span", lambda: self._agent_time_span(form_data))
+            dag.add(
+                "analysis",
+                lambda task_type, experience_level, time_span: {
+                    "task_type": task_type,
+                    "experience_level": experience_level,
+                    "time_span": time_span
+                },
+                inputs=("task_type", "experience_level", "time_span")
+            )
+
+        if self.streaming:
+            def breakdown(analysis, emit):
+                return self._agent_breakdown_stream(form_data, analysis, emit)
+        else:
+            def breakdown(analysis, emit=None):
+                return self._agent_breakdown(form_data, analysis)
+
+        if self.speculative_breakdown:
+            # 耗时最长的拆解 Agent 不等分析结果，直接用本地推导的分析开始生成
+            dag.add(
+                "tasks",
+                lambda **kwargs: breakdown(self._local_analysis(form_data), **kwargs),
+                streaming=self.streaming
+            )
+        else:
+            dag.add("tasks", breakdown, inputs=("analysis",), streaming=self.streaming)
+        dag.add("questions", lambda analysis: self._agent_questions(form_data, analysis), inputs=("analysis",))
+        return dag
+
+    def _local_analysis(self, form_data: Dict[str, Any]) -> Dict[str, str]:
+        """不调用模型，按关键词和表单字段推导分析结果（供推测执行使用）"""
+        goal = form_data.get('goal', '')
+        type_keywords = [
+            ("考试备考类", ['考试', '考研', '考公', '考证', '备考', '雅思', '托福', 'CPA', '四级', '六级']),
+            ("健康健身类", ['减肥', '减脂', '增肌', '健身', '跑步', '马拉松', '瑜伽', '体重']),
+            ("项目开发类", ['开发', '网站', '网页', 'APP', 'App', 'app', '小程序', '论文', '项目', '系统']),
+            ("阅读写作类", ['读完', '阅读', '读书', '写作', '小说', '写书']),
+            ("生活目标类", ['装修', '旅行', '旅游', '搬家', '婚礼']),
+            ("技能学习类", ['学习', '学会', '掌握', '入门', '语言', '乐器', '吉他', '钢琴', '编程']),
+        ]
+        task_type = "技能学习类"
+        for type_name, keywords in type_keywords:
+            if any(kw in goal for kw in keywords):
+                task_type = type_name
+                break
+
+        experience_map = {
+            "beginner": "初学者 - 刚开始接触这个领域",
+            "intermediate": "进阶者 - 有一定基础，需要进一步提升",
+            "expert": "精通者 - 技能熟练，想要突破瓶颈"
+        }
+        return {
+            "task_type": f"{task_type} - {goal[:30]}",
+            "experience_level": experience_map.get(form_data.get('experience'), "初学者 - 刚开始接触这个领域"),
+            "time_span": self._local_time_span(form_data)[0]
+        }
+
+    # ==================== Agent 1-3 融合: 一次调用完成全部分析 ====================
+    def _agent_analysis_fused(self, form_data: Dict[str, Any]) -> Dict[str, str]:
+        """Agent 1-3 融合版：一次调用同时返回任务类型、经验水平（和时间跨度）
+
+        时间跨度能由本地规则确定时不再交给模型；模型输出无法解析或缺少字段时，
+        缺失的字段退回到各自独立的 Agent 调用。
+        """
+        import concurrent.futures
+
+        result = {}
+        fields = ["task_type", "experience_level", "time_span"]
+        if self.time_span_mode != "llm":
+            label, ambiguous = self._local_time_span(form_data)
+            if not ambiguous or not self.time_span_llm_fallback:
+                result["time_span"] = label
+                fields.remove("time_span")
+
+        deadline = form_data.get('deadline')
+        field_specs = {
+            "task_type": """"task_type": 目标属于哪种任务类型，格式"类型名称 - 简短描述"（50字以内），例如"技能学习类 - 网页开发"。
+  常见类型：技能学习类、项目开发类、健康健身类、考试备考类、阅读写作类、生活目标类""",
+            "experience_level": '"experience_level": 用户在该领域的真实水平，格式"水平等级 - 具体描述"（50字以内），'
+                                '例如"零基础 - 完全没有编程经验，需要从基础概念开始"',
+            "time_span": """"time_span": 时间跨度和拆解层级，格式"时间跨度 - 拆解层级建议"，例如"中期(3个月) - 使用月度+周度+日度三层拆解"。
+  时间跨度：长期(半年以上) / 中期(1-6个月) / 短期(1个月内)；层级可选年度/季度/月度/周度/日度""",
+        }
+        prompt = f"""分析以下目标，一次性给出下列分析字段。
+
+目标：{form_data.get('goal', '')}
+用户自评经验：{form_data.get('experience', 'beginner')}
+截止日期：{deadline or '无固定截止日期'}
+每日可用：{form_data.get('daily_hours', '2')}小时
+
+需要返回的字段：
+{chr(10).join(f"- {field_specs[field]}" for field in fields)}
+
+只返回一个JSON对象，不要输出解释或代码块，例如：
+{json.dumps({field: "..." for field in fields}, ensure_ascii=False)}"""
+
+        try:
+            response = self._call_llm(
+                [{"role": "user", "content": prompt}],
+                temperature=0.3,
+                model=self.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="analysis_fused"
+            )
+            result.update(self._parse_fused_analysis(response, fields))
+        except Exception as e:
+            logger.error("融合分析调用失败: %s", e)
+
+        missing = [field for field in fields if not result.get(field)]
+        if missing:
+            logger.warning("融合分析缺少字段 %s，退回独立 Agent 调用", missing)
+            agents = {
+                "task_type": self._agent_task_type,
+                "experience_level": self._agent_experience,
+                "time_span": self._agent_time_span,
+            }
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                futures = {field: executor.submit(agents[field], form_data) for field in missing}
+                for field, future in futures.items():
+                    result[field] = future.result()
+
+        return result
+
+    def _parse_fused_analysis(self, response: str, fields: List[str]) -> Dict[str, str]:
+        """解析融合分析的 JSON 输出，只保留非空的字符串字段"""
+        response = response.strip()
+        if "```" in response:
+            start = response.find("{")
+            end = response.rfind("}")
+            response = response[start:end + 1] if start != -1 and end > start else response
+        try:
+            data = json.loads(response)
+        except json.JSONDecodeError as e:
+            logger.warning("融合分析输出不是合法JSON: %s", e)
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {
+            field: data[field].strip().split('\n')[0][:100]
+            for field in fields
+            if isinstance(data.get(field), str) and data[field].strip()
+        }
+
     # ==================== Agent 1: 任务类型分析 ====================
     def _agent_task_type(self, form_data: Dict[str, Any]) -> str:
         """Agent 1: 分析任务类型"""
+        try:
+            response = self._call_llm(
+                [{"role": "user", "content": self._task_type_prompt(form_data)}],
+                temperature=0.3,
+                model=self.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="task_type"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，任务类型改用本地推导", e)
+            return self._local_analysis(form_data)["task_type"]
+        # 清理响应
+        return response.strip().split('\n')[0][:100]
+
+    def _task_type_prompt(self, form_data: Dict[str, Any]) -> str:
+        """Agent 1 提示词"""
         prompt = f"""分析以下目标属于哪种任务类型，只返回类型名称和简短描述（50字以内）。
 
 目标：{form_data.get('goal', '')}
@@ -200,13 +552,27 @@ class AIService:
 
 返回格式：类型名称 - 简短描述
 例如：技能学习类 - 网页开发"""
-        response = self._call_llm([{"role": "user", "content": prompt}], temperature=0.3, model=self.model_analysis)
-        # 清理响应
-        return response.strip().split('\n')[0][:100]
+        return prompt
 
     # ==================== Agent 2: 经验水平评估 ====================
     def _agent_experience(self, form_data: Dict[str, Any]) -> str:
         """Agent 2: 评估用户经验水平"""
+        try:
+            response = self._call_llm(
+                [{"role": "user", "content": self._experience_prompt(form_data)}],
+                temperature=0.3,
+                model=self.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="experience_level"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，经验水平改用本地推导", e)
+            return self._local_analysis(form_data)["experience_level"]
+        return response.strip().split('\n')[0][:100]
+
+    def _experience_prompt(self, form_data: Dict[str, Any]) -> str:
+        """Agent 2 提示词"""
         user_exp = form_data.get('experience', 'beginner')
         goal = form_data.get('goal', '')
 
@@ -219,12 +585,76 @@ class AIService:
 
 返回格式：水平等级 - 具体描述
 例如：零基础 - 完全没有编程经验，需要从基础概念开始"""
-        response = self._call_llm([{"role": "user", "content": prompt}], temperature=0.3, model=self.model_analysis)
-        return response.strip().split('\n')[0][:100]
+        return prompt
 
     # ==================== Agent 3: 时间跨度判断 ====================
     def _agent_time_span(self, form_data: Dict[str, Any]) -> str:
-        """Agent 3: 判断时间跨度并确定拆解层级"""
+        """Agent 3: 判断时间跨度并确定拆解层级
+
+        默认由本地规则直接计算；只有 TIME_SPAN_MODE=llm，或本地规则无法确定且开启了
+        TIME_SPAN_LLM_FALLBACK 时才调用模型。
+        """
+        if self.time_span_mode != "llm":
+            label, ambiguous = self._local_time_span(form_data)
+            if not ambiguous or not self.time_span_llm_fallback:
+                return label
+            logger.debug("时间跨度无法由规则确定，调用模型判断")
+
+        return self._llm_time_span(form_data)
+
+    def _local_time_span(self, form_data: Dict[str, Any]) -> tuple:
+        """按剩余天数计算时间跨度标签，格式与 Agent 3 的模型输出一致
+
+        Returns:
+            (标签, 是否不确定)；无截止日期、日期无效或已过期时视为不确定
+        """
+        from datetime import datetime
+
+        deadline = form_data.get('deadline')
+        if not deadline:
+            return "中期(无固定期限) - 使用月度+周度+日度三层拆解", True
+        try:
+            deadline_date = datetime.strptime(deadline, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return "中期(截止日期未知) - 使用月度+周度+日度三层拆解", True
+
+        # 按日历日计算，截止日期为今天时剩余 0 天（按 1 天计）
+        days_left = (deadline_date.date() - datetime.now().date()).days
+        if days_left < 0:
+            return "短期(已过截止日期) - 使用日度拆解", True
+
+        days = max(1, days_left)
+        if days <= 7:
+            return f"短期({days}天) - 使用日度拆解", False
+        if days < 30:
+            return f"短期({days}天) - 使用周度+日度两层拆解", False
+        months = max(1, round(days / 30))
+        if days < 180:
+            return f"中期({months}个月) - 使用月度+周度+日度三层拆解", False
+        if days < 365:
+            return f"长期({months}个月) - 使用年度+月度+周度+日度四层拆解", False
+        years, rest_months = divmod(months, 12)
+        duration = f"{years}年{rest_months}个月" if rest_months else f"{years}年"
+        return f"长期({duration}) - 使用年度+月度+周度+日度四层拆解", False
+
+    def _llm_time_span(self, form_data: Dict[str, Any]) -> str:
+        """调用模型判断时间跨度"""
+        try:
+            response = self._call_llm(
+                [{"role": "user", "content": self._time_span_prompt(form_data)}],
+                temperature=0.3,
+                model=self.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="time_span"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，时间跨度改用本地规则", e)
+            return self._local_time_span(form_data)[0]
+        return response.strip().split('\n')[0][:100]
+
+    def _time_span_prompt(self, form_data: Dict[str, Any]) -> str:
+        """Agent 3（模型判断）提示词"""
         deadline = form_data.get('deadline')
         daily_hours = form_data.get('daily_hours', '2')
         goal = form_data.get('goal', '')
@@ -252,8 +682,7 @@ class AIService:
 
 返回格式：时间跨度 - 拆解层级建议
 例如：中期(3个月) - 使用月度+周度+日度三层拆解"""
-        response = self._call_llm([{"role": "user", "content": prompt}], temperature=0.3, model=self.model_analysis)
-        return response.strip().split('\n')[0][:100]
+        return prompt
 
     # ==================== Agent 4: 补充问题生成 ====================
     def _agent_questions(self, form_data: Dict[str, Any], analysis: Dict[str, str], previous_questions: list = None) -> list:
@@ -267,6 +696,21 @@ class AIService:
         Returns:
             补充问题列表
         """
+        prompt = self._questions_prompt(form_data, analysis, previous_questions)
+        try:
+            response = self._call_llm(
+                [{"role": "user", "content": prompt}],
+                temperature=0.7,
+                model=self.model_generation,
+                agent="questions"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认补充问题", e)
+            return self._get_default_questions()
+        return self._parse_questions_response(response)
+
+    def _questions_prompt(self, form_data: Dict[str, Any], analysis: Dict[str, str], previous_questions: list = None) -> str:
+        """Agent 4 提示词"""
         experience_map = {
             "beginner": "初学者",
             "intermediate": "进阶者",
@@ -293,33 +737,12 @@ class AIService:
 {chr(10).join(prev_q_list)}
 """
 
+        # 固定的职责、规则和输出格式在前，用户数据和已问过的问题在后（前缀可被上游缓存复用）
         prompt = f"""你是补充问题生成器（Follow-up Question Agent）。
 
 ## 你的职责
 你不负责生成计划，也不负责修改任务；你只负责提出高价值的补充问题，帮助下一步让计划更准确、更可执行。
 
-## 输入信息
-{{
-  "goal": "{form_data.get('goal', '')}",
-  "user_profile": {{
-    "experience_level": "{experience_map.get(form_data.get('experience', 'beginner'), '初学者')}",
-    "daily_hours": "{form_data.get('daily_hours', '')}小时",
-    "working_days": {json.dumps(form_data.get('working_days', []), ensure_ascii=False)},
-    "importance": "{form_data.get('importance', 3)}/5",
-    "deadline": "{form_data.get('deadline', '无')}"
-  }},
-  "context": {{
-    "blockers": "{form_data.get('blockers', '无')}",
-    "resources": "{form_data.get('resources', '无')}",
-    "expectations": {json.dumps(form_data.get('expectations', []), ensure_ascii=False)}
-  }},
-  "ai_analysis": {{
-    "task_type": "{analysis.get('task_type', '')}",
-    "experience_level": "{analysis.get('experience_level', '')}",
-    "time_span": "{analysis.get('time_span', '')}"
-  }}
-}}
-{previous_questions_text}
 ## 输出要求
 生成1~3个高信息增益的补充问题，遵循以下原则：
 ### 🎯 个人偏好维度（挖掘学习习惯与风格）
@@ -352,8 +775,35 @@ class AIService:
 ## 输出格式
 只返回JSON数组，不要输出解释、markdown、代码块、额外字段：
 
-[{{"id": "q1", "question": "单选问题", "type": "single", "options": ["选项1", "选项2", "选项3"]}}, {{"id": "q2", "question": "多选问题", "type": "multiple", "options": ["选项A", "选项B", "选项C"]}}]"""
-        response = self._call_llm([{"role": "user", "content": prompt}], temperature=0.7, model=self.model_generation)
+[{{"id": "q1", "question": "单选问题", "type": "single", "options": ["选项1", "选项2", "选项3"]}}, {{"id": "q2", "question": "多选问题", "type": "multiple", "options": ["选项A", "选项B", "选项C"]}}]
+
+## 输入信息
+{{
+  "goal": "{form_data.get('goal', '')}",
+  "user_profile": {{
+    "experience_level": "{experience_map.get(form_data.get('experience', 'beginner'), '初学者')}",
+    "daily_hours": "{form_data.get('daily_hours', '')}小时",
+    "working_days": {json.dumps(form_data.get('working_days', []), ensure_ascii=False)},
+    "importance": "{form_data.get('importance', 3)}/5",
+    "deadline": "{form_data.get('deadline', '无')}"
+  }},
+  "context": {{
+    "blockers": "{form_data.get('blockers', '无')}",
+    "resources": "{form_data.get('resources', '无')}",
+    "expectations": {json.dumps(form_data.get('expectations', []), ensure_ascii=False)}
+  }},
+  "ai_analysis": {{
+    "task_type": "{analysis.get('task_type', '')}",
+    "experience_level": "{analysis.get('experience_level', '')}",
+    "time_span": "{analysis.get('time_span', '')}"
+  }}
+}}
+{previous_questions_text}
+请根据以上输入信息生成补充问题，只返回JSON数组。"""
+        return prompt
+
+    def _parse_questions_response(self, response: str) -> list:
+        """解析补充问题，失败时返回默认问题"""
         # 提取JSON
         if "```json" in response:
             start = response.find("```json") + 7
@@ -375,7 +825,7 @@ class AIService:
                 return result
             return self._get_default_questions()
         except Exception as e:
-            print(f"[ERROR] 解析补充问题失败: {e}")
+            logger.error("解析补充问题失败: %s", e)
             return self._get_default_questions()
 
     def _ensure_category_fields(self, questions: list) -> list:
@@ -450,14 +900,297 @@ class AIService:
     # ==================== Agent 6: 专业任务拆解器 ====================
     def _agent_breakdown(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> Dict[str, Any]:
         """Agent 6: 专业任务拆解器 - 将需求拆解成月度→周度→日度的详细任务计划"""
-        prompt = self._build_breakdown_prompt(form_data, analysis)
+        if self._use_map_reduce(form_data):
+            tasks = self._agent_breakdown_map_reduce(form_data, analysis)
+            if tasks is not None:
+                return tasks
+        try:
+            response = self._call_llm(
+                self._breakdown_messages(form_data, analysis),
+                temperature=0.7,
+                model=self.model_generation,
+                response_model=BreakdownResult,
+                agent="breakdown",
+                weeks=self._plan_horizon(form_data)["weeks_count"]
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认任务结构", e)
+            return self._get_fallback_tasks(form_data)
+        return self._parse_breakdown_response(response, form_data)
+
+    def _agent_breakdown_stream(self, form_data: Dict[str, Any], analysis: Dict[str, str], emit=None) -> Dict[str, Any]:
+        """Agent 6 流式版：边接收边解析，每个月/周/日条目闭合后立即转换并通过 emit 推送
+
+        输出中途断开时保留已解析的条目；一个条目都没有解析出来时退回整体解析。
+        """
+        from datetime import datetime
+
+        if self._use_map_reduce(form_data):
+            tasks = self._agent_breakdown_map_reduce(form_data, analysis, emit)
+            if tasks is not None:
+                return tasks
+
+        messages = self._breakdown_messages(form_data, analysis)
+        parser = IncrementalJSONParser()
+        converted = {"yearly": [], "quarterly": {}, "monthly": {}, "weekly": {}, "daily": {}}
+        current_date = datetime.now()
+
+        try:
+            for chunk in self._call_llm_stream(
+                messages,
+                temperature=0.7,
+                model=self.model_generation,
+                response_model=BreakdownResult,
+                agent="breakdown",
+                weeks=self._plan_horizon(form_data)["weeks_count"]
+            ):
+                for section, key, value in parser.feed(chunk):
+                    converted_entry = self._convert_agent6_entry(section, key, value, current_date)
+                    if converted_entry is None:
+                        continue
+                    out_key, entry_tasks = converted_entry
+                    converted[section][out_key] = entry_tasks
+                    if emit is not None:
+                        emit({"level": section, "key": out_key, "tasks": entry_tasks})
+        except Exception as e:
+            if parser.entries == 0:
+                logger.warning("流式拆解失败，改用非流式调用: %s", e)
+                return self._agent_breakdown(form_data, analysis)
+            logger.warning("流式输出中断，保留已解析的 %s 个条目: %s", parser.entries, e)
+
+        if parser.entries == 0:
+            # 输出不是预期的结构（如整体包了一层），交给完整解析流程处理
+            return self._parse_breakdown_response(parser.pending_text(), form_data)
+
+        logger.debug("流式解析完成: monthly %s, weekly %s, daily %s", len(converted['monthly']), len(converted['weekly']), len(converted['daily']))
+        return converted
+
+    # ---------- 分层拆解（map-reduce） ----------
+
+    def _use_map_reduce(self, form_data: Dict[str, Any]) -> bool:
+        """长周期计划是否改用分层拆解"""
+        return (
+            self.breakdown_mode == "map_reduce"
+            and self._plan_horizon(form_data)["weeks_count"] >= self.map_reduce_min_weeks
+        )
+
+    def _agent_breakdown_map_reduce(self, form_data: Dict[str, Any], analysis: Dict[str, str], emit=None) -> Dict[str, Any] | None:
+        """分层拆解：一次调用生成月/周骨架，再按月并行展开日任务，最后合并为完整计划
+
+        单次输出的长度只与一个月的日任务有关，不再随计划周期增长而触及 max_tokens。
+        某个月展开失败时该月只保留月/周目标；骨架无法解析时返回 None，由调用方改为一次生成。
+        """
+        import concurrent.futures
+        from datetime import datetime
+
+        try:
+            response = self._call_llm(
+                self._skeleton_messages(form_data, analysis),
+                temperature=0.7,
+                model=self.model_generation,
+                response_model=BreakdownSkeleton,
+                agent="breakdown_skeleton",
+                weeks=self._plan_horizon(form_data)["weeks_count"]
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认任务结构", e)
+            return self._get_fallback_tasks(form_data)
+
+        skeleton = self._parse_skeleton(response)
+        if skeleton is None:
+            logger.warning("月/周骨架无法解析，改为一次生成完整计划")
+            return None
+        groups = self._month_groups(skeleton)
+        logger.info("分层拆解: 骨架完成", extra={"months": len(skeleton["monthly"]), "weeks": len(skeleton["weekly"])})
+
+        current_date = datetime.now()
+        converted = self._convert_agent6_format({"monthly": skeleton["monthly"], "weekly": skeleton["weekly"]})
+        converted["daily"] = {}
+        if emit is not None:
+            for section in ("monthly", "weekly"):
+                for key, entry_tasks in converted[section].items():
+                    emit({"level": section, "key": key, "tasks": entry_tasks})
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.map_concurrency, len(groups))) as executor:
+            futures = {
+                executor.submit(self._expand_month, form_data, analysis, skeleton, month_key, week_keys): month_key
+                for month_key, week_keys in groups
+            }
+            daily = {}
+            for future in concurrent.futures.as_completed(futures):
+                month_key = futures[future]
+                try:
+                    month_daily = future.result()
+                except Exception as e:
+                    logger.warning("%s 的日任务展开失败，只保留月/周目标: %s", month_key, e)
+                    continue
+                for week_key, days in month_daily.items():
+                    converted_entry = self._convert_agent6_entry("daily", week_key, days, current_date)
+                    if converted_entry is None:
+                        continue
+                    daily[converted_entry[0]] = converted_entry[1]
+                    if emit is not None:
+                        emit({"level": "daily", "key": converted_entry[0], "tasks": converted_entry[1]})
+
+        # 按周次排序，与一次生成的结果顺序一致
+        converted["daily"] = dict(sorted(daily.items(), key=lambda item: week_number(item[0]) or 0))
+        logger.info("分层拆解完成", extra={"months": len(groups), "weeks_with_days": len(daily)})
+        return converted
+
+    def _skeleton_messages(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> List[Dict[str, str]]:
+        """分层拆解第一步：只生成月度和周度目标"""
+        horizon = self._plan_horizon(form_data)
+        start_date = horizon["start_date"]
+        prompt = f"""请将下面的需求拆解成月度→周度的任务骨架（日任务稍后按月单独生成，这里不要输出 daily）。
+
+## 输出要求
+1. 周次从"第1周"开始连续编号到时间约束中的总周数，每个月包含4周（最后一个月可以少于4周）
+2. monthly 中每个月的 weeks 列出该月包含的周次
+3. weekly 中每周给出目标、明确产出（必须用"产出："开头）和重点领域
+4. 任务从简单到复杂，循序渐进
+
+严格按照以下JSON格式输出，不要有其他文字：
+{{"project_name": "项目名称", "overview": "项目概述", "monthly": {{"第1个月": {{"goal": "...", "output": "...", "weeks": ["第1周", "第2周", "第3周", "第4周"]}}}}, "weekly": {{"第1周": {{"goal": "...", "output": "产出：...", "focus": "..."}}}}}}
+
+## 用户需求
+{form_data.get('goal', '')}
+
+## 时间约束
+- 每天可用时间：{form_data.get('daily_hours', '1')} 小时
+- 总周期：{horizon['weeks_count']} 周（第1周到第{horizon['weeks_count']}周，约 {horizon['months_count']} 个月）
+- 开始日期：{start_date.year}年{start_date.month}月{start_date.day}日
+
+## AI分析结果
+- 任务类型：{analysis.get('task_type', '')}
+- 经验水平：{analysis.get('experience_level', '')}
+- 时间跨度：{analysis.get('time_span', '')}"""
+        return [{"role": "user", "content": prompt}]
+
+    def _parse_skeleton(self, response: str) -> Dict[str, Any] | None:
+        """解析月/周骨架，monthly 或 weekly 为空时返回 None"""
+        result = self._loads_json_output(response)
+        if not result or not isinstance(result.get("monthly"), dict) or not isinstance(result.get("weekly"), dict):
+            return None
+        weekly = {key: value for key, value in result["weekly"].items() if week_number(key) is not None}
+        if not result["monthly"] or not weekly:
+            return None
+        result["weekly"] = weekly
+        return result
+
+    def _month_groups(self, skeleton: Dict[str, Any]) -> List[tuple]:
+        """每个月包含的周：优先使用骨架中月份列出的 weeks，未列出的周按每月4周归入对应月份"""
+        week_keys = {week_number(key): key for key in skeleton["weekly"]}
+        months = list(skeleton["monthly"].items())
+        groups = {month_key: [] for month_key, _ in months}
+        assigned = set()
+        for month_key, month in months:
+            listed = month.get("weeks", []) if isinstance(month, dict) else []
+            for week in listed:
+                number = week_number(str(week))
+                if number in week_keys and number not in assigned:
+                    groups[month_key].append(week_keys[number])
+                    assigned.add(number)
+
+        month_by_number = {month_number(month_key): month_key for month_key, _ in months}
+        for number in sorted(set(week_keys) - assigned):
+            month_key = month_by_number.get(month_of_week(number)) or months[-1][0]
+            groups[month_key].append(week_keys[number])
+
+        return [
+            (month_key, sorted(keys, key=week_number))
+            for month_key, keys in groups.items() if keys
+        ]
+
+    def _month_messages(
+        self,
+        form_data: Dict[str, Any],
+        analysis: Dict[str, str],
+        skeleton: Dict[str, Any],
+        month_key: str,
+        week_keys: List[str]
+    ) -> List[Dict[str, str]]:
+        """分层拆解第二步：展开一个月内各周的日任务"""
+        month = skeleton["monthly"].get(month_key) or {}
+        weeks_text = "\n".join(
+            f"- {key}: {skeleton['weekly'][key].get('goal', '')}（{skeleton['weekly'][key].get('output', '')}）"
+            for key in week_keys
+        )
+        # 固定的要求在前，同一计划各月共享的整体计划居中，只属于本月的内容在最后：
+        # 并行展开各月时，除最后一段外的提示都可被上游的前缀缓存复用
+        prompt = f"""请为下面计划中指定的月份生成每天的任务。
+
+## 输出要求
+1. 只输出 daily，包含且只包含最后列出的需要展开的周，周次名称保持一致
+2. 每周 Day1-Day7，每天1小时内能完成的具体操作，每步都有产出
+3. 每周最后一天设为"机动"日，用于查漏补缺
+
+严格按照以下JSON格式输出，不要有其他文字：
+{{"daily": {{"第N周": {{"Day1": {{"title": "...", "description": "...", "hours": 1, "output": "产出：..."}}}}}}}}
+
+## 用户需求
+{form_data.get('goal', '')}
+
+## 时间约束
+- 每天可用时间：{form_data.get('daily_hours', '1')} 小时
+
+## AI分析结果
+- 任务类型：{analysis.get('task_type', '')}
+- 经验水平：{analysis.get('experience_level', '')}
+
+## 整体计划
+{plan_outline(skeleton)}
+
+## 本次展开：{month_key}
+- 目标：{month.get('goal', '') if isinstance(month, dict) else month}
+- 产出：{month.get('output', '') if isinstance(month, dict) else ''}
+
+## 需要展开的周
+{weeks_text}"""
+        return [
+            {"role": "system", "content": self._get_breakdown_system_prompt()},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _expand_month(
+        self,
+        form_data: Dict[str, Any],
+        analysis: Dict[str, str],
+        skeleton: Dict[str, Any],
+        month_key: str,
+        week_keys: List[str]
+    ) -> Dict[str, Any]:
+        """展开一个月的日任务，返回 Agent6 格式的 daily（只保留该月的周）"""
         response = self._call_llm(
-            [{"role": "system", "content": self._get_breakdown_system_prompt()},
-             {"role": "user", "content": prompt}],
+            self._month_messages(form_data, analysis, skeleton, month_key, week_keys),
             temperature=0.7,
-            model=self.model_generation
+            model=self.model_generation,
+            response_model=BreakdownResult,
+            agent="breakdown_month",
+            weeks=len(week_keys)
         )
-        return self._parse_breakdown_response(response, form_data)
+        return self._month_daily(response, week_keys)
+
+    def _month_daily(self, response: str, week_keys: List[str]) -> Dict[str, Any]:
+        """从一个月的展开结果中取出指定周的日任务"""
+        result = self._loads_json_output(response)
+        if result is None or not isinstance(result.get("daily"), dict):
+            raise ValueError("日任务输出无法解析")
+        wanted = {week_number(key): key for key in week_keys}
+        daily = {}
+        for key, days in result["daily"].items():
+            number = week_number(key)
+            if number in wanted and wanted[number] not in daily:
+                daily[wanted[number]] = days
+        if not daily:
+            raise ValueError("日任务输出不包含该月的周")
+        return daily
+
+    def _breakdown_messages(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> List[Dict[str, str]]:
+        """Agent 6 的消息列表（系统提示 + 用户提示）"""
+        return [
+            {"role": "system", "content": self._get_breakdown_system_prompt()},
+            {"role": "user", "content": self._build_breakdown_prompt(form_data, analysis)}
+        ]
 
     def _get_breakdown_system_prompt(self) -> str:
         """Agent 6 任务拆解系统提示"""
@@ -545,14 +1278,12 @@ class AIService:
 
 只返回JSON，不要有任何其他文字。"""
 
-    def _build_breakdown_prompt(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> str:
-        """构建任务拆解的用户提示"""
+    def _plan_horizon(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
+        """计划的时间范围：开始日期、截止日期、剩余天数、周数和月数（无截止日期或日期无效时按 30 天计算）"""
         from datetime import datetime, timedelta
 
-        # 计算日期范围
         start_date = datetime.now()
         deadline = form_data.get('deadline')
-        daily_hours = form_data.get('daily_hours', '1')
 
         if deadline:
             try:
@@ -571,6 +1302,25 @@ class AIService:
             months_count = 1
             deadline_date = start_date + timedelta(days=30)
 
+        return {
+            "start_date": start_date,
+            "deadline_date": deadline_date,
+            "days_left": days_left,
+            "weeks_count": weeks_count,
+            "months_count": months_count,
+        }
+
+    def _build_breakdown_prompt(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> str:
+        """构建任务拆解的用户提示"""
+        from datetime import timedelta
+
+        # 计算日期范围
+        horizon = self._plan_horizon(form_data)
+        start_date = horizon["start_date"]
+        days_left = horizon["days_left"]
+        weeks_count = horizon["weeks_count"]
+        daily_hours = form_data.get('daily_hours', '1')
+
         # 生成日期示例
         date_examples = []
         current = start_date
@@ -578,7 +1328,16 @@ class AIService:
             date_examples.append(f"Day{i+1}: {current.month}月{current.day}日")
             current += timedelta(days=1)
 
-        prompt = f"""请将以下需求拆解成详细的月度→周度→日度任务计划：
+        # 固定的要求在前、每次请求不同的用户数据和日期在后，使系统提示 + 本段开头在请求之间逐字节相同，
+        # 可被上游的前缀缓存复用
+        prompt = f"""请将下面的需求拆解成详细的月度→周度→日度任务计划。
+
+## 拆解要求
+1. **月度任务**：描述整体目标和最终产出
+2. **周度任务**：每周目标 + 明确产出（必须用"产出："开头）
+3. **日度任务**：每天1小时内能完成的具体操作，每步都有产出
+4. **每周最后一天**：设为"机动"日，用于查漏补缺
+5. **任务递进**：从简单到复杂，循序渐进
 
 ## 用户需求
 {form_data.get('goal', '')}
@@ -596,23 +1355,22 @@ class AIService:
 - 经验水平：{analysis.get('experience_level', '')}
 - 时间跨度：{analysis.get('time_span', '')}
 
-## 拆解要求
-1. **月度任务**：描述整体目标和最终产出
-2. **周度任务**：每周目标 + 明确产出（必须用"产出："开头）
-3. **日度任务**：每天1小时内能完成的具体操作，每步都有产出
-4. **每周最后一天**：设为"机动"日，用于查漏补缺
-5. **任务递进**：从简单到复杂，循序渐进
-
 请严格按照JSON格式输出，不要有其他文字。"""
         return prompt
 
     def _parse_breakdown_response(self, response: str, form_data: Dict[str, Any]) -> Dict[str, Any]:
         """解析任务拆解响应"""
-        print(f"\n[DEBUG] ============ 解析任务拆解响应 ============")
-        print(f"[DEBUG] 响应长度: {len(response)} 字符")
+        logger.debug("============ 解析任务拆解响应 ============")
+        logger.debug("响应长度: %s 字符", len(response))
 
         # 打印原始响应的前500个字符用于调试
-        print(f"[DEBUG] 响应内容预览: {response[:500]}")
+        logger.debug("响应内容预览: %s", response[:500])
+
+        # 快速路径：结构化输出时响应本身就是 JSON，跳过代码块提取和截断修复
+        result = loads_json_object(response)
+        if result is not None and any(result.get(level) for level in ("monthly", "weekly", "daily")):
+            logger.debug("响应为完整 JSON，直接转换")
+            return self._convert_agent6_format(result)
 
         response = response.strip()
 
@@ -623,77 +1381,77 @@ class AIService:
             end = response.find("```", start)
             if end != -1:
                 response = response[start:end].strip()
-                print(f"[DEBUG] 提取了 ```json 代码块，长度: {len(response)}")
+                logger.debug("提取了 ```json 代码块，长度: %s", len(response))
             else:
                 # 没有找到结束标记，可能是响应被截断
                 response = response[start:].strip()
-                print(f"[DEBUG] 提取了 ```json 代码块（无结束标记，响应可能被截断），长度: {len(response)}")
+                logger.debug("提取了 ```json 代码块（无结束标记，响应可能被截断），长度: %s", len(response))
         elif "```" in response:
             start = response.find("```") + 3
             end = response.find("```", start)
             if end != -1:
                 response = response[start:end].strip()
-                print(f"[DEBUG] 提取了 ``` 代码块")
+                logger.debug("提取了 ``` 代码块")
             else:
                 response = response[start:].strip()
-                print(f"[DEBUG] 提取了 ``` 代码块（无结束标记），长度: {len(response)}")
+                logger.debug("提取了 ``` 代码块（无结束标记），长度: %s", len(response))
 
         # 如果响应过短，可能解析会失败
         if len(response) < 100:
-            print(f"[WARNING] 提取后的响应过短: {len(response)} 字符")
-            print(f"[DEBUG] 响应内容: {response}")
-            print(f"[DEBUG] 使用 fallback 任务结构")
+            logger.warning("提取后的响应过短: %s 字符", len(response))
+            logger.debug("响应内容: %s", response)
+            logger.debug("使用 fallback 任务结构")
             return self._get_fallback_tasks(form_data)
 
         # 尝试修复截断的JSON
         try:
             result = json.loads(response)
         except json.JSONDecodeError as e:
-            print(f"[WARNING] JSON解析失败，尝试修复截断的JSON: {e}")
-            # 尝试修复：统计未闭合的括号并补全
+            logger.warning("JSON解析失败，尝试修复截断的JSON: %s", e)
+            # 尝试修复：单次扫描补齐未闭合的字符串和括号
             response_fixed = self._fix_truncated_json(response)
             if response_fixed:
                 try:
                     result = json.loads(response_fixed)
-                    print(f"[DEBUG] JSON修复成功")
+                    logger.debug("JSON修复成功")
                 except:
-                    print(f"[DEBUG] JSON修复失败，使用 fallback")
+                    logger.debug("JSON修复失败，使用 fallback")
                     return self._get_fallback_tasks(form_data)
             else:
-                print(f"[DEBUG] 无法修复截断的JSON，使用 fallback")
+                logger.debug("无法修复截断的JSON，使用 fallback")
                 return self._get_fallback_tasks(form_data)
 
         # 解析成功，打印调试信息并转换
-        print(f"[DEBUG] JSON解析成功，keys: {list(result.keys()) if isinstance(result, dict) else type(result)}")
+        logger.debug("JSON解析成功，keys: %s", list(result.keys()) if isinstance(result, dict) else type(result))
 
         # 打印monthly/weekly/daily的内容
         if isinstance(result, dict):
             if 'monthly' in result:
-                print(f"[DEBUG] monthly keys: {list(result.get('monthly', {}).keys())}")
+                logger.debug("monthly keys: %s", list(result.get('monthly', {}).keys()))
             if 'weekly' in result:
-                print(f"[DEBUG] weekly keys: {list(result.get('weekly', {}).keys())}")
+                logger.debug("weekly keys: %s", list(result.get('weekly', {}).keys()))
             if 'daily' in result:
-                print(f"[DEBUG] daily keys: {list(result.get('daily', {}).keys())}")
+                logger.debug("daily keys: %s", list(result.get('daily', {}).keys()))
 
         # 将Agent6格式转换为前端期望的格式
-        print(f"[DEBUG] 开始转换 Agent6 格式...")
+        logger.debug("开始转换 Agent6 格式...")
         converted = self._convert_agent6_format(result)
-        print(f"[DEBUG] _parse_breakdown_response 转换后的daily keys: {list(converted.get('daily', {}).keys())}")
-        print(f"[DEBUG] _parse_breakdown_response 转换后的weekly keys: {list(converted.get('weekly', {}).keys())}")
-        print(f"[DEBUG] _parse_breakdown_response 转换后的monthly keys: {list(converted.get('monthly', {}).keys())}")
-        print(f"[DEBUG] ============ 解析完成 ============\n")
+        logger.debug("_parse_breakdown_response 转换后的daily keys: %s", list(converted.get('daily', {}).keys()))
+        logger.debug("_parse_breakdown_response 转换后的weekly keys: %s", list(converted.get('weekly', {}).keys()))
+        logger.debug("_parse_breakdown_response 转换后的monthly keys: %s", list(converted.get('monthly', {}).keys()))
+        logger.debug("============ 解析完成 ============")
         return converted
 
     def _convert_agent6_format(self, agent6_result: Dict[str, Any]) -> Dict[str, Any]:
         """将Agent6格式转换为前端期望的嵌套格式"""
-        from datetime import datetime, timedelta
+        from datetime import datetime
 
-        print(f"[DEBUG] _convert_agent6_format 输入keys: {list(agent6_result.keys())}")
-        print(f"[DEBUG] _convert_agent6_format 输入内容: {str(agent6_result)[:1000]}")
+        logger.debug("_convert_agent6_format 输入keys: %s", list(agent6_result.keys()))
+        logger.debug("_convert_agent6_format 输入内容: %.1000s", agent6_result)
 
         # 如果已经是前端格式，直接返回
         if all(key in agent6_result for key in ['yearly', 'quarterly', 'monthly', 'weekly', 'daily']):
-            print(f"[DEBUG] 检测到前端格式，直接返回")
+            logger.debug("检测到前端格式，直接返回")
             return agent6_result
 
         converted = {
@@ -704,127 +1462,21 @@ class AIService:
             "daily": {}
         }
 
-        # 处理monthly
-        monthly = agent6_result.get('monthly', {})
-        print(f"[DEBUG] monthly类型: {type(monthly)}, 内容: {str(monthly)[:200]}")
-        if isinstance(monthly, dict):
-            for month_key, month_info in monthly.items():
-                # 生成月度任务列表
-                if isinstance(month_info, dict):
-                    title = month_info.get('goal', month_key)
-                    description = month_info.get('output', '')
-                elif isinstance(month_info, list):
-                    # 已经是前端格式列表
-                    converted["monthly"][month_key] = month_info
-                    continue
-                else:
-                    title = str(month_info)
-                    description = ''
-                month_tasks = [{
-                    "id": f"m-{month_key}",
-                    "title": title,
-                    "description": description,
-                    "estimated_hours": 40
-                }]
-                converted["monthly"][month_key] = month_tasks
-
-        # 处理weekly
-        weekly = agent6_result.get('weekly', {})
-        print(f"[DEBUG] weekly类型: {type(weekly)}, 内容: {str(weekly)[:200]}")
-        if isinstance(weekly, dict):
-            for week_key, week_info in weekly.items():
-                if isinstance(week_info, dict):
-                    title = week_info.get('goal', week_key)
-                    description = week_info.get('output', '')
-                elif isinstance(week_info, list):
-                    # 已经是前端格式列表
-                    converted["weekly"][week_key] = week_info
-                    continue
-                else:
-                    title = str(week_info)
-                    description = ''
-                week_tasks = [{
-                    "id": f"w-{week_key}",
-                    "title": title,
-                    "description": description,
-                    "estimated_hours": 10
-                }]
-                converted["weekly"][week_key] = week_tasks
-
-        # 处理daily - 转换为嵌套结构
-        daily = agent6_result.get('daily', {})
-        print(f"[DEBUG] daily类型: {type(daily)}, 内容: {str(daily)[:300]}")
         current_date = datetime.now()
-
-        if isinstance(daily, dict):
-            for week_key, week_days in daily.items():
-                # 提取周数，如"第1周" -> 1
-                week_num = 1
-                for num in range(1, 10):
-                    if f"第{num}周" in week_key:
-                        week_num = num
-                        break
-
-                # 创建周级别的daily结构
-                week_daily_data = {}
-                day_offset = 0
-
-                if isinstance(week_days, dict):
-                    for day_key, day_task in week_days.items():
-                        # 计算实际日期
-                        target_date = current_date + timedelta(days=(week_num - 1) * 7 + day_offset)
-                        date_str = f"{target_date.month}月{target_date.day}日"
-
-                        # 转换任务格式
-                        if isinstance(day_task, dict):
-                            task_list = [{
-                                "id": f"d-{week_key}-{day_key}",
-                                "title": day_task.get('title', ''),
-                                "description": day_task.get('description', ''),
-                                "output": day_task.get('output', ''),
-                                "estimated_hours": day_task.get('hours', 1)
-                            }]
-                        elif isinstance(day_task, list):
-                            # 已经是前端格式列表
-                            task_list = day_task
-                        else:
-                            task_list = [{
-                                "id": f"d-{week_key}-{day_key}",
-                                "title": str(day_task),
-                                "description": '',
-                                "output": '',
-                                "estimated_hours": 1
-                            }]
-
-                        week_daily_data[date_str] = task_list
-                        day_offset += 1
-
-                    # 使用"第X个月-第X周"作为key
-                    month_num = (week_num - 1) // 4 + 1
-                    nested_key = f"第{month_num}个月-第{week_num}周"
-                    converted["daily"][nested_key] = week_daily_data
-                elif isinstance(week_days, list):
-                    # 已经是前端格式的列表结构 {"第1天": [tasks]}
-                    # 需要转换为嵌套结构
-                    week_daily_data = {}
-                    day_idx = 0
-                    for day_task in week_days:
-                        target_date = current_date + timedelta(days=(week_num - 1) * 7 + day_idx)
-                        date_str = f"{target_date.month}月{target_date.day}日"
-                        if isinstance(day_task, list):
-                            week_daily_data[date_str] = day_task
-                        else:
-                            week_daily_data[date_str] = [day_task]
-                        day_idx += 1
-
-                    month_num = (week_num - 1) // 4 + 1
-                    nested_key = f"第{month_num}个月-第{week_num}周"
-                    converted["daily"][nested_key] = week_daily_data
-
-        print(f"[DEBUG] _convert_agent6_format 转换完成")
-        print(f"[DEBUG] 转换后的monthly: {list(converted['monthly'].keys())}")
-        print(f"[DEBUG] 转换后的weekly: {list(converted['weekly'].keys())}")
-        print(f"[DEBUG] 转换后的daily: {list(converted['daily'].keys())}")
+        for section in ("monthly", "weekly", "daily"):
+            entries = agent6_result.get(section, {})
+            logger.debug("%s类型: %s, 内容: %.200s", section, type(entries), entries)
+            if not isinstance(entries, dict):
+                continue
+            for entry_key, entry_value in entries.items():
+                converted_entry = self._convert_agent6_entry(section, entry_key, entry_value, current_date)
+                if converted_entry is not None:
+                    converted[section][converted_entry[0]] = converted_entry[1]
+
+        logger.debug("_convert_agent6_format 转换完成")
+        logger.debug("转换后的monthly: %s", list(converted['monthly'].keys()))
+        logger.debug("转换后的weekly: %s", list(converted['weekly'].keys()))
+        logger.debug("转换后的daily: %s", list(converted['daily'].keys()))
 
         # 检查是否有实际内容，如果没有则返回None表示需要fallback
         has_content = (
@@ -834,77 +1486,95 @@ class AIService:
         )
 
         if not has_content:
-            print(f"[ERROR] _convert_agent6_format 转换后无内容")
+            logger.error("_convert_agent6_format 转换后无内容")
             raise ValueError("转换后的任务结构为空，无法生成有效任务")
 
         return converted
 
-    def _fix_truncated_json(self, json_str: str) -> str:
-        """尝试修复截断的JSON字符串"""
-        if not json_str or len(json_str.strip()) < 10:
-            return None
-
-        json_str = json_str.strip()
-
-        # 统计括号，补全未闭合的部分
-        open_braces = json_str.count('{') - json_str.count('}')
-        open_brackets = json_str.count('[') - json_str.count(']')
+    def _convert_agent6_entry(self, section: str, entry_key: str, entry_value: Any, current_date) -> tuple | None:
+        """转换 Agent6 结果中 monthly/weekly/daily 的单个条目
 
-        if open_braces > 0 or open_brackets > 0:
-            print(f"[DEBUG] 检测到截断的JSON: 缺少 {open_braces} 个 }} 和 {open_brackets} 个 ]")
-            # 补全括号
-            fixed = json_str + '}' * open_braces + ']' * open_brackets
-            try:
-                json.loads(fixed)
-                print(f"[DEBUG] JSON修复成功，补全了 {open_braces} 个 }} 和 {open_brackets} 个 ]")
-                return fixed
-            except:
-                pass
+        Returns:
+            (前端使用的 key, 任务数据)；无法转换的条目返回 None
+        """
+        from datetime import timedelta
+
+        if section in ("monthly", "weekly"):
+            if isinstance(entry_value, list):
+                # 已经是前端格式列表
+                return entry_key, entry_value
+            if isinstance(entry_value, dict):
+                title = entry_value.get('goal', entry_key)
+                description = entry_value.get('output', '')
+            else:
+                title = str(entry_value)
+                description = ''
+            prefix, hours = ("m", 40) if section == "monthly" else ("w", 10)
+            return entry_key, [{
+                "id": f"{prefix}-{entry_key}",
+                "title": title,
+                "description": description,
+                "estimated_hours": hours
+            }]
+
+        # daily - 转换为嵌套结构
+        # 提取周数，如"第1周" -> 1、"第12周" -> 12
+        week_key, week_days = entry_key, entry_value
+        week_num = week_number(week_key) or 1
+
+        # 创建周级别的daily结构
+        week_daily_data = {}
+        if isinstance(week_days, dict):
+            for day_offset, (day_key, day_task) in enumerate(week_days.items()):
+                # 计算实际日期
+                target_date = current_date + timedelta(days=(week_num - 1) * 7 + day_offset)
+                date_str = f"{target_date.month}月{target_date.day}日"
+
+                # 转换任务格式
+                if isinstance(day_task, dict):
+                    task_list = [{
+                        "id": f"d-{week_key}-{day_key}",
+                        "title": day_task.get('title', ''),
+                        "description": day_task.get('description', ''),
+                        "output": day_task.get('output', ''),
+                        "estimated_hours": day_task.get('hours', 1)
+                    }]
+                elif isinstance(day_task, list):
+                    # 已经是前端格式列表
+                    task_list = day_task
+                else:
+                    task_list = [{
+                        "id": f"d-{week_key}-{day_key}",
+                        "title": str(day_task),
+                        "description": '',
+                        "output": '',
+                        "estimated_hours": 1
+                    }]
+                week_daily_data[date_str] = task_list
+        elif isinstance(week_days, list):
+            # 已经是前端格式的列表结构 {"第1天": [tasks]}，需要转换为嵌套结构
+            for day_idx, day_task in enumerate(week_days):
+                target_date = current_date + timedelta(days=(week_num - 1) * 7 + day_idx)
+                date_str = f"{target_date.month}月{target_date.day}日"
+                week_daily_data[date_str] = day_task if isinstance(day_task, list) else [day_task]
+        else:
+            return None
 
-        # 如果直接修复失败，尝试找到最后一个完整的对象
-        # 找到所有完整的顶层键
-        lines = json_str.split('\n')
-        fixed_lines = []
-        depth = 0
-        in_string = False
-        escape_next = False
-
-        for line in lines:
-            i = 0
-            while i < len(line):
-                char = line[i]
-                if escape_next:
-                    escape_next = False
-                elif char == '\\' and in_string:
-                    escape_next = True
-                elif char == '"' and not escape_next:
-                    in_string = not in_string
-                elif not in_string:
-                    if char == '{' or char == '[':
-                        depth += 1
-                    elif char == '}' or char == ']':
-                        depth -= 1
-                i += 1
-            fixed_lines.append(line)
-            # 当回到顶层且遇到闭合括号时停止
-            if depth == 0 and ('}' in line or ']' in line):
-                # 检查这行是否是顶层闭合
-                if line.rstrip().endswith('}') or line.rstrip().endswith(']'):
-                    break
-
-        fixed = '\n'.join(fixed_lines)
-        # 确保以正确的括号结束
-        if not fixed.rstrip().endswith('}'):
-            fixed += '\n}'
+        # 使用"第X个月-第X周"作为key
+        return f"第{month_of_week(week_num)}个月-第{week_num}周", week_daily_data
 
-        try:
-            json.loads(fixed)
-            print(f"[DEBUG] JSON截断修复成功")
-            return fixed
-        except:
-            print(f"[DEBUG] 无法修复截断的JSON")
+    def _fix_truncated_json(self, json_str: str) -> str:
+        """尝试修复截断的JSON字符串（单次扫描，见 services/json_repair.py）"""
+        if not json_str or len(json_str.strip()) < 10:
             return None
 
+        fixed = repair_json(json_str.strip())
+        if fixed is None:
+            logger.debug("无法修复截断的JSON")
+        else:
+            logger.debug("截断JSON已修复: 保留 %s/%s 字符", len(fixed), len(json_str))
+        return fixed
+
     def _get_fallback_tasks(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
         """备用任务结构"""
         daily_hours = float(form_data.get('daily_hours', 2))
@@ -1202,7 +1872,8 @@ class AIService:
         answers: Dict[str, Any],
         previous_tasks: Dict[str, Any],
         analysis: Dict[str, str] = None,
-        previous_questions: list = None
+        previous_questions: list = None,
+        previous_answers: Dict[str, Any] = None
     ) -> Dict[str, Any]:
         """根据补充问题的答案重新生成任务（基于已有任务结构进行优化）
 
@@ -1212,11 +1883,56 @@ class AIService:
             previous_tasks: 之前的任务结构
             analysis: AI分析结果
             previous_questions: 之前生成的补充问题列表（用于避免重复）
+            previous_answers: 上次重新生成时已有的答案（delta/patch 模式下只按变化的答案调整计划）
 
         Returns:
             包含新任务和新补充问题的字典
         """
+        tasks = None
+        if self.regenerate_mode in ("delta", "patch"):
+            changed = {
+                key: value for key, value in answers.items()
+                if value and (previous_answers or {}).get(key) != value
+            }
+            regenerate = self._regenerate_delta if self.regenerate_mode == "delta" else self._regenerate_patch
+            try:
+                tasks = regenerate(form_data, changed, previous_tasks, analysis, previous_questions)
+            except CircuitOpenError as e:
+                logger.warning("%s，保留原有任务计划", e)
+                tasks = previous_tasks
+            except Exception as e:
+                # 影响范围判断、增量/补丁生成或合并出错时不向上抛出，回退到整体重新生成
+                logger.exception("%s 模式重新生成失败，回退到整体重新生成: %s", self.regenerate_mode, e)
+                tasks = None
+        if tasks is None:
+            tasks = self._regenerate_full(form_data, answers, previous_tasks, analysis)
 
+        # 重新生成补充问题（基于答案，避免重复之前的问题）
+        try:
+            new_questions = self._agent_questions(
+                form_data=form_data,
+                analysis=analysis or {},
+                previous_questions=previous_questions
+            )
+        except Exception as e:
+            logger.exception("重新生成补充问题失败: %s", e)
+            # 补充问题生成失败时，使用默认问题或空列表
+            new_questions = self._get_default_questions()
+
+        # 返回与 generate_task_breakdown 相同的结构
+        return {
+            "tasks": tasks,
+            "follow_up_questions": new_questions
+        }
+
+    def _regenerate_full(
+        self,
+        form_data: Dict[str, Any],
+        answers: Dict[str, Any],
+        previous_tasks: Dict[str, Any],
+        analysis: Dict[str, str] = None
+    ) -> Dict[str, Any]:
+        """整体重新生成：模型输出包含所有月、周、天的完整计划"""
         # 构建已有任务摘要
         monthly_summary = []
         monthly_tasks = previous_tasks.get('monthly', {})
@@ -1338,42 +2054,312 @@ class AIService:
 
 请严格按照上述JSON格式输出完整的任务计划，不要省略任何内容。"""
 
-        print(f"[DEBUG] regenerate_with_answers prompt 长度: {len(prompt)}")
+        logger.debug("regenerate_with_answers prompt 长度: %s", len(prompt))
+
+        try:
+            response = self._call_llm(
+                [{"role": "system", "content": self._get_breakdown_system_prompt()},
+                 {"role": "user", "content": prompt}],
+                temperature=0.7,
+                model=self.model_generation,
+                response_model=BreakdownResult,
+                agent="regenerate",
+                weeks=len(plan_weeks(previous_tasks)) or self._plan_horizon(form_data)["weeks_count"]
+            )
+        except CircuitOpenError as e:
+            # 熔断期间保留原有计划，而不是用默认结构覆盖
+            logger.warning("%s，保留原有任务计划", e)
+            tasks = previous_tasks
+        else:
+            logger.debug("regenerate_with_answers LLM 响应长度: %s", len(response) if response else 0)
+            if not response or len(response.strip()) < 100:
+                logger.warning("regenerate_with_answers LLM 响应过短或为空!")
+                logger.debug("响应内容: %s", response)
+
+            # 解析任务
+            tasks = self._parse_breakdown_response(response, form_data)
+
+        return tasks
+
+    # ==================== 增量重新生成 ====================
+
+    def _regenerate_delta(
+        self,
+        form_data: Dict[str, Any],
+        changed_answers: Dict[str, Any],
+        previous_tasks: Dict[str, Any],
+        analysis: Dict[str, str] = None,
+        previous_questions: list = None
+    ) -> Dict[str, Any] | None:
+        """只重新生成补充信息影响到的周（及其所属月份），合并回原计划
+
+        Returns:
+            合并后的任务结构；无法增量生成（影响范围过大、判断或输出无法解析）时返回 None，由调用方整体重新生成
+        """
+        all_weeks = plan_weeks(previous_tasks)
+        if not all_weeks:
+            logger.info("原计划没有按周组织，改为整体重新生成")
+            return None
+        if not changed_answers:
+            logger.info("补充信息没有变化，保留原有任务计划")
+            return previous_tasks
+
+        answers_text = self._answers_text(changed_answers, previous_questions)
+        weeks = self._agent_regenerate_scope(form_data, answers_text, previous_tasks, all_weeks)
+        if weeks is None:
+            return None
+        if not weeks:
+            logger.info("补充信息不影响现有任务，保留原有任务计划")
+            return previous_tasks
+        if len(weeks) > self.regenerate_delta_max_ratio * len(all_weeks):
+            logger.info(
+                "补充信息影响 %s/%s 周，改为整体重新生成", len(weeks), len(all_weeks),
+                extra={"weeks": sorted(weeks)}
+            )
+            return None
 
         response = self._call_llm(
             [{"role": "system", "content": self._get_breakdown_system_prompt()},
-             {"role": "user", "content": prompt}],
+             {"role": "user", "content": self._delta_prompt(form_data, analysis, previous_tasks, answers_text, weeks)}],
             temperature=0.7,
-            model=self.model_generation
+            model=self.model_generation,
+            response_model=BreakdownResult,
+            agent="regenerate_delta",
+            weeks=len(weeks)
+        )
+        result = self._loads_json_output(response)
+        if result is None:
+            logger.warning("增量重新生成的输出无法解析，改为整体重新生成")
+            return None
+        try:
+            delta = self._convert_agent6_format(result)
+        except ValueError:
+            return None
+        returned = {week_number(key) for section in ("weekly", "daily") for key in delta[section]}
+        if not returned & weeks:
+            logger.warning("增量重新生成的输出不包含需要调整的周，改为整体重新生成")
+            return None
+
+        logger.info(
+            "增量重新生成完成",
+            extra={"weeks": sorted(weeks & returned), "total_weeks": len(all_weeks)}
         )
+        return merge_weeks(previous_tasks, delta, weeks)
 
-        print(f"[DEBUG] regenerate_with_answers LLM 响应长度: {len(response) if response else 0}")
-        if not response or len(response.strip()) < 100:
-            print(f"[WARNING] regenerate_with_answers LLM 响应过短或为空!")
-            print(f"[DEBUG] 响应内容: {response}")
+    def _regenerate_patch(
+        self,
+        form_data: Dict[str, Any],
+        changed_answers: Dict[str, Any],
+        previous_tasks: Dict[str, Any],
+        analysis: Dict[str, str] = None,
+        previous_questions: list = None
+    ) -> Dict[str, Any] | None:
+        """只让模型输出对已有任务的增删改操作（按任务 id），在本地校验后应用到原计划
 
-        # 解析任务
-        tasks = self._parse_breakdown_response(response, form_data)
+        Returns:
+            应用补丁后的任务结构；补丁无法解析或无法应用时返回 None，由调用方整体重新生成
+        """
+        listing = plan_listing(previous_tasks)
+        if not listing:
+            logger.info("原计划没有带 id 的任务，改为整体重新生成")
+            return None
+        if not changed_answers:
+            logger.info("补充信息没有变化，保留原有任务计划")
+            return previous_tasks
 
-        # 重新生成补充问题（基于答案，避免重复之前的问题）
+        answers_text = self._answers_text(changed_answers, previous_questions)
         try:
-            new_questions = self._agent_questions(
-                form_data=form_data,
-                analysis=analysis or {},
-                previous_questions=previous_questions
+            response = self._call_llm(
+                [{"role": "user", "content": self._patch_prompt(form_data, analysis, listing, answers_text)}],
+                temperature=0.5,
+                model=self.model_generation,
+                response_model=TaskPatch,
+                agent="regenerate_patch",
+                weeks=len(plan_weeks(previous_tasks)),
+                allow_truncated=False
             )
-        except Exception as e:
-            print(f"[ERROR] 重新生成补充问题失败: {e}")
-            import traceback
-            traceback.print_exc()
-            # 补充问题生成失败时，使用默认问题或空列表
-            new_questions = self._get_default_questions()
+        except OutputTruncatedError as e:
+            logger.warning("补丁输出被截断（%s），改为整体重新生成", e)
+            return None
+        # 严格解析：截断修复会留下前半部分的操作和被截断的字段值，补丁只能完整应用
+        result = self._loads_json_output(response, repair=False)
+        if result is None or not isinstance(result.get("ops"), list):
+            logger.warning("补丁输出无法解析，改为整体重新生成")
+            return None
+        try:
+            tasks = apply_patch(previous_tasks, result["ops"])
+        except PatchError as e:
+            logger.warning("补丁无法应用（%s），改为整体重新生成", e)
+            return None
 
-        # 返回与 generate_task_breakdown 相同的结构
-        return {
-            "tasks": tasks,
-            "follow_up_questions": new_questions
-        }
+        counts = {}
+        for op in result["ops"]:
+            counts[op["op"]] = counts.get(op["op"], 0) + 1
+        logger.info("补丁重新生成完成", extra={"ops": counts, "reason": result.get("reason", "")})
+        return tasks
+
+    def _patch_prompt(
+        self,
+        form_data: Dict[str, Any],
+        analysis: Dict[str, str],
+        listing: str,
+        answers_text: str
+    ) -> str:
+        """补丁式重新生成的提示：带 id 的完整任务清单作为上下文，只要求输出改动"""
+        return f"""请根据用户的补充信息调整已有任务计划。不要重新输出整个计划，只输出需要改动的任务。
+
+## 用户原始需求
+{form_data.get('goal', '')}
+
+## AI分析结果
+- 任务类型：{analysis.get('task_type', '') if analysis else ''}
+- 经验水平：{analysis.get('experience_level', '') if analysis else ''}
+- 时间跨度：{analysis.get('time_span', '') if analysis else ''}
+
+## 已有任务计划（每行：[任务id] 位置 | 标题 | 产出）
+{listing}
+
+## 用户补充信息
+{answers_text}
+
+## 输出要求
+只返回JSON，不要有其他文字：
+{{"ops": [
+  {{"op": "replace", "id": "w-第2周", "task": {{"title": "新标题", "description": "产出：新产出"}}}},
+  {{"op": "add", "after": "d-第2周-Day3", "task": {{"title": "任务标题", "description": "具体步骤", "estimated_hours": 1}}}},
+  {{"op": "remove", "id": "d-第3周-Day5"}}
+], "reason": "一句话说明改动"}}
+
+- replace 只给出需要修改的字段（title / description / output / estimated_hours），其余字段保持不变；月度和周度任务没有 output，产出写在 description 中
+- add 把新任务插入到 after 指定的任务之后（同一天/同一周/同一月）
+- id 和 after 必须是上面清单中已有的任务id，原样复制方括号内的内容
+- 只改动与补充信息相关的任务；补充信息与计划无关时返回 {{"ops": [], "reason": "..."}}"""
+
+    def _answers_text(self, answers: Dict[str, Any], questions: list = None) -> str:
+        """补充信息文本：能对应到问题时用问题原文代替问题 id"""
+        question_texts = {q.get("id"): q.get("question") for q in (questions or []) if isinstance(q, dict)}
+        lines = []
+        for key, value in answers.items():
+            if isinstance(value, list):
+                value = "、".join(str(v) for v in value)
+            lines.append(f"- {question_texts.get(key) or key}: {value}")
+        return "\n".join(lines)
+
+    def _agent_regenerate_scope(
+        self,
+        form_data: Dict[str, Any],
+        answers_text: str,
+        previous_tasks: Dict[str, Any],
+        all_weeks: List[int]
+    ) -> set | None:
+        """判断补充信息影响到哪些周（使用分析模型）；无法判断时返回 None"""
+        prompt = f"""请判断用户新提交的补充信息会影响已有任务计划中的哪些周。
+
+## 用户需求
+{form_data.get('goal', '')}
+
+## 已有任务计划
+{plan_outline(previous_tasks)}
+
+## 新的补充信息
+{answers_text}
+
+## 输出要求
+只返回JSON，不要有其他文字：
+{{"weeks": ["第2周", "第3周"], "reason": "一句话说明判断依据"}}
+
+- 只列出任务内容需要改变的周
+- 补充信息改变整体节奏、难度或方向时，列出所有周
+- 补充信息与已有计划无关时，weeks 返回空数组"""
+
+        response = self._call_llm(
+            [{"role": "user", "content": prompt}],
+            temperature=0.3,
+            model=self.model_analysis,
+            response_model=RegenerateScope,
+            agent="regenerate_scope"
+        )
+        result = self._loads_json_output(response)
+        if result is None or not isinstance(result.get("weeks"), list):
+            logger.warning("无法解析影响范围，改为整体重新生成")
+            return None
+
+        weeks = set()
+        for key in result["weeks"]:
+            number = week_number(str(key))
+            if number in all_weeks:
+                weeks.add(number)
+        logger.debug("补充信息影响的周: %s（%s）", sorted(weeks), result.get("reason", ""))
+        return weeks
+
+    def _delta_prompt(
+        self,
+        form_data: Dict[str, Any],
+        analysis: Dict[str, str],
+        previous_tasks: Dict[str, Any],
+        answers_text: str,
+        weeks: set
+    ) -> str:
+        """增量重新生成的用户提示：完整计划摘要作为上下文，只要求输出受影响的周和月"""
+        week_keys = [f"第{week}周" for week in sorted(weeks)]
+        month_keys = [f"第{month}个月" for month in sorted({month_of_week(week) for week in weeks})]
+        return f"""请根据用户的补充信息，只重新生成任务计划中受影响的部分：
+
+## 用户原始需求
+{form_data.get('goal', '')}
+
+## AI分析结果
+- 任务类型：{analysis.get('task_type', '') if analysis else ''}
+- 经验水平：{analysis.get('experience_level', '') if analysis else ''}
+- 时间跨度：{analysis.get('time_span', '') if analysis else ''}
+
+## 已有任务计划（其余部分保持不变）
+{plan_outline(previous_tasks)}
+
+## 用户补充信息
+{answers_text}
+
+## 需要重新生成的部分
+- 月度：{'、'.join(month_keys)}
+- 周度和日度：{'、'.join(week_keys)}
+
+## 输出要求
+1. 按系统提示中的JSON格式输出，但 monthly 只包含 {'、'.join(month_keys)}，weekly 和 daily 只包含 {'、'.join(week_keys)}
+2. 周次和月份的名称与上面列出的完全一致（如"第2周"），每周7天，最后一天为"机动"日
+3. 与前后未改动的周保持衔接，不要重复其他周已经安排的内容
+
+只返回JSON，不要有其他文字。"""
+
+    def _loads_json_output(self, response: str, repair: bool = True) -> Dict[str, Any] | None:
+        """解析模型输出的 JSON 对象（完整 JSON、代码块或被截断的 JSON），失败返回 None
+
+        repair 为 False 时只接受完整的 JSON（代码块也必须闭合），不修复被截断的输出。
+        """
+        result = loads_json_object(response)
+        if result is not None:
+            return result
+        if not response:
+            return None
+        text = response.strip()
+        if "```" in text:
+            start = text.find("\n", text.find("```")) + 1
+            end = text.find("```", start)
+            if end == -1 and not repair:
+                return None
+            text = text[start:end if end != -1 else len(text)].strip()
+        try:
+            result = json.loads(text)
+        except json.JSONDecodeError:
+            if not repair:
+                return None
+            fixed = self._fix_truncated_json(text)
+            if not fixed:
+                return None
+            try:
+                result = json.loads(fixed)
+            except json.JSONDecodeError:
+                return None
+        return result if isinstance(result, dict) else None
 
 
 # 单例
@@ -0,0 +1,353 @@
+"""
+AI 服务（asyncio 版）- 基于 AsyncOpenAI，用协程编排多个 Agent
+
+同步版每个进行中的 LLM 调用都占用一个线程；这里所有 Agent 在同一个事件循环中并发，
+单个进程即可承载大量同时进行的拆解请求。提示词、解析和本地规则全部复用 AIService，
+两个版本的输出格式完全一致。
+
+融合分析（ANALYSIS_MODE=fused）和流式拆解（LLM_STREAMING）目前只在同步版中提供。
+"""
+import asyncio
+import uuid
+from typing import Any, Dict, List
+
+from openai import APIConnectionError, APIError, RateLimitError
+
+from services.ai_service import AIService, get_ai_service
+from services.http_client import get_async_openai_client
+from services.llm_cache import make_cache_key
+from services.rate_limiter import backoff_delay
+from services.circuit_breaker import CircuitOpenError
+from services.structured_output import acreate_chat_completion
+from services.task_tree import week_number
+from models.schema import BreakdownResult, BreakdownSkeleton
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class AsyncAIService:
+    """AIService 的 asyncio 版本"""
+
+    def __init__(self, sync_service: AIService | None = None):
+        # 提示词、解析、本地规则和配置都来自同步版服务
+        self.sync = sync_service or get_ai_service()
+        self.cache = self.sync.cache
+        # 按请求内容合并并发的相同调用（与同步版共用统计）
+        self.single_flight = self.sync.single_flight
+        # 指定后固定使用该客户端（测试和压测注入替身）
+        self._client = None
+
+    @property
+    def client(self):
+        """当前事件循环的 AsyncOpenAI 客户端（连接绑定在事件循环上）"""
+        return self._client or get_async_openai_client()
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    async def _cache_get(self, key: str):
+        # 磁盘缓存的文件读写放到线程中执行，不阻塞事件循环
+        if self.cache.disk_dir:
+            return await asyncio.to_thread(self.cache.get, key)
+        return self.cache.get(key)
+
+    async def _cache_set(self, key: str, value: str):
+        if self.cache.disk_dir:
+            await asyncio.to_thread(self.cache.set, key, value)
+        else:
+            self.cache.set(key, value)
+
+    async def _call_llm(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        model: str | None = None,
+        max_retries: int = 3,
+        use_cache: bool = False,
+        response_model=None,
+        hedge: bool = False,
+        agent: str | None = None,
+        weeks: int = 0
+    ) -> str:
+        """调用 LLM（参数与 AIService._call_llm 相同）"""
+        if model is None:
+            model = self.sync.model_generation
+        budget = self.sync.token_budget.plan(agent, model, messages, weeks)
+
+        request_key = make_cache_key(model, messages, temperature, budget.max_tokens)
+        if use_cache:
+            cached = await self._cache_get(request_key)
+            if cached is not None:
+                return cached
+
+        async def fetch() -> str:
+            if hedge:
+                content = await self.sync.hedger.acall(
+                    model,
+                    lambda m: self._call_llm_upstream(messages, temperature, m, budget, max_retries, response_model, agent)
+                )
+            else:
+                content = await self._call_llm_upstream(messages, temperature, model, budget, max_retries, response_model, agent)
+            if use_cache:
+                await self._cache_set(request_key, content)
+            return content
+
+        return await self.single_flight.ado(request_key, fetch)
+
+    async def _call_llm_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        model: str,
+        budget,
+        max_retries: int,
+        response_model=None,
+        agent: str | None = None
+    ) -> str:
+        """实际请求上游模型（带重试，等待期间不占用线程；截断时的处理与同步版相同）"""
+        token_budget = self.sync.token_budget
+        last_error = None
+        for attempt in range(max_retries):
+            try:
+                response = await acreate_chat_completion(
+                    self.client,
+                    response_model=response_model,
+                    agent=agent,
+                    attempt=attempt + 1,
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=budget.max_tokens,
+                    timeout=budget.timeout,
+                )
+                finish_reason = getattr(response.choices[0], "finish_reason", None)
+                token_budget.record(agent, model, budget, getattr(response, "usage", None), finish_reason)
+                if finish_reason == "length" and budget.max_tokens < budget.cap and attempt < max_retries - 1:
+                    logger.warning("%s 的输出被截断，按上限 %s 重新请求", agent, budget.cap)
+                    budget = budget._replace(max_tokens=budget.cap, timeout=token_budget.default_limits(model)[1])
+                    continue
+                return response.choices[0].message.content
+            except CircuitOpenError:
+                raise
+            except RateLimitError as e:
+                last_error = e
+                logger.error("API 速率限制: %s", e)
+                # 限流器已按 Retry-After 暂停该模型，下一次尝试会在获取许可时等待
+                wait_time = 0
+            except (APIConnectionError, APIError) as e:
+                last_error = e
+                logger.error("API 错误 (尝试 %s/%s): %s", attempt + 1, max_retries, e)
+                wait_time = backoff_delay(attempt)
+            except Exception as e:
+                last_error = e
+                logger.error("未知错误 (尝试 %s/%s): %s - %s", attempt + 1, max_retries, type(e).__name__, e)
+                wait_time = backoff_delay(attempt)
+            if attempt < max_retries - 1 and wait_time:
+                await asyncio.sleep(wait_time)
+
+        logger.error("AI 调用失败：已重试 %s 次，仍然失败", max_retries)
+        raise RuntimeError(f"AI 调用失败: {str(last_error)}")
+
+    async def generate_task_breakdown(self, form_data: Dict[str, Any]) -> Dict[str, Any]:
+        """生成任务拆解，返回值与 AIService.generate_task_breakdown 相同
+
+        analysis ← Agent 1-3（gather 并发）
+        tasks / questions ← analysis（gather 并发；推测模式下 tasks 不等待 analysis）
+        """
+        analysis_task = asyncio.ensure_future(self._agent_analysis(form_data))
+
+        async def breakdown():
+            if self.sync.speculative_breakdown:
+                analysis = self.sync._local_analysis(form_data)
+            else:
+                analysis = await analysis_task
+            return await self._agent_breakdown(form_data, analysis)
+
+        async def questions():
+            return await self._agent_questions(form_data, await analysis_task)
+
+        pending = [analysis_task, asyncio.ensure_future(breakdown()), asyncio.ensure_future(questions())]
+        try:
+            analysis, tasks, questions_result = await asyncio.gather(*pending)
+        except BaseException:
+            # 任一 Agent 失败或请求被取消时，不再等待其余 Agent
+            for task in pending:
+                task.cancel()
+            raise
+
+        return {
+            "project_id": str(uuid.uuid4()),
+            "analysis": analysis,
+            "tasks": tasks,
+            "follow_up_questions": questions_result
+        }
+
+    # ==================== Agent 1-3 ====================
+
+    async def _agent_analysis(self, form_data: Dict[str, Any]) -> Dict[str, str]:
+        task_type, experience_level, time_span = await asyncio.gather(
+            self._agent_task_type(form_data),
+            self._agent_experience(form_data),
+            self._agent_time_span(form_data),
+        )
+        return {
+            "task_type": task_type,
+            "experience_level": experience_level,
+            "time_span": time_span
+        }
+
+    async def _agent_task_type(self, form_data: Dict[str, Any]) -> str:
+        try:
+            response = await self._call_llm(
+                [{"role": "user", "content": self.sync._task_type_prompt(form_data)}],
+                temperature=0.3,
+                model=self.sync.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="task_type"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，任务类型改用本地推导", e)
+            return self.sync._local_analysis(form_data)["task_type"]
+        return response.strip().split('\n')[0][:100]
+
+    async def _agent_experience(self, form_data: Dict[str, Any]) -> str:
+        try:
+            response = await self._call_llm(
+                [{"role": "user", "content": self.sync._experience_prompt(form_data)}],
+                temperature=0.3,
+                model=self.sync.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="experience_level"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，经验水平改用本地推导", e)
+            return self.sync._local_analysis(form_data)["experience_level"]
+        return response.strip().split('\n')[0][:100]
+
+    async def _agent_time_span(self, form_data: Dict[str, Any]) -> str:
+        """与 AIService._agent_time_span 相同：默认本地计算，按配置才调用模型"""
+        if self.sync.time_span_mode != "llm":
+            label, ambiguous = self.sync._local_time_span(form_data)
+            if not ambiguous or not self.sync.time_span_llm_fallback:
+                return label
+        try:
+            response = await self._call_llm(
+                [{"role": "user", "content": self.sync._time_span_prompt(form_data)}],
+                temperature=0.3,
+                model=self.sync.model_analysis,
+                use_cache=True,
+                hedge=True,
+                agent="time_span"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，时间跨度改用本地规则", e)
+            return self.sync._local_time_span(form_data)[0]
+        return response.strip().split('\n')[0][:100]
+
+    # ==================== Agent 4 / 6 ====================
+
+    async def _agent_questions(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> list:
+        prompt = self.sync._questions_prompt(form_data, analysis)
+        try:
+            response = await self._call_llm(
+                [{"role": "user", "content": prompt}],
+                temperature=0.7,
+                model=self.sync.model_generation,
+                agent="questions"
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认补充问题", e)
+            return self.sync._get_default_questions()
+        return self.sync._parse_questions_response(response)
+
+    async def _agent_breakdown(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> Dict[str, Any]:
+        if self.sync._use_map_reduce(form_data):
+            tasks = await self._agent_breakdown_map_reduce(form_data, analysis)
+            if tasks is not None:
+                return tasks
+        try:
+            response = await self._call_llm(
+                self.sync._breakdown_messages(form_data, analysis),
+                temperature=0.7,
+                model=self.sync.model_generation,
+                response_model=BreakdownResult,
+                agent="breakdown",
+                weeks=self.sync._plan_horizon(form_data)["weeks_count"]
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认任务结构", e)
+            return self.sync._get_fallback_tasks(form_data)
+        return self.sync._parse_breakdown_response(response, form_data)
+
+    async def _agent_breakdown_map_reduce(self, form_data: Dict[str, Any], analysis: Dict[str, str]) -> Dict[str, Any] | None:
+        """与 AIService._agent_breakdown_map_reduce 相同：骨架生成后各月的日任务并发展开"""
+        from datetime import datetime
+
+        try:
+            response = await self._call_llm(
+                self.sync._skeleton_messages(form_data, analysis),
+                temperature=0.7,
+                model=self.sync.model_generation,
+                response_model=BreakdownSkeleton,
+                agent="breakdown_skeleton",
+                weeks=self.sync._plan_horizon(form_data)["weeks_count"]
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认任务结构", e)
+            return self.sync._get_fallback_tasks(form_data)
+
+        skeleton = self.sync._parse_skeleton(response)
+        if skeleton is None:
+            logger.warning("月/周骨架无法解析，改为一次生成完整计划")
+            return None
+        groups = self.sync._month_groups(skeleton)
+        semaphore = asyncio.Semaphore(self.sync.map_concurrency)
+
+        async def expand(month_key: str, week_keys: list) -> Dict[str, Any]:
+            async with semaphore:
+                response = await self._call_llm(
+                    self.sync._month_messages(form_data, analysis, skeleton, month_key, week_keys),
+                    temperature=0.7,
+                    model=self.sync.model_generation,
+                    response_model=BreakdownResult,
+                    agent="breakdown_month",
+                    weeks=len(week_keys)
+                )
+            return self.sync._month_daily(response, week_keys)
+
+        results = await asyncio.gather(
+            *(expand(month_key, week_keys) for month_key, week_keys in groups),
+            return_exceptions=True
+        )
+
+        current_date = datetime.now()
+        converted = self.sync._convert_agent6_format({"monthly": skeleton["monthly"], "weekly": skeleton["weekly"]})
+        daily = {}
+        for (month_key, _), month_daily in zip(groups, results):
+            if isinstance(month_daily, BaseException):
+                if not isinstance(month_daily, Exception):
+                    raise month_daily
+                logger.warning("%s 的日任务展开失败，只保留月/周目标: %s", month_key, month_daily)
+                continue
+            for week_key, days in month_daily.items():
+                converted_entry = self.sync._convert_agent6_entry("daily", week_key, days, current_date)
+                if converted_entry is not None:
+                    daily[converted_entry[0]] = converted_entry[1]
+        converted["daily"] = dict(sorted(daily.items(), key=lambda item: week_number(item[0]) or 0))
+        return converted
+
+
+# 单例
+_async_ai_service = None
+
+
+def get_async_ai_service() -> AsyncAIService:
+    """获取 asyncio 版 AI 服务单例（需在事件循环所在线程中使用）"""
+    global _async_ai_service
+    if _async_ai_service is None:
+        _async_ai_service = AsyncAIService()
+    return _async_ai_service
@@ -0,0 +1,156 @@
+"""
+快速任务服务（asyncio 版）- 基于 AsyncOpenAI
+
+阶段1（Agent A 与专业资料）和阶段2（各节点指南）都用 asyncio.gather 并发，
+不再为每个请求创建线程池。提示词与解析复用 QuickTaskService，输出格式完全一致。
+"""
+import asyncio
+from typing import Any, Dict, List
+
+from models.schema import Checkpoint, RawCheckpoint, RawCheckpointList, StepGuide
+from services.circuit_breaker import CircuitOpenError
+from services.http_client import get_async_openai_client
+from services.quick_task_service import QuickTaskService, get_quick_task_service
+from services.structured_output import acreate_chat_completion
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+QUICK_TASK_MODEL = "inclusionAI/Ling-flash-2.0"
+
+
+class AsyncQuickTaskService:
+    """QuickTaskService 的 asyncio 版本"""
+
+    def __init__(self, sync_service: QuickTaskService | None = None):
+        self.sync = sync_service or get_quick_task_service()
+        # 指定后固定使用该客户端（测试和压测注入替身）
+        self._client = None
+
+    @property
+    def client(self):
+        """当前事件循环的 AsyncOpenAI 客户端（连接绑定在事件循环上）"""
+        return self._client or get_async_openai_client()
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    async def generate_checkpoints(self, idea: str, time_estimate: str = None) -> Dict[str, Any]:
+        """生成检测节点，返回值与 QuickTaskService.generate_checkpoints 相同"""
+        logger.info("开始处理(async): %s", idea)
+
+        raw_checkpoints, professional_summaries = await asyncio.gather(
+            self._agent_a_extract_nodes(idea),
+            self._search_professional_materials(idea),
+        )
+        logger.info("Agent A 提取了 %s 个节点", len(raw_checkpoints))
+
+        checkpoints = await self._agent_b_generate_standards(idea, raw_checkpoints, professional_summaries)
+        return self.sync._build_result(idea, checkpoints, professional_summaries)
+
+    async def _agent_a_extract_nodes(self, idea: str) -> List[RawCheckpoint]:
+        try:
+            response = await acreate_chat_completion(
+                self.client,
+                response_model=RawCheckpointList,
+                agent="quick_nodes",
+                model=QUICK_TASK_MODEL,
+                messages=[{"role": "user", "content": self.sync._extract_nodes_prompt(idea)}],
+                temperature=0.7,
+                max_tokens=4096
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认节点框架", e)
+            return self.sync._get_default_checkpoints()
+        return self.sync._parse_raw_checkpoints(response.choices[0].message.content.strip())
+
+    async def _search_professional_materials(self, idea: str) -> List[str]:
+        try:
+            response = await acreate_chat_completion(
+                self.client,
+                agent="quick_materials",
+                model=QUICK_TASK_MODEL,
+                messages=[{"role": "user", "content": self.sync._materials_prompt(idea)}],
+                temperature=0.7,
+                max_tokens=2048
+            )
+            return self.sync._parse_materials(response.choices[0].message.content.strip())
+        except Exception as e:
+            logger.error("搜索专业资料失败: %s", e)
+            return self.sync._get_default_materials()
+
+    async def _agent_b_generate_standards(
+        self,
+        idea: str,
+        raw_checkpoints: List[RawCheckpoint],
+        professional_summaries: List[str]
+    ) -> List[Checkpoint]:
+        """并发生成所有节点的指南（并发数与整体超时沿用 QUICK_TASK_GUIDE_*）"""
+        semaphore = asyncio.Semaphore(self.sync.guide_concurrency)
+
+        async def guide_for(raw_cp: RawCheckpoint) -> StepGuide:
+            async with semaphore:
+                return await self._ai_generate_guide_for_node(idea, raw_cp.name, professional_summaries)
+
+        tasks = [asyncio.ensure_future(guide_for(raw_cp)) for raw_cp in raw_checkpoints]
+        # 整个阶段共享一个截止时间，超时的节点使用默认指南
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.sync.guide_timeout)
+
+        checkpoints = []
+        for raw_cp, task in zip(raw_checkpoints, tasks):
+            if not task.done():
+                logger.warning("节点 %s 指南生成超时，使用默认指南", raw_cp.name)
+                task.cancel()
+                guide = self.sync._get_default_guide(raw_cp.name)
+            elif task.exception() is not None:
+                logger.error("节点 %s 指南生成失败: %s", raw_cp.name, task.exception())
+                guide = self.sync._get_default_guide(raw_cp.name)
+            else:
+                guide = task.result()
+
+            checkpoints.append(Checkpoint(
+                id=raw_cp.id,
+                name=raw_cp.name,
+                step_guide=guide,
+                estimated_time=raw_cp.estimated_time,
+                depends_on=raw_cp.depends_on,
+                check_method="self",
+                status="pending"
+            ))
+        return checkpoints
+
+    async def _ai_generate_guide_for_node(
+        self,
+        idea: str,
+        node_name: str,
+        professional_summaries: List[str]
+    ) -> StepGuide:
+        try:
+            response = await acreate_chat_completion(
+                self.client,
+                response_model=StepGuide,
+                agent="quick_guide",
+                model=QUICK_TASK_MODEL,
+                messages=[{"role": "user", "content": self.sync._guide_prompt(idea, node_name, professional_summaries)}],
+                temperature=0.7,
+                max_tokens=2048,
+                timeout=self.sync.guide_timeout
+            )
+            return self.sync._parse_guide(response.choices[0].message.content.strip())
+        except Exception as e:
+            logger.error("生成操作指南失败: %s", e)
+            return self.sync._get_default_guide(node_name)
+
+
+# 单例
+_async_quick_task_service = None
+
+
+def get_async_quick_task_service() -> AsyncQuickTaskService:
+    """获取 asyncio 版快速任务服务单例"""
+    global _async_quick_task_service
+    if _async_quick_task_service is None:
+        _async_quick_task_service = AsyncQuickTaskService()
+    return _async_quick_task_service
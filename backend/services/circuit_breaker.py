@@ -0,0 +1,200 @@
+"""
+上游模型熔断器 - 服务商故障时快速失败，而不是让每个请求重试到超时
+
+按模型记录调用结果：
+- closed：正常放行；连续失败（连接错误、超时、5xx）或连续慢调用达到阈值后熔断
+- open：直接抛出 CircuitOpenError，调用方改用本地默认结果；冷却时间过后进入 half_open
+- half_open：只放行少量探测请求，探测成功则恢复，失败则重新熔断
+
+429 和 400 不说明服务商故障，不计入失败（限流由 rate_limiter 处理）。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from openai import APIConnectionError, APIStatusError
+
+from services.rate_limiter import model_env_suffix
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 未配置时的慢调用阈值（秒）：思考模型本身就需要较长时间
+_DEFAULT_SLOW_SECONDS = {"ANALYSIS": 30.0, "GENERATION": 300.0, "DEFAULT": 60.0}
+
+
+class CircuitOpenError(RuntimeError):
+    """模型处于熔断状态，调用未发出"""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"模型 {model} 已熔断，{retry_in:.0f} 秒后重新探测")
+        self.model = model
+        self.retry_in = retry_in
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """是否为说明服务商故障的错误（连接错误、超时、5xx）"""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+class _ModelBreaker:
+    """单个模型的熔断状态"""
+
+    def __init__(self, model: str, failure_threshold: int, slow_seconds: float, cooldown: float, probes: int):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.probes = probes
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._counters = {
+            "calls": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "rejected": 0,      # 熔断期间被直接拒绝的调用
+            "opened": 0,        # 熔断次数
+        }
+
+    def before_call(self) -> bool:
+        """放行则返回是否为探测请求；熔断中抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    self._counters["rejected"] += 1
+                    raise CircuitOpenError(self.model, remaining)
+                self.state = HALF_OPEN
+                logger.info("模型 %s 熔断冷却结束，开始探测", self.model)
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.probes:
+                    self._counters["rejected"] += 1
+                    raise CircuitOpenError(self.model, 0)
+                self._probes_in_flight += 1
+                return True
+            self._counters["calls"] += 1
+            return False
+
+    def after_call(self, probe: bool, failed: bool, latency: float):
+        """记录一次调用的结果；failed 为 None 表示结果不说明服务商状态（如 429）"""
+        slow = failed is False and self.slow_seconds > 0 and latency > self.slow_seconds
+        with self._lock:
+            if probe:
+                self._probes_in_flight -= 1
+            if failed is None:
+                return
+            if failed:
+                self._counters["failures"] += 1
+            if slow:
+                self._counters["slow_calls"] += 1
+
+            if failed or slow:
+                self._consecutive_failures += 1
+                if probe or (self.state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                    self._open()
+            else:
+                self._consecutive_failures = 0
+                if probe and self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    logger.info("模型 %s 探测成功，熔断恢复", self.model)
+
+    def _open(self):
+        """进入熔断（调用方需持有锁）"""
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._counters["opened"] += 1
+        logger.warning("模型 %s 连续 %s 次失败或超慢，熔断 %.0f 秒", self.model, self._consecutive_failures, self.cooldown)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "slow_seconds": self.slow_seconds,
+            })
+            if self.state == OPEN:
+                stats["retry_in_s"] = round(max(0.0, self._opened_at + self.cooldown - time.monotonic()), 1)
+        return stats
+
+
+class CircuitBreaker:
+    """按模型管理熔断器
+
+    慢调用阈值按 LLM_BREAKER_SLOW_ANALYSIS / LLM_BREAKER_SLOW_GENERATION / LLM_BREAKER_SLOW_DEFAULT 配置（秒，0 表示不按延迟熔断）。
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+        self.failure_threshold = max(1, int(os.getenv("LLM_BREAKER_FAILURES", "5")))
+        self.cooldown = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+        self.probes = max(1, int(os.getenv("LLM_BREAKER_PROBES", "1")))
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelBreaker] = {}
+
+    def _breaker(self, model: str) -> _ModelBreaker:
+        breaker = self._models.get(model)
+        if breaker is None:
+            with self._lock:
+                breaker = self._models.get(model)
+                if breaker is None:
+                    suffix = model_env_suffix(model)
+                    slow_seconds = float(os.getenv(f"LLM_BREAKER_SLOW_{suffix}", _DEFAULT_SLOW_SECONDS[suffix]))
+                    breaker = _ModelBreaker(model, self.failure_threshold, slow_seconds, self.cooldown, self.probes)
+                    self._models[model] = breaker
+        return breaker
+
+    def before_call(self, model: str) -> bool:
+        """调用前检查：熔断中抛出 CircuitOpenError，否则返回是否为探测请求"""
+        if not self.enabled:
+            return False
+        return self._breaker(model).before_call()
+
+    def after_call(self, model: str, probe: bool, error: Exception | None, latency: float):
+        """调用后记录结果（error 为 None 表示成功）"""
+        if not self.enabled:
+            return
+        if error is None:
+            failed = False
+        elif is_upstream_failure(error):
+            failed = True
+        else:
+            failed = None
+        self._breaker(model).after_call(probe, failed, latency)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._models.values())
+        return {
+            "enabled": self.enabled,
+            "failure_threshold": self.failure_threshold,
+            "cooldown": self.cooldown,
+            "models": {breaker.model: breaker.get_stats() for breaker in breakers},
+        }
+
+
+# 单例
+_circuit_breaker = None
+_circuit_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """获取熔断器单例"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        with _circuit_breaker_lock:
+            if _circuit_breaker is None:
+                _circuit_breaker = CircuitBreaker()
+    return _circuit_breaker
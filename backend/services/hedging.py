@@ -0,0 +1,291 @@
+"""
+对冲请求 - 降低分析 Agent 的长尾延迟
+
+调用超过该模型近期延迟的某个分位数（默认 P95）仍未返回时，再发一个相同的请求
+（可指定发往备用模型），取先成功返回的结果：
+- 计时和延迟统计都从限流器放行之后开始（见 services/rate_limiter.py 的 admission_listener），
+  在限流队列中等待的时间不算延迟，也不会触发对冲
+- 对冲模型有调用在排队或被上游限流暂停时不对冲，避免限流期间请求量翻倍
+- 对冲比例有上限（最近一段调用中对冲的占比），避免上游整体变慢时请求量翻倍
+- 同步版的原请求在独立线程中立即开始，线程池只执行对冲请求；落后的请求无法中断，在后台自然结束。
+  异步版会取消落后的请求
+"""
+import asyncio
+import concurrent.futures
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from services.logger import get_logger
+from services.rate_limiter import admission_listener, get_rate_limiter
+
+logger = get_logger(__name__)
+
+
+class _LatencyWindow:
+    """最近若干次成功调用的延迟"""
+
+    def __init__(self, size: int):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class Hedger:
+    """按模型统计延迟并决定何时发出对冲请求"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        # 超过该分位数的延迟触发对冲
+        self.percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        # 样本不足时使用的固定等待时间，以及等待时间的下限（秒）
+        self.default_delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+        self.min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+        self.min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        # 最近 window 次调用中对冲的比例上限
+        self.max_rate = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+        # 对冲请求发往的模型，留空则与原请求相同
+        self.fallback_model = os.getenv("LLM_HEDGE_FALLBACK_MODEL", "") or None
+
+        window = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+        self._window = window
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, _LatencyWindow] = {}
+        self._recent = deque(maxlen=window)     # 最近调用是否对冲
+        self._recent_hedged = 0
+        self._counters = {
+            "calls": 0,
+            "hedged": 0,            # 发出了对冲请求
+            "hedge_wins": 0,        # 对冲请求先返回
+            "capped": 0,            # 达到对冲比例上限而未对冲
+            "congested": 0,         # 对冲模型在限流排队或暂停中而未对冲
+        }
+        self._executor = None
+
+    # ---------- 统计 ----------
+
+    def _latency(self, model: str) -> _LatencyWindow:
+        window = self._latencies.get(model)
+        if window is None:
+            with self._lock:
+                window = self._latencies.setdefault(model, _LatencyWindow(self._window))
+        return window
+
+    def hedge_delay(self, model: str) -> float:
+        """发出对冲前的等待时间"""
+        window = self._latency(model)
+        if len(window) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, window.percentile(self.percentile))
+
+    def _record_call(self, hedged: bool):
+        with self._lock:
+            self._counters["calls"] += 1
+            if len(self._recent) == self._recent.maxlen and self._recent[0]:
+                self._recent_hedged -= 1
+            self._recent.append(hedged)
+            if hedged:
+                self._recent_hedged += 1
+                self._counters["hedged"] += 1
+
+    def _allow_hedge(self, hedge_model: str) -> bool:
+        if get_rate_limiter().congested(hedge_model):
+            with self._lock:
+                self._counters["congested"] += 1
+            return False
+        with self._lock:
+            # 把本次对冲也算进去后仍不超过上限才放行
+            allowed = (self._recent_hedged + 1) <= self.max_rate * (len(self._recent) + 1)
+            if not allowed:
+                self._counters["capped"] += 1
+        return allowed
+
+    def _record_win(self, hedge_won: bool):
+        if hedge_won:
+            with self._lock:
+                self._counters["hedge_wins"] += 1
+
+    # ---------- 同步调用 ----------
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=int(os.getenv("LLM_HEDGE_WORKERS", "64")),
+                        thread_name_prefix="llm-hedge"
+                    )
+        return self._executor
+
+    def _admission(self, admitted) -> tuple:
+        """(记录放行时间的回调, 放行时间列表)；admitted 为事件对象，放行时置位"""
+        admitted_at = []
+
+        def on_admitted():
+            # 重试时会多次获得许可，只记第一次
+            if not admitted_at:
+                admitted_at.append(time.monotonic())
+                if admitted is not None:
+                    admitted.set()
+
+        return on_admitted, admitted_at
+
+    def _timed(self, model: str, fn: Callable[[str], Any], admitted: Optional[threading.Event] = None) -> Any:
+        """执行 fn(model)，记录限流放行之后的耗时；admitted 在放行或结束时置位"""
+        on_admitted, admitted_at = self._admission(admitted)
+        try:
+            with admission_listener(on_admitted):
+                result = fn(model)
+        finally:
+            if admitted is not None:
+                admitted.set()
+        # 没有经过限流器（如命中缓存）的调用不计入延迟统计
+        if admitted_at:
+            self._latency(model).add(time.monotonic() - admitted_at[0])
+        return result
+
+    def _run_primary(self, future: concurrent.futures.Future, model: str, fn: Callable[[str], Any],
+                     admitted: threading.Event):
+        try:
+            future.set_result(self._timed(model, fn, admitted))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def call(self, model: str, fn: Callable[[str], Any]) -> Any:
+        """执行 fn(model)；限流放行后超过对冲等待时间仍未返回时再执行 fn(对冲模型)，返回先成功的结果"""
+        if not self.enabled:
+            return self._timed(model, fn)
+
+        # 原请求在独立线程中立即开始，不在线程池里排队
+        admitted = threading.Event()
+        primary = concurrent.futures.Future()
+        primary.set_running_or_notify_cancel()
+        threading.Thread(
+            target=self._run_primary, args=(primary, model, fn, admitted), name="llm-hedge-primary", daemon=True
+        ).start()
+        # 对冲计时从限流放行开始
+        admitted.wait()
+        done, _ = concurrent.futures.wait([primary], timeout=self.hedge_delay(model))
+        hedge_model = self.fallback_model or model
+        if done or not self._allow_hedge(hedge_model):
+            self._record_call(False)
+            return primary.result()
+
+        self._record_call(True)
+        logger.info("%s 调用超过对冲等待时间，发出对冲请求 → %s", model, hedge_model)
+        hedge = self._get_executor().submit(self._timed, hedge_model, fn)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._record_win(future is hedge)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    # ---------- 异步调用 ----------
+
+    async def _atimed(self, model: str, fn: Callable[[str], Awaitable[Any]],
+                      admitted: Optional[asyncio.Event] = None) -> Any:
+        on_admitted, admitted_at = self._admission(admitted)
+        try:
+            with admission_listener(on_admitted):
+                result = await fn(model)
+        finally:
+            if admitted is not None:
+                admitted.set()
+        if admitted_at:
+            self._latency(model).add(time.monotonic() - admitted_at[0])
+        return result
+
+    async def acall(self, model: str, fn: Callable[[str], Awaitable[Any]]) -> Any:
+        """call 的异步版本：落后的请求会被取消"""
+        if not self.enabled:
+            return await self._atimed(model, fn)
+
+        admitted = asyncio.Event()
+        primary = asyncio.ensure_future(self._atimed(model, fn, admitted))
+        tasks = {primary}
+        try:
+            await admitted.wait()
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(model))
+            hedge_model = self.fallback_model or model
+            if done or not self._allow_hedge(hedge_model):
+                self._record_call(False)
+                return await primary
+
+            self._record_call(True)
+            logger.info("%s 调用超过对冲等待时间，发出对冲请求 → %s", model, hedge_model)
+            hedge = asyncio.ensure_future(self._atimed(hedge_model, fn))
+            tasks.add(hedge)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._record_win(task is hedge)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            models = list(self._latencies.items())
+        stats.update({
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "max_rate": self.max_rate,
+            "fallback_model": self.fallback_model,
+            "hedge_rate": round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0,
+            "models": {
+                model: {
+                    "samples": len(window),
+                    "p50_s": round(window.percentile(50) or 0.0, 3),
+                    "p95_s": round(window.percentile(95) or 0.0, 3),
+                    "hedge_delay_s": round(self.hedge_delay(model), 3),
+                }
+                for model, window in models
+            },
+        })
+        return stats
+
+
+# 单例
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """获取对冲请求单例"""
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger
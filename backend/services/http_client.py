@@ -0,0 +1,222 @@
+"""
+共享 HTTP 连接池 - 进程内所有 LLM 调用复用同一个 httpx/OpenAI 客户端
+
+避免每次调用都重新创建客户端导致的 TLS 握手开销，并让 keep-alive 连接得到复用。
+异步客户端的连接绑定在事件循环上，按事件循环各建一个（循环结束后随之释放）。
+"""
+import asyncio
+import os
+import threading
+import weakref
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from services.llm_replay import get_llm_recorder
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（h2）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PoolStats:
+    """连接池统计：请求数、新建连接数，由 httpx 的 trace 扩展回调累计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+
+    def on_request(self, request: httpx.Request):
+        """请求发出前挂上 trace 回调，用于统计新建的 TCP 连接"""
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def on_request_async(self, request: httpx.Request):
+        """异步客户端的请求钩子（httpx 要求异步客户端的钩子和 trace 回调都是协程）"""
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self._atrace
+
+    async def _atrace(self, event_name: str, info: Dict[str, Any]):
+        self._trace(event_name, info)
+
+    def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name.endswith(".failed"):
+            with self._lock:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            reused = max(0, self.requests - self.connections_opened)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": reused,
+                "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+                "errors": self.errors,
+            }
+
+
+class HTTPClientPool:
+    """进程级共享的 httpx 连接池和 OpenAI 客户端（线程安全，懒加载）"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+        self.timeout = float(os.getenv("HTTP_POOL_TIMEOUT", "120"))
+        http2_setting = os.getenv("HTTP_POOL_HTTP2", "auto").lower()
+        if http2_setting == "auto":
+            self.http2 = _http2_available()
+        else:
+            self.http2 = http2_setting == "true" and _http2_available()
+
+        self.stats = PoolStats()
+        self._lock = threading.Lock()
+        self._http_client: Optional[httpx.Client] = None
+        self._openai_client: Optional[OpenAI] = None
+        # 异步客户端供 asyncio 版服务使用；连接绑定在创建它的事件循环上，按循环分别创建
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, AsyncOpenAI]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def get_http_client(self) -> httpx.Client:
+        """获取共享的 httpx 客户端"""
+        if self._http_client is None:
+            with self._lock:
+                if self._http_client is None:
+                    self._http_client = httpx.Client(
+                        verify=False,  # 与原实现一致：临时禁用 SSL 验证以解决 Windows 上的连接问题
+                        timeout=self.timeout,
+                        http2=self.http2,
+                        limits=self._limits(),
+                        event_hooks={"request": [self.stats.on_request]},
+                    )
+                    logger.debug("共享 HTTP 连接池已创建 (max=%s, keepalive=%s, http2=%s)", self.max_connections, self.max_keepalive_connections, self.http2)
+        return self._http_client
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _async_clients_for_loop(self) -> Tuple[httpx.AsyncClient, AsyncOpenAI]:
+        """当前事件循环的 (httpx.AsyncClient, AsyncOpenAI)，需在协程中调用"""
+        loop = asyncio.get_running_loop()
+        clients = self._async_clients.get(loop)
+        if clients is None:
+            with self._lock:
+                clients = self._async_clients.get(loop)
+                if clients is None:
+                    http_client = httpx.AsyncClient(
+                        verify=False,
+                        timeout=self.timeout,
+                        http2=self.http2,
+                        limits=self._limits(),
+                        event_hooks={"request": [self.stats.on_request_async]},
+                    )
+                    clients = (http_client, AsyncOpenAI(
+                        api_key=os.getenv("SILICONFLOW_API_KEY"),
+                        base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"),
+                        http_client=http_client,
+                    ))
+                    self._async_clients[loop] = clients
+        return clients
+
+    def get_async_http_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环共享的异步 httpx 客户端（与同步客户端使用相同的连接池配置）"""
+        return self._async_clients_for_loop()[0]
+
+    def get_async_openai_client(self) -> AsyncOpenAI:
+        """获取当前事件循环共享的 AsyncOpenAI 客户端"""
+        return self._async_clients_for_loop()[1]
+
+    def get_openai_client(self) -> OpenAI:
+        """获取共享的 OpenAI 客户端（底层复用同一个连接池）"""
+        if self._openai_client is None:
+            http_client = self.get_http_client()
+            with self._lock:
+                if self._openai_client is None:
+                    self._openai_client = OpenAI(
+                        api_key=os.getenv("SILICONFLOW_API_KEY"),
+                        base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"),
+                        http_client=http_client,
+                    )
+        return self._openai_client
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池配置与复用统计"""
+        stats = self.stats.snapshot()
+        stats.update({
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+        })
+        return stats
+
+    def close(self):
+        """关闭连接池（主要用于测试或进程退出）"""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._http_client = None
+            self._openai_client = None
+            # 异步客户端需要在各自的事件循环中关闭（见 aclose），这里只丢弃引用
+            self._async_clients.clear()
+
+    async def aclose(self):
+        """关闭当前事件循环的异步连接池（ASGI 应用退出时调用）"""
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if clients is not None:
+            await clients[0].aclose()
+
+
+# 单例
+_http_client_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_http_client_pool() -> HTTPClientPool:
+    """获取共享连接池单例"""
+    global _http_client_pool
+    if _http_client_pool is None:
+        with _pool_lock:
+            if _http_client_pool is None:
+                _http_client_pool = HTTPClientPool()
+    return _http_client_pool
+
+
+def get_openai_client() -> OpenAI:
+    """获取共享的 OpenAI 客户端（LLM_REPLAY_MODE 开启时返回录制/回放包装，见 services/llm_replay.py）"""
+    pool = get_http_client_pool()
+    recorder = get_llm_recorder()
+    if recorder.enabled:
+        return recorder.client(pool.get_openai_client)
+    return pool.get_openai_client()
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """获取当前事件循环共享的 AsyncOpenAI 客户端（LLM_REPLAY_MODE 开启时返回录制/回放包装），需在协程中调用"""
+    pool = get_http_client_pool()
+    recorder = get_llm_recorder()
+    if recorder.enabled:
+        return recorder.async_client(pool.get_async_openai_client)
+    return pool.get_async_openai_client()
@@ -0,0 +1,382 @@
+"""
+后台任务服务 - 把耗时的 LLM 生成放到本地工作线程池中执行
+
+提交后立即返回 job_id，客户端轮询或订阅任务状态，不再占用请求线程。
+任务记录（状态、进度、结果、错误、耗时）保存在共享存储（jobs 集合）中，
+多个 gunicorn worker 中的任意一个都能查询、订阅和取消其他 worker 提交的任务。
+执行方按 JOB_HEARTBEAT_INTERVAL 更新未结束任务的心跳，心跳超过 JOB_LEASE_TIMEOUT 的任务
+（执行它的 worker 已退出）在查询或巡检时标记为失败，轮询和订阅方不会一直等待。
+"""
+import os
+import threading
+import time
+import uuid
+import concurrent.futures
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from services.logger import get_logger
+from services.storage import get_store
+
+logger = get_logger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务已被取消，由 set_progress 抛出，用于在 Agent 阶段之间停止执行"""
+
+
+class Job:
+    """单个后台任务（共享存储中任务记录的快照）"""
+
+    def __init__(self, kind: str):
+        self.id = f"job-{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.status = QUEUED
+        self.progress: Optional[str] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        # 已开始保存结果（on_success），此后不再接受取消
+        self.committed = False
+        self.version = 0  # 每次状态变化递增，供订阅方判断是否有更新
+        self.submitted_at = time.time()
+        # 执行方最近一次确认任务仍在处理（排队或运行）的时间
+        self.heartbeat_at = self.submitted_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_record(self) -> Dict[str, Any]:
+        """保存到共享存储的记录"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "cancel_requested": self.cancel_requested,
+            "committed": self.committed,
+            "version": self.version,
+            "submitted_at": self.submitted_at,
+            "heartbeat_at": self.heartbeat_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "created_at": datetime.fromtimestamp(self.submitted_at).isoformat(),
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        job = cls.__new__(cls)
+        for field in ("id", "kind", "status", "progress", "result", "error",
+                      "cancel_requested", "committed", "version", "submitted_at", "heartbeat_at",
+                      "started_at", "finished_at"):
+            setattr(job, field, record.get(field))
+        return job
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        queue_end = self.started_at or self.finished_at or now
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "submitted_at": datetime.fromtimestamp(self.submitted_at).isoformat(),
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            "queue_ms": int((queue_end - self.submitted_at) * 1000),
+            "run_ms": int(((self.finished_at or now) - self.started_at) * 1000) if self.started_at else None,
+        }
+        if self.status == SUCCEEDED:
+            data["result"] = self.result
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class JobService:
+    """后台任务队列（本进程的线程池执行 + 共享存储中的任务表）"""
+
+    def __init__(self):
+        self.max_workers = max(1, int(os.getenv("JOB_WORKERS", "4")))
+        # 只保留最近的若干个已结束任务，避免存储无限增长
+        self.max_history = int(os.getenv("JOB_HISTORY", "200"))
+        # 订阅时检查其他 worker 更新的间隔（秒）；本进程内的更新会立即唤醒
+        self.poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+        # 心跳间隔与租约（秒）：未结束的任务超过租约没有心跳，视为执行它的 worker 已退出
+        self.heartbeat_interval = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+        self.lease_timeout = max(self.heartbeat_interval * 2, float(os.getenv("JOB_LEASE_TIMEOUT", "60")))
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="job-worker"
+        )
+        self._store = get_store("jobs")
+        # 本进程提交、尚未结束的任务（用于取消排队中的 future）
+        self._futures: Dict[str, concurrent.futures.Future] = {}
+        self._cond = threading.Condition()
+        # 心跳线程（按进程启动：gunicorn fork 之后子进程里需要重新启动）
+        self._heartbeat_pid: Optional[int] = None
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[[Job], Any],
+        on_success: Optional[Callable[[Any], Any]] = None
+    ) -> Job:
+        """提交任务
+
+        Args:
+            kind: 任务类型（breakdown / regenerate）
+            fn: 实际执行的函数，参数为 Job 本身（可更新 progress）
+            on_success: 成功后的回调，返回值作为任务结果；任务被取消时不会调用
+        """
+        job = Job(kind)
+        self._store.put(job.id, job.to_record())
+        self._prune()
+        self._ensure_heartbeat()
+        with self._cond:
+            self._futures[job.id] = self._executor.submit(self._run, job.id, fn, on_success)
+        logger.info("提交任务 %s (%s)，当前排队 %s 个", job.id, kind, self.queue_depth())
+        return job
+
+    def _run(self, job_id: str, fn: Callable[[Job], Any], on_success: Optional[Callable[[Any], Any]]):
+        def start(record):
+            # 排队期间被取消或因心跳超时被标记为失败的任务不再执行
+            if record["status"] != QUEUED:
+                return
+            record["status"] = RUNNING
+            record["started_at"] = record["heartbeat_at"] = time.time()
+            record["version"] += 1
+
+        try:
+            record = self._update(job_id, start)
+            if record is None or record["status"] != RUNNING:
+                return
+
+            try:
+                result = fn(Job.from_record(record))
+                # 取消与成功在同一次原子更新中决出：标记 committed 之后取消不再生效，
+                # 避免项目已经保存、任务却以 cancelled 结束
+                if self._commit(job_id) and on_success is not None:
+                    result = on_success(result)
+                status, error = SUCCEEDED, None
+            except JobCancelled:
+                logger.info("任务 %s 已取消，停止执行", job_id)
+                result, status, error = None, CANCELLED, None
+            except Exception as e:
+                logger.exception("任务 %s 执行失败: %s", job_id, e)
+                result, status, error = None, FAILED, str(e)
+
+            def finish(record):
+                if record["cancel_requested"] and not record["committed"]:
+                    # 运行中被取消：结果直接丢弃
+                    record["status"], record["result"] = CANCELLED, None
+                elif record.get("lease_expired") and not record["committed"]:
+                    # 心跳中断期间已被其他 worker 标记为失败，保持失败
+                    return
+                else:
+                    record["status"], record["result"] = status, result
+                record["error"] = error
+                record["finished_at"] = time.time()
+                record["version"] += 1
+
+            record = self._update(job_id, finish)
+            if record is not None:
+                logger.info("任务 %s 结束: %s，耗时 %sms", job_id, record["status"],
+                            Job.from_record(record).to_dict()["run_ms"])
+        finally:
+            with self._cond:
+                self._futures.pop(job_id, None)
+
+    def set_progress(self, job: Job, progress: str):
+        """更新任务进度描述；任务已被取消时抛出 JobCancelled，在 Agent 阶段之间停止执行"""
+        def apply(record):
+            if record["cancel_requested"] or record.get("lease_expired"):
+                return
+            record["progress"] = progress
+            record["heartbeat_at"] = time.time()
+            record["version"] += 1
+
+        record = self._update(job.id, apply)
+        if record is None or record["cancel_requested"] or record.get("lease_expired"):
+            raise JobCancelled(job.id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        record = self._store.get(job_id)
+        if record is None:
+            return None
+        if self._lease_expired(job_id, record):
+            record = self._expire(job_id) or record
+        return Job.from_record(record)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """取消任务：排队中的直接移出队列，运行中的在下一个阶段停止并丢弃结果
+
+        任务可能由其他 worker 执行：只在共享记录上标记取消，执行方在开始运行、每次更新进度
+        和保存结果前检查这个标记。已经开始保存结果的任务不能再取消，返回其当前状态。
+        """
+        def apply(record):
+            if record["status"] in FINISHED_STATUSES or record["committed"]:
+                return
+            record["cancel_requested"] = True
+            if record["status"] == QUEUED:
+                record["finished_at"] = time.time()
+            record["status"] = CANCELLED
+            record["version"] += 1
+
+        record = self._update(job_id, apply)
+        if record is None:
+            return None
+        with self._cond:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            with self._cond:
+                self._futures.pop(job_id, None)
+        return Job.from_record(record)
+
+    def wait_for_update(self, job_id: str, version: int, timeout: float = 15.0) -> Optional[Job]:
+        """阻塞等待任务状态变化（version 变大）或超时，用于订阅
+
+        本进程内的更新通过条件变量立即唤醒，其他 worker 的更新按 poll_interval 轮询共享存储。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.version != version or remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(self.poll_interval, remaining))
+
+    def snapshot(self, job_id: str) -> Optional[tuple]:
+        """任务状态快照：(version, 对外的状态字典)"""
+        job = self.get(job_id)
+        return (job.version, job.to_dict()) if job else None
+
+    def queue_depth(self) -> int:
+        return self._store.count_by_status().get(QUEUED, 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """队列深度与各状态任务数（所有 worker 合计，按状态索引计数，不读取任务结果）"""
+        counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED_STATUSES}
+        for status, count in self._store.count_by_status().items():
+            if status in counts:
+                counts[status] = count
+        return {
+            "workers": self.max_workers,
+            "queue_depth": counts[QUEUED],
+            "jobs": counts,
+        }
+
+    def _commit(self, job_id: str) -> bool:
+        """原子地检查取消标记并标记 committed；已被取消时返回 False"""
+        def apply(record):
+            if not record["cancel_requested"] and not record.get("lease_expired"):
+                record["committed"] = True
+
+        record = self._update(job_id, apply)
+        return record is not None and record["committed"]
+
+    def _update(self, job_id: str, mutator: Callable[[Dict[str, Any]], Any]) -> Optional[Dict[str, Any]]:
+        """原子地更新任务记录，并唤醒本进程内的订阅方"""
+        record = self._store.update(job_id, mutator)
+        with self._cond:
+            self._cond.notify_all()
+        return record
+
+    def _prune(self):
+        """只保留最近 max_history 个已结束的任务（按状态索引删除，不读取任务记录）"""
+        self._store.delete_oldest(FINISHED_STATUSES, self.max_history)
+
+    # ---------- 心跳与租约 ----------
+    def _ensure_heartbeat(self):
+        """启动本进程的心跳线程"""
+        pid = os.getpid()
+        if self._heartbeat_pid == pid:
+            return
+        with self._cond:
+            if self._heartbeat_pid == pid:
+                return
+            self._heartbeat_pid = pid
+            # fork 之前提交的 future 不在子进程中执行
+            if self._futures:
+                self._futures = {}
+        threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self._heartbeat()
+                self._expire_stale()
+            except Exception as e:
+                logger.warning("任务心跳失败: %s", e)
+
+    def _heartbeat(self):
+        """更新本进程中未结束任务的心跳（不改变 version，订阅方不会因此收到更新）"""
+        def beat(record):
+            if record["status"] not in FINISHED_STATUSES:
+                record["heartbeat_at"] = time.time()
+
+        with self._cond:
+            job_ids = list(self._futures)
+        for job_id in job_ids:
+            self._store.update(job_id, beat)
+
+    def _lease_expired(self, job_id: str, record: Dict[str, Any]) -> bool:
+        if record["status"] in FINISHED_STATUSES:
+            return False
+        with self._cond:
+            if job_id in self._futures:
+                return False
+        heartbeat_at = record.get("heartbeat_at") or record["submitted_at"]
+        return time.time() - heartbeat_at > self.lease_timeout
+
+    def _expire(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """把心跳超时的任务标记为失败（在同一次原子更新中再次检查，避免覆盖刚恢复的心跳）"""
+        def apply(record):
+            if not self._lease_expired(job_id, record):
+                return
+            record["status"] = FAILED
+            record["lease_expired"] = True
+            record["error"] = f"执行任务的 worker 已退出（超过 {self.lease_timeout:g} 秒没有心跳）"
+            record["finished_at"] = time.time()
+            record["version"] += 1
+
+        record = self._update(job_id, apply)
+        if record is not None and record.get("lease_expired"):
+            logger.warning("任务 %s 心跳超时，标记为失败", job_id)
+        return record
+
+    def _expire_stale(self):
+        """巡检：把所有 worker 中心跳超时的排队/运行中任务标记为失败"""
+        for job_id, record in self._store.list((QUEUED, RUNNING)):
+            if self._lease_expired(job_id, record):
+                self._expire(job_id)
+
+
+# 单例
+_job_service = None
+_job_service_lock = threading.Lock()
+
+
+def get_job_service() -> JobService:
+    """获取后台任务服务单例"""
+    global _job_service
+    if _job_service is None:
+        with _job_service_lock:
+            if _job_service is None:
+                _job_service = JobService()
+    return _job_service
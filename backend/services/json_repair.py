@@ -0,0 +1,180 @@
+"""
+截断 JSON 修复 - 单次线性扫描
+
+模型输出因 max_tokens 被截断时，JSON 往往停在字符串、键或数组中间。
+扫描时维护字符串/转义状态和括号栈，并记录最后一个"安全截断点"（在此处补齐括号即为合法 JSON），
+最终只需拼接一次字符串、解析一次：
+- 截断在字符串值中间：补上引号，保留已生成的部分文本
+- 截断在键、冒号、逗号或不完整的数字/字面量之后：退回到最后一个安全截断点
+- 末尾多余的逗号（如 [1, 2,]）：删除
+- 按栈的顺序补齐未闭合的 } 和 ]
+"""
+import json
+import re
+from typing import Any, List, Optional
+
+# 字符串内部只需关心引号和反斜杠
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+# 数字、true/false/null 等标量（到下一个分隔符为止）
+_SCALAR = re.compile(r'[^\s,:\[\]{}"]+')
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_LITERALS = ("true", "false", "null")
+# 字符串末尾不完整的 \uXXXX 转义（前面的反斜杠个数为奇数时才是转义）
+_PARTIAL_UNICODE = re.compile(r'(\\+)u[0-9a-fA-F]{0,3}$')
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# 容器内下一个期望的记号
+_EXPECT_KEY = 0
+_EXPECT_COLON = 1
+_EXPECT_VALUE = 2
+_EXPECT_COMMA = 3
+
+
+def repair_json(text: str) -> Optional[str]:
+    """修复截断的 JSON 文本，返回可以直接 json.loads 的字符串；无法修复时返回 None"""
+    if not text:
+        return None
+
+    n = len(text)
+    start = min((p for p in (text.find("{"), text.find("[")) if p != -1), default=-1)
+    if start == -1:
+        return None
+
+    stack: List[str] = []       # 未闭合的容器 "{" / "["
+    expect: List[int] = []      # 每层容器期望的下一个记号
+    dropped: List[int] = []     # 需要删除的多余逗号位置
+    last_comma = -1             # 当前容器中最后一个逗号的位置
+    safe_pos = start            # 最后一个安全截断点（不含）
+    safe_depth = 0              # 安全截断点处的栈深度
+    string_start = -1
+    in_string = False
+    string_is_key = False
+    i = start
+
+    while i < n:
+        if in_string:
+            match = _STRING_SPECIAL.search(text, i)
+            if match is None:
+                i = n
+                break
+            j = match.start()
+            if text[j] == "\\":
+                i = j + 2
+                continue
+            in_string = False
+            i = j + 1
+            if string_is_key:
+                expect[-1] = _EXPECT_COLON
+            else:
+                expect[-1] = _EXPECT_COMMA
+                safe_pos, safe_depth = i, len(stack)
+            continue
+
+        i = _WHITESPACE.match(text, i).end()
+        if i >= n:
+            break
+        c = text[i]
+        state = expect[-1] if expect else _EXPECT_VALUE
+
+        if c == '"':
+            if state == _EXPECT_KEY:
+                string_is_key = True
+            elif state == _EXPECT_VALUE:
+                string_is_key = False
+            else:
+                break
+            in_string = True
+            string_start = i
+            i += 1
+        elif c in "{[":
+            if state != _EXPECT_VALUE:
+                break
+            stack.append(c)
+            expect.append(_EXPECT_KEY if c == "{" else _EXPECT_VALUE)
+            last_comma = -1
+            i += 1
+            # 空容器补齐后即为合法 JSON
+            safe_pos, safe_depth = i, len(stack)
+        elif c in "}]":
+            if not stack or _CLOSERS[stack[-1]] != c:
+                break
+            if state == _EXPECT_COLON or (state == _EXPECT_VALUE and stack[-1] == "{"):
+                # 键后面没有值，无法补救，按截断处理
+                break
+            if last_comma != -1 and state in (_EXPECT_KEY, _EXPECT_VALUE):
+                dropped.append(last_comma)
+            stack.pop()
+            expect.pop()
+            last_comma = -1
+            i += 1
+            safe_pos, safe_depth = i, len(stack)
+            if not stack:
+                break
+            expect[-1] = _EXPECT_COMMA
+        elif c == ":":
+            if state != _EXPECT_COLON:
+                break
+            expect[-1] = _EXPECT_VALUE
+            i += 1
+        elif c == ",":
+            if state != _EXPECT_COMMA or not stack:
+                break
+            expect[-1] = _EXPECT_KEY if stack[-1] == "{" else _EXPECT_VALUE
+            last_comma = i
+            i += 1
+        else:
+            if state != _EXPECT_VALUE:
+                break
+            match = _SCALAR.match(text, i)
+            token = match.group()
+            end = match.end()
+            if token not in _LITERALS and _NUMBER.fullmatch(token) is None:
+                # 不完整的字面量/数字（如 "tru"、"12."）或非法内容
+                break
+            i = end
+            expect[-1] = _EXPECT_COMMA
+            safe_pos, safe_depth = i, len(stack)
+
+    parts = []
+    prev = start
+    if in_string and not string_is_key:
+        # 截断在字符串值中间：保留已生成的文字，去掉不完整的转义后补上引号
+        body = text[string_start:n - 1] if i > n else text[string_start:]
+        match = _PARTIAL_UNICODE.search(body)
+        if match and len(match.group(1)) % 2 == 1:
+            body = body[:match.end(1) - 1]
+        cut_end, depth = string_start, len(stack)
+        tail = body + '"'
+    else:
+        cut_end, depth = safe_pos, safe_depth
+        tail = ""
+
+    for pos in dropped:
+        if pos < cut_end:
+            parts.append(text[prev:pos])
+            prev = pos + 1
+    parts.append(text[prev:cut_end])
+    parts.append(tail)
+    parts.extend(_CLOSERS[opener] for opener in reversed(stack[:depth]))
+    return "".join(parts)
+
+
+def parse_truncated_json(text: str) -> Any:
+    """解析可能被截断的 JSON：先直接解析，失败时修复后再解析一次
+
+    Raises:
+        ValueError: 无法修复
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    repaired = repair_json(text)
+    if repaired is None:
+        raise ValueError("无法修复的 JSON")
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"无法修复的 JSON: {e}") from e
@@ -0,0 +1,192 @@
+"""
+增量 JSON 解析 - 边接收模型的流式输出边解析任务拆解
+
+每当根对象中 monthly / weekly / daily 下的某个条目闭合，就立即解析并产出该条目，
+已产出的文本随即丢弃，内存中只保留当前尚未闭合的条目。
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, List, Tuple
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 字符串内部只需关心引号和反斜杠，用正则直接跳过普通字符
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = " \t\r\n"
+
+
+class _Container:
+    """容器栈中的一层（对象或数组）"""
+    __slots__ = ("kind", "expecting_key", "key")
+
+    def __init__(self, kind: str):
+        self.kind = kind                      # "{" 或 "["
+        self.expecting_key = kind == "{"      # 对象中下一个字符串是否为键
+        self.key = None                       # 对象中当前值对应的键
+
+
+class IncrementalJSONParser:
+    """任务拆解 JSON 的增量解析器
+
+    用法：
+        parser = IncrementalJSONParser()
+        for chunk in stream:
+            for section, key, value in parser.feed(chunk):
+                ...   # 如 ("weekly", "第1周", {"goal": ..., "output": ...})
+        parser.meta          # 根对象中的字符串字段（project_name、overview 等）
+        parser.entries       # 已产出的条目数
+        parser.pending_text()  # 尚未消费的文本（一个条目都没解析出来时就是完整响应）
+    """
+
+    def __init__(self, sections: Iterable[str] = ("monthly", "weekly", "daily")):
+        self.sections = set(sections)
+        self.meta: Dict[str, Any] = {}
+        self.entries = 0
+        self.done = False
+        self._buf = ""
+        self._i = 0
+        self._started = False
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._string_start = -1
+        self._value_start = -1
+
+    def pending_text(self) -> str:
+        return self._buf
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        """输入一段新文本，返回这段文本中闭合的所有条目"""
+        if self.done or not chunk:
+            return []
+        self._buf += chunk
+        out: List[Tuple[str, str, Any]] = []
+        buf = self._buf
+        n = len(buf)
+        i = self._i
+
+        while i < n:
+            if not self._started:
+                # 跳过根对象之前的内容（如 ```json 代码块标记）
+                start = buf.find("{", i)
+                if start == -1:
+                    i = n
+                    break
+                self._started = True
+                self._stack.append(_Container("{"))
+                i = start + 1
+                continue
+
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buf, i)
+                if match is None:
+                    i = n
+                    break
+                j = match.start()
+                if buf[j] == "\\":
+                    if j + 1 >= n:
+                        # 转义符在本段末尾，等下一段数据
+                        i = j
+                        break
+                    i = j + 2
+                    continue
+                # 字符串结束
+                self._in_string = False
+                i = j + 1
+                if self._on_string_end(buf, i, out):
+                    buf, i = self._trim(i)
+                    n = len(buf)
+                continue
+
+            c = buf[i]
+            if c in _WHITESPACE or c == ":":
+                i += 1
+                continue
+
+            top = self._stack[-1]
+            if c == ",":
+                self._on_scalar_end(buf, i, out)
+                if top.kind == "{":
+                    top.expecting_key = True
+                    top.key = None
+                i += 1
+                continue
+
+            if c in "}]":
+                self._on_scalar_end(buf, i, out)
+                self._stack.pop()
+                i += 1
+                if not self._stack:
+                    self.done = True
+                    break
+                if self._in_entry_slot() and self._value_start >= 0:
+                    self._emit(buf[self._value_start:i], out)
+                    buf, i = self._trim(i)
+                    n = len(buf)
+                continue
+
+            # 值的开始：字符串、容器或标量
+            is_key = top.kind == "{" and top.expecting_key
+            if not is_key and self._in_entry_slot() and self._value_start < 0:
+                self._value_start = i
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                i += 1
+            elif c in "{[":
+                self._stack.append(_Container(c))
+                i += 1
+            else:
+                i += 1
+
+        self._i = i
+        return out
+
+    # ==================== 内部方法 ====================
+
+    def _in_entry_slot(self) -> bool:
+        """当前是否位于 monthly/weekly/daily 对象的直接子值位置"""
+        return (
+            len(self._stack) == 2
+            and self._stack[0].key in self.sections
+            and self._stack[1].kind == "{"
+        )
+
+    def _on_string_end(self, buf: str, end: int, out: list) -> bool:
+        """处理一个完整的字符串；返回 True 表示产出了一个条目，可以丢弃已消费的文本"""
+        top = self._stack[-1]
+        text = buf[self._string_start:end]
+        if top.kind == "{" and top.expecting_key:
+            top.key = json.loads(text)
+            top.expecting_key = False
+        elif self._in_entry_slot() and self._value_start >= 0:
+            self._emit(buf[self._value_start:end], out)
+            return True
+        elif len(self._stack) == 1 and top.key is not None:
+            self.meta[top.key] = json.loads(text)
+        return False
+
+    def _on_scalar_end(self, buf: str, end: int, out: list):
+        """数字/true/false/null 在遇到 , } ] 时结束"""
+        if self._in_entry_slot() and self._value_start >= 0:
+            self._emit(buf[self._value_start:end].strip(), out)
+            self._value_start = -1
+
+    def _emit(self, text: str, out: list):
+        section = self._stack[0].key
+        key = self._stack[1].key
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning("流式解析条目 %s/%s 失败: %s", section, key, e)
+            self._value_start = -1
+            return
+        out.append((section, key, value))
+        self.entries += 1
+        self._value_start = -1
+
+    def _trim(self, end: int) -> Tuple[str, int]:
+        """丢弃已经产出的文本"""
+        self._buf = self._buf[end:]
+        self._string_start = -1
+        return self._buf, 0
@@ -0,0 +1,200 @@
+"""
+LLM 响应缓存 - 对相同的 (model, messages, temperature, max_tokens) 直接复用结果
+
+两级缓存：
+- 进程内 LRU（条目数上限 + TTL）
+- 可选的磁盘缓存（LLM_CACHE_DIR，多进程共享，按总大小淘汰最旧的文件）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """根据请求内容生成缓存键（内容寻址）"""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """LLM 响应缓存"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl = float(os.getenv("LLM_CACHE_TTL", "3600"))
+        self.max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+        self.disk_dir = os.getenv("LLM_CACHE_DIR") or None
+        self.disk_max_bytes = int(float(os.getenv("LLM_CACHE_DISK_MAX_MB", "64")) * 1024 * 1024)
+        # 每写入若干次才扫描一次磁盘目录做淘汰，避免每次写入都遍历
+        self.disk_evict_interval = 32
+        self._disk_sets = 0
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存，先内存后磁盘；磁盘命中会回填到内存"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is not None:
+                self._counters["disk_hits"] += 1
+                self._memory_set(key, value, now)
+            else:
+                self._counters["misses"] += 1
+        return value
+
+    def set(self, key: str, value: str):
+        """写入缓存（内存 + 磁盘）"""
+        if not self.enabled or not value:
+            return
+        now = time.time()
+        with self._lock:
+            self._memory_set(key, value, now)
+            self._counters["sets"] += 1
+        self._disk_set(key, value, now)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中/未命中计数"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        stats["disk_enabled"] = bool(self.disk_dir)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    # ==================== 内存层 ====================
+
+    def _memory_set(self, key: str, value: str, now: float):
+        # 调用方需持有 self._lock
+        self._memory[key] = (now + self.ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    # ==================== 磁盘层 ====================
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _disk_set(self, key: str, value: str, now: float):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免其他进程读到半个文件
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": now + self.ttl, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_sets += 1
+                should_evict = self._disk_sets % self.disk_evict_interval == 0
+            if should_evict:
+                self._disk_evict()
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败: %s", e)
+
+    def _disk_evict(self):
+        """磁盘缓存超过大小上限时，按修改时间从旧到新删除"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= self.disk_max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self._counters["evictions"] += 1
+            except OSError:
+                pass
+
+
+# 单例
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """获取 LLM 缓存单例"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMCache()
+    return _llm_cache
@@ -0,0 +1,535 @@
+"""
+LLM 录制/回放 - 不依赖网络地运行完整流程，用于基准测试和回归
+
+LLM_REPLAY_MODE：
+- off（默认）：直接调用上游
+- record：照常调用上游，同时把每次调用的输出和耗时写入 LLM_REPLAY_DIR 下的 fixture 文件
+- replay：不发出网络请求，从 fixture 文件返回之前录制的输出，并按 LLM_REPLAY_LATENCY 模拟延迟
+
+fixture 以请求内容寻址（与 services/llm_cache.py 的缓存键相同），每个调用一个 JSON 文件，
+可以手工编辑或直接编写。回放时请求找不到完全相同的 fixture（例如目标文本不同）：
+LLM_REPLAY_MISS=nearest（默认）使用同一模型下消息前缀最相近的 fixture，error 则抛出 ReplayMissError。
+请求的 max_tokens 小于录制时 usage 中的输出 token 数时，回放按比例截断输出并返回 finish_reason=length，
+与上游达到 max_tokens 时的行为一致，可以离线检查输出预算是否会导致截断。
+
+录制/回放包装在 services/http_client.py 的 get_openai_client / get_async_openai_client 中生效，
+所有经过共享客户端的调用（拆解、补充问题、快速任务）都会被录制或回放；流式调用回放时按录制的
+首包时间和总耗时分段产出。test/stub_llm_server.py 使用同一批 fixture 提供 OpenAI 兼容的 HTTP 接口。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from services.llm_cache import make_cache_key
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test", "fixtures", "llm")
+
+# 回放流式响应时每段的字符数
+STREAM_CHUNK_CHARS = 32
+
+
+class ReplayMissError(LookupError):
+    """回放模式下没有可用的 fixture"""
+
+
+def fixture_key(request: Dict[str, Any]) -> str:
+    """请求对应的 fixture 键"""
+    return make_cache_key(request["model"], request["messages"], request.get("temperature"), request.get("max_tokens"))
+
+
+def _prompt_text(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{m.get('role')}:{m.get('content') or ''}" for m in messages)
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class FixtureStore:
+    """fixture 目录：按键查找，找不到时按消息前缀匹配最相近的一条"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._fixtures: Optional[Dict[str, Dict[str, Any]]] = None
+        # 未命中请求 → 选中的 fixture 键，相同请求只匹配一次
+        self._nearest: Dict[str, Optional[str]] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._fixtures is None:
+            with self._lock:
+                if self._fixtures is None:
+                    fixtures = {}
+                    if os.path.isdir(self.directory):
+                        for name in sorted(os.listdir(self.directory)):
+                            if not name.endswith(".json"):
+                                continue
+                            try:
+                                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                                    fixture = json.load(f)
+                                fixtures[fixture.get("key") or fixture_key(fixture["request"])] = fixture
+                            except (OSError, ValueError, KeyError) as e:
+                                logger.warning("跳过无法读取的 fixture %s: %s", name, e)
+                    logger.info("已加载 %s 个 LLM fixture: %s", len(fixtures), self.directory)
+                    self._fixtures = fixtures
+        return self._fixtures
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(list(self._load().values()))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._load().get(key)
+
+    def models(self) -> List[str]:
+        """fixture 中出现过的模型"""
+        return sorted({f["request"].get("model") for f in self._load().values()} - {None})
+
+    def nearest(self, key: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """同一模型下消息前缀最长的 fixture（该模型没有 fixture 时在全部 fixture 中找）"""
+        fixtures = self._load()
+        with self._lock:
+            if key in self._nearest:
+                chosen = self._nearest[key]
+                return fixtures.get(chosen) if chosen else None
+
+        candidates = [(k, f) for k, f in fixtures.items() if f["request"].get("model") == request["model"]]
+        if not candidates:
+            candidates = list(fixtures.items())
+        text = _prompt_text(request["messages"])
+        best_key, best_len = None, -1
+        for k, fixture in candidates:
+            length = _common_prefix(text, _prompt_text(fixture["request"]["messages"]))
+            if length > best_len:
+                best_key, best_len = k, length
+
+        with self._lock:
+            self._nearest[key] = best_key
+        return fixtures.get(best_key) if best_key else None
+
+    def save(self, fixture: Dict[str, Any]):
+        """写入一条 fixture（先写临时文件再替换，避免并发录制时读到半个文件）"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{fixture['key'][:16]}.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._fixtures is not None:
+                self._fixtures[fixture["key"]] = fixture
+
+
+def make_fixture(request: Dict[str, Any], content: str, finish_reason: Optional[str], usage: Any,
+                 latency: float, first_chunk: Optional[float] = None) -> Dict[str, Any]:
+    """由一次真实调用生成 fixture"""
+    if usage is not None and hasattr(usage, "model_dump"):
+        usage = usage.model_dump(exclude_none=True)
+    return {
+        "key": fixture_key(request),
+        "request": {
+            "model": request["model"],
+            "messages": request["messages"],
+            "temperature": request.get("temperature"),
+            "max_tokens": request.get("max_tokens"),
+        },
+        "response": {
+            "content": content,
+            "finish_reason": finish_reason or "stop",
+            "usage": usage,
+        },
+        "latency_s": round(latency, 3),
+        "first_chunk_s": round(first_chunk if first_chunk is not None else latency, 3),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def replay_response(fixture: Dict[str, Any], max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """按请求的 max_tokens 回放 fixture 的响应
+
+    录制的输出 token 数（usage.completion_tokens，含推理 token）超过 max_tokens 时，先扣除推理 token，
+    再按剩余的比例截断输出文本，finish_reason 为 length。没有录制 usage 时原样返回。
+    """
+    response = fixture["response"]
+    usage = response.get("usage") or {}
+    completion_tokens = usage.get("completion_tokens")
+    if not max_tokens or not completion_tokens or completion_tokens <= max_tokens:
+        return response
+    reasoning_tokens = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens") or 0
+    output_tokens = completion_tokens - reasoning_tokens
+    content = response["content"] or ""
+    kept = max(0, max_tokens - reasoning_tokens)
+    content = content[:len(content) * kept // output_tokens] if output_tokens > 0 else ""
+    usage = dict(usage, completion_tokens=max_tokens, total_tokens=(usage.get("prompt_tokens") or 0) + max_tokens)
+    if reasoning_tokens:
+        usage["completion_tokens_details"] = dict(usage["completion_tokens_details"],
+                                                  reasoning_tokens=min(reasoning_tokens, max_tokens))
+    return dict(response, content=content, finish_reason="length", usage=usage)
+
+
+def completion_payload(fixture: Dict[str, Any], model: str, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """fixture → chat.completion 响应体"""
+    response = replay_response(fixture, max_tokens)
+    payload = {
+        "id": f"replay-{fixture['key'][:16]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": response["content"]},
+            "finish_reason": response.get("finish_reason") or "stop",
+        }],
+    }
+    if response.get("usage"):
+        payload["usage"] = response["usage"]
+    return payload
+
+
+def chunk_payloads(fixture: Dict[str, Any], model: str, max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+    """fixture → chat.completion.chunk 响应体序列（最后一段带 finish_reason）"""
+    response = replay_response(fixture, max_tokens)
+    content = response["content"] or ""
+    base = {"id": f"replay-{fixture['key'][:16]}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+    pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+    chunks = [
+        dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": piece} if i == 0 else {"content": piece},
+                             "finish_reason": None}])
+        for i, piece in enumerate(pieces)
+    ]
+    chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": response.get("finish_reason") or "stop"}]))
+    return chunks
+
+
+class LatencyModel:
+    """回放时的模拟延迟
+
+    setting 为 "recorded" 时使用录制的耗时，为数字时固定为该秒数；scale 对两者都生效。
+    """
+
+    def __init__(self, setting: str = "recorded", scale: float = 1.0):
+        self.recorded = setting.lower() == "recorded"
+        self.fixed = 0.0 if self.recorded else float(setting)
+        self.scale = scale
+
+    def delays(self, fixture: Dict[str, Any]) -> Tuple[float, float]:
+        """(首包时间, 总耗时)"""
+        if self.recorded:
+            total = float(fixture.get("latency_s") or 0.0)
+            first = float(fixture.get("first_chunk_s") or total)
+        else:
+            total = first = self.fixed
+        return first * self.scale, max(first, total) * self.scale
+
+    def stream_schedule(self, fixture: Dict[str, Any], chunks: int) -> List[float]:
+        """每段之前的等待时间：首段等待首包时间，其余时间均摊到后续各段"""
+        first, total = self.delays(fixture)
+        rest = (total - first) / (chunks - 1) if chunks > 1 else 0.0
+        return [first] + [rest] * (chunks - 1)
+
+
+# ---------- 同步客户端包装 ----------
+
+class _ReplayStream:
+    """回放的流式响应（支持 with 和迭代，与 openai.Stream 的用法一致）"""
+
+    def __init__(self, chunks: List[Dict[str, Any]], schedule: List[float]):
+        self._chunks = chunks
+        self._schedule = schedule
+
+    def __iter__(self) -> Iterator[ChatCompletionChunk]:
+        for chunk, delay in zip(self._chunks, self._schedule):
+            if delay > 0:
+                time.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class _RecordingStream:
+    """包装真实的流式响应：边产出边累计内容，读完后写入 fixture"""
+
+    def __init__(self, stream, request: Dict[str, Any], start: float, on_done: Callable[[Dict[str, Any]], None]):
+        self._stream = stream
+        self._request = request
+        self._start = start
+        self._on_done = on_done
+
+    def __iter__(self):
+        parts = []
+        first_chunk = None
+        finish_reason = None
+        usage = None
+        for chunk in self._stream:
+            if first_chunk is None:
+                first_chunk = time.monotonic() - self._start
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            usage = getattr(chunk, "usage", None) or usage
+            yield chunk
+        self._on_done(make_fixture(self._request, "".join(parts), finish_reason, usage,
+                                   time.monotonic() - self._start, first_chunk))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+
+
+class _Completions:
+    def __init__(self, recorder: "LLMRecorder", client):
+        self._recorder = recorder
+        self._client = client
+
+    def create(self, **kwargs):
+        recorder = self._recorder
+        if recorder.mode == "replay":
+            fixture = recorder.lookup(kwargs)
+            if kwargs.get("stream"):
+                chunks = chunk_payloads(fixture, kwargs["model"], kwargs.get("max_tokens"))
+                return _ReplayStream(chunks, recorder.latency.stream_schedule(fixture, len(chunks)))
+            _, total = recorder.latency.delays(fixture)
+            if total > 0:
+                time.sleep(total)
+            return ChatCompletion.model_validate(completion_payload(fixture, kwargs["model"], kwargs.get("max_tokens")))
+
+        start = time.monotonic()
+        response = self._client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _RecordingStream(response, kwargs, start, recorder.record)
+        recorder.record(make_fixture(
+            kwargs, response.choices[0].message.content, response.choices[0].finish_reason,
+            response.usage, time.monotonic() - start
+        ))
+        return response
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class ReplayClient:
+    """只实现 chat.completions.create 的 OpenAI 客户端替身"""
+
+    def __init__(self, recorder: "LLMRecorder", client=None):
+        self.chat = _Chat(_Completions(recorder, client))
+
+
+# ---------- 异步客户端包装 ----------
+
+class _AsyncReplayStream:
+    """_ReplayStream 的异步版本"""
+
+    def __init__(self, chunks: List[Dict[str, Any]], schedule: List[float]):
+        self._chunks = chunks
+        self._schedule = schedule
+
+    async def __aiter__(self):
+        for chunk, delay in zip(self._chunks, self._schedule):
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        pass
+
+
+class _AsyncRecordingStream:
+    """_RecordingStream 的异步版本"""
+
+    def __init__(self, stream, request: Dict[str, Any], start: float, on_done: Callable[[Dict[str, Any]], None]):
+        self._stream = stream
+        self._request = request
+        self._start = start
+        self._on_done = on_done
+
+    async def __aiter__(self):
+        parts = []
+        first_chunk = None
+        finish_reason = None
+        usage = None
+        async for chunk in self._stream:
+            if first_chunk is None:
+                first_chunk = time.monotonic() - self._start
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            usage = getattr(chunk, "usage", None) or usage
+            yield chunk
+        self._on_done(make_fixture(self._request, "".join(parts), finish_reason, usage,
+                                   time.monotonic() - self._start, first_chunk))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._stream.close()
+
+
+class _AsyncCompletions:
+    def __init__(self, recorder: "LLMRecorder", client_factory):
+        self._recorder = recorder
+        # 真实的异步客户端绑定在事件循环上，每次调用时按当前循环获取
+        self._client_factory = client_factory
+
+    async def create(self, **kwargs):
+        recorder = self._recorder
+        if recorder.mode == "replay":
+            fixture = recorder.lookup(kwargs)
+            if kwargs.get("stream"):
+                chunks = chunk_payloads(fixture, kwargs["model"], kwargs.get("max_tokens"))
+                return _AsyncReplayStream(chunks, recorder.latency.stream_schedule(fixture, len(chunks)))
+            _, total = recorder.latency.delays(fixture)
+            if total > 0:
+                await asyncio.sleep(total)
+            return ChatCompletion.model_validate(completion_payload(fixture, kwargs["model"], kwargs.get("max_tokens")))
+
+        start = time.monotonic()
+        response = await self._client_factory().chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _AsyncRecordingStream(response, kwargs, start, recorder.record)
+        recorder.record(make_fixture(
+            kwargs, response.choices[0].message.content, response.choices[0].finish_reason,
+            response.usage, time.monotonic() - start
+        ))
+        return response
+
+
+class AsyncReplayClient:
+    """ReplayClient 的异步版本（对应 AsyncOpenAI）"""
+
+    def __init__(self, recorder: "LLMRecorder", client_factory: Optional[Callable[[], Any]] = None):
+        self.chat = _Chat(_AsyncCompletions(recorder, client_factory))
+
+
+class LLMRecorder:
+    """按 LLM_REPLAY_* 环境变量录制或回放 LLM 调用"""
+
+    def __init__(self):
+        mode = os.getenv("LLM_REPLAY_MODE", "off").lower()
+        self.mode = mode if mode in ("record", "replay") else "off"
+        self.store = FixtureStore(os.getenv("LLM_REPLAY_DIR") or DEFAULT_FIXTURE_DIR)
+        self.latency = LatencyModel(
+            os.getenv("LLM_REPLAY_LATENCY", "recorded"),
+            float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1"))
+        )
+        self.miss_policy = "error" if os.getenv("LLM_REPLAY_MISS", "nearest").lower() == "error" else "nearest"
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self._counters = {
+            "hits": 0,          # 请求与 fixture 完全一致
+            "nearest": 0,       # 使用了最相近的 fixture
+            "misses": 0,        # 没有可用的 fixture
+            "recorded": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def lookup(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """回放：查找请求对应的 fixture"""
+        key = fixture_key(request)
+        fixture = self.store.get(key)
+        if fixture is not None:
+            self._count("hits")
+            return fixture
+        if self.miss_policy == "nearest":
+            fixture = self.store.nearest(key, request)
+            if fixture is not None:
+                self._count("nearest")
+                return fixture
+        self._count("misses")
+        raise ReplayMissError(f"没有与请求匹配的 LLM fixture（模型 {request['model']}，目录 {self.store.directory}）")
+
+    def record(self, fixture: Dict[str, Any]):
+        """录制：保存一条 fixture（写入失败不影响调用本身）"""
+        try:
+            self.store.save(fixture)
+            self._count("recorded")
+        except OSError as e:
+            logger.warning("写入 LLM fixture 失败: %s", e)
+
+    def client(self, factory: Callable[[], Any]) -> ReplayClient:
+        """同步客户端包装；factory 返回真实客户端，只在录制模式下调用"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = ReplayClient(self, factory() if self.mode == "record" else None)
+        return self._client
+
+    def async_client(self, factory: Callable[[], Any]) -> AsyncReplayClient:
+        """异步客户端包装；录制模式下每次调用时通过 factory 取当前事件循环的真实客户端"""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = AsyncReplayClient(self, factory if self.mode == "record" else None)
+        return self._async_client
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({
+            "mode": self.mode,
+            "directory": self.store.directory,
+            "miss_policy": self.miss_policy,
+        })
+        if self.enabled:
+            stats["fixtures"] = len(self.store)
+        return stats
+
+
+# 单例
+_llm_recorder = None
+_llm_recorder_lock = threading.Lock()
+
+
+def get_llm_recorder() -> LLMRecorder:
+    """获取 LLM 录制/回放单例"""
+    global _llm_recorder
+    if _llm_recorder is None:
+        with _llm_recorder_lock:
+            if _llm_recorder is None:
+                _llm_recorder = LLMRecorder()
+    return _llm_recorder
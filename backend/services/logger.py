@@ -0,0 +1,197 @@
+"""
+结构化日志 - 替代各模块中的 print 调试输出
+
+- 分级：LOG_LEVEL（默认 INFO）以下的日志在调用处直接返回，参数不会被格式化
+- 惰性格式化：使用 logger.debug("... %s", obj) 的参数形式，只有真正输出时才调用 str()；
+  构造参数本身就很昂贵时用 lazy(lambda: ...) 包装
+- 采样：LOG_DEBUG_SAMPLE_RATE 控制 DEBUG 日志的保留比例；单条日志也可以通过 extra={"sample": 0.01} 指定
+- 非阻塞：LOG_ASYNC=true（默认）时日志先进入队列，由后台线程格式化并写出，调用线程不格式化也不等待 stdout
+- 结构化：LOG_FORMAT=json 时每条日志输出一行 JSON，extra 中的字段原样作为 JSON 字段
+
+用法：
+    from services.logger import get_logger, lazy
+    logger = get_logger(__name__)
+    logger.info("任务拆解完成", extra={"project_id": project_id, "elapsed_ms": 1234})
+    logger.debug("tasks 内容: %s", lazy(lambda: json.dumps(tasks, ensure_ascii=False)))
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import traceback
+from datetime import datetime
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+# 日志在各模块导入时就完成配置，需要先读取 .env 中的 LOG_* 设置
+load_dotenv()
+
+# 所有业务日志都挂在这个命名空间下，不影响第三方库（werkzeug、httpx 等）的日志配置
+ROOT_LOGGER = "task"
+
+# LogRecord 的内置属性，其余属性视为 extra 中的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+class lazy:
+    """惰性求值的日志参数：只有日志真正输出时才调用 fn"""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Callable[[], Any]):
+        self.fn = fn
+
+    def __str__(self) -> str:
+        return str(self.fn())
+
+    def __repr__(self) -> str:
+        return repr(self.fn())
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # 经过队列的日志在入队时已把异常转成文本
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于人工阅读的单行格式，extra 字段以 key=value 附在末尾"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(name)s: %(message)s", datefmt="%H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """按比例丢弃 DEBUG 日志（WARNING 及以上不采样）"""
+
+    def __init__(self, debug_rate: float):
+        super().__init__()
+        self.debug_rate = debug_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample", None)
+        if rate is None:
+            if record.levelno > logging.DEBUG:
+                return True
+            rate = self.debug_rate
+        return rate >= 1 or random.random() < rate
+
+
+# 可以延后到后台线程再拼接的参数类型（不可变）
+_SCALAR_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """入队时不格式化的 QueueHandler
+
+    标准库的 QueueHandler.prepare 会在调用线程上执行完整的 format（拼接消息、格式化异常），
+    这里只做必须在调用线程完成的部分，格式化交给后台线程：
+    - 参数全部是字符串、数字等不可变的标量时，消息留给后台线程拼接
+    - 参数中有其他对象（list/dict、业务对象等）时在调用线程上拼接消息，
+      避免调用方之后修改对象（包括嵌套的内容）影响输出
+    - 异常信息转成文本（traceback 引用的栈帧在调用返回后会变化），其余按原样入队
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        args = record.args
+        values = args.values() if isinstance(args, dict) else (args or ())
+        if not all(isinstance(value, _SCALAR_TYPES) for value in values):
+            record.msg = record.getMessage()
+            record.args = None
+        elif isinstance(args, dict):
+            # 按名称引用参数时 args 就是调用方传入的字典本身
+            record.args = dict(args)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip("\n")
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_setup_lock = threading.Lock()
+_configured = False
+
+
+def setup_logging(force: bool = False):
+    """按环境变量配置业务日志（重复调用无副作用；force=True 时按当前环境变量重新配置）"""
+    global _listener, _configured
+    with _setup_lock:
+        if _configured and not force:
+            return
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+        root = logging.getLogger(ROOT_LOGGER)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+
+        level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+        root.setLevel(level)
+        root.propagate = False
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JSONFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else TextFormatter())
+
+        if os.getenv("LOG_ASYNC", "true").lower() == "true":
+            log_queue = queue.SimpleQueue()
+            handler = DeferredQueueHandler(log_queue)
+            _listener = logging.handlers.QueueListener(log_queue, output)
+            _listener.start()
+        else:
+            handler = output
+        # 采样放在入口 handler 上：被丢弃的日志不会进入队列，也不会被格式化
+        handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1"))))
+        root.addHandler(handler)
+        _configured = True
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志（进程退出时自动调用）"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取业务日志记录器（首次调用时完成配置）"""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
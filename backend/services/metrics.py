@@ -0,0 +1,238 @@
+"""
+LLM 调用指标 - 按 Agent / 模型统计延迟、token 用量和费用，以 Prometheus 文本格式导出
+
+每次上游调用（包括重试的每一次尝试）记录：Agent 名称、模型、第几次尝试、结果、
+prompt/completion token 数（来自 response.usage）和耗时。
+指标保存在进程内；gunicorn 多 worker 部署时每个 worker 各自导出自己的指标。
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, BadRequestError, RateLimitError
+
+from services.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from services.hedging import get_hedger
+from services.rate_limiter import get_rate_limiter, model_env_suffix
+
+# 延迟直方图的桶（秒）：分析模型通常在几秒内，思考模型可达数分钟
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """可任意设置的瞬时值"""
+
+    kind = "gauge"
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class CounterSnapshot(Counter):
+    """由其他模块维护的累计计数，导出时从其统计快照中读取（类型仍为 counter，值只增不减）"""
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """累积桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._lock = threading.Lock()
+        # 标签值 → [各桶计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, *label_values: str, value: float):
+        with self._lock:
+            row = self._values.get(label_values)
+            if row is None:
+                row = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(row)) for key, row in self._values.items())
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(row[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {_format_value(row[-1])}")
+        return lines
+
+
+def classify_outcome(error: Optional[BaseException]) -> str:
+    """把调用结果归类为有限的几种，作为指标标签"""
+    if error is None:
+        return "success"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, RateLimitError):
+        return "rate_limited"
+    if isinstance(error, APITimeoutError):
+        return "timeout"
+    if isinstance(error, APIConnectionError):
+        return "connection_error"
+    if isinstance(error, BadRequestError):
+        return "bad_request"
+    if isinstance(error, APIStatusError):
+        return "server_error" if error.status_code >= 500 else "client_error"
+    if isinstance(error, BaseException) and not isinstance(error, Exception):
+        return "cancelled"
+    return "error"
+
+
+class LLMMetrics:
+    """LLM 调用指标
+
+    费用按 LLM_PRICE_ANALYSIS / LLM_PRICE_GENERATION / LLM_PRICE_DEFAULT 计算，
+    格式为"输入单价,输出单价"（元 / 百万 token），未配置时不统计费用。
+    """
+
+    def __init__(self):
+        labels = ("agent", "model")
+        self.requests = Counter(
+            "llm_requests_total", "上游 LLM 调用次数（每次尝试计一次）", labels + ("attempt", "outcome"))
+        self.latency = Histogram(
+            "llm_request_duration_seconds", "上游 LLM 调用耗时（流式调用为收到响应头的时间）", labels)
+        self.tokens = Counter("llm_tokens_total", "response.usage 中的 token 数", labels + ("kind",))
+        self.cost = Counter("llm_cost_yuan_total", "按配置单价估算的费用（元）", labels)
+        self._metrics = [self.requests, self.latency, self.tokens, self.cost]
+        self._prices: Dict[str, Optional[Tuple[float, float]]] = {}
+
+    def _price(self, model: str) -> Optional[Tuple[float, float]]:
+        if model not in self._prices:
+            raw = os.getenv(f"LLM_PRICE_{model_env_suffix(model)}", "")
+            try:
+                prompt_price, completion_price = (float(part) for part in raw.split(","))
+                self._prices[model] = (prompt_price, completion_price)
+            except ValueError:
+                self._prices[model] = None
+        return self._prices[model]
+
+    def record(
+        self,
+        agent: str,
+        model: str,
+        attempt: int,
+        latency: float,
+        error: Optional[BaseException] = None,
+        usage: Any = None
+    ):
+        """记录一次上游调用"""
+        agent = agent or "unknown"
+        self.requests.inc(agent, model, str(attempt), classify_outcome(error))
+        if error is None:
+            self.latency.observe(agent, model, value=latency)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        if prompt_tokens or completion_tokens:
+            self.tokens.inc(agent, model, "prompt", amount=prompt_tokens)
+            self.tokens.inc(agent, model, "completion", amount=completion_tokens)
+            price = self._price(model)
+            if price is not None:
+                cost = (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+                self.cost.inc(agent, model, amount=cost)
+
+    def _state_metrics(self) -> List[Counter]:
+        """限流、熔断、对冲的当前状态和累计计数（导出时从各模块的统计中生成）"""
+        waiting = Gauge("llm_rate_limit_waiting", "正在排队等待限流许可的调用数", ("model",))
+        wait_total = CounterSnapshot("llm_rate_limit_wait_seconds_total", "累计排队等待时间（秒）", ("model",))
+        throttled = CounterSnapshot("llm_rate_limit_throttled_total", "上游返回 429 的次数", ("model",))
+        for model, stats in get_rate_limiter().get_stats()["models"].items():
+            waiting.set(model, value=stats["waiting"])
+            wait_total.set(model, value=stats["wait_total_s"])
+            throttled.set(model, value=stats["throttled"])
+
+        circuit = Gauge("llm_circuit_state", "熔断状态（0 正常，1 探测中，2 熔断）", ("model",))
+        rejected = CounterSnapshot("llm_circuit_rejected_total", "熔断期间被直接拒绝的调用数", ("model",))
+        states = {"closed": 0, "half_open": 1, "open": 2}
+        for model, stats in get_circuit_breaker().get_stats()["models"].items():
+            circuit.set(model, value=states[stats["state"]])
+            rejected.set(model, value=stats["rejected"])
+
+        hedge_stats = get_hedger().get_stats()
+        hedges = CounterSnapshot("llm_hedge_total", "对冲请求统计", ("kind",))
+        for kind in ("calls", "hedged", "hedge_wins", "capped", "congested"):
+            hedges.set(kind, value=hedge_stats[kind])
+        return [waiting, wait_total, throttled, circuit, rejected, hedges]
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics + self._state_metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# 单例
+_llm_metrics = None
+_llm_metrics_lock = threading.Lock()
+
+
+def get_llm_metrics() -> LLMMetrics:
+    """获取 LLM 指标单例"""
+    global _llm_metrics
+    if _llm_metrics is None:
+        with _llm_metrics_lock:
+            if _llm_metrics is None:
+                _llm_metrics = LLMMetrics()
+    return _llm_metrics
@@ -4,17 +4,22 @@ Agent A: 提取节点框架
 Agent B: 生成操作指南
 """
 import json
+import os
 import uuid
 from typing import List, Dict, Any
 from openai import OpenAI
-import httpx
-import os
 from dotenv import load_dotenv
 
 from models.schema import (
     Checkpoint, QuickTaskResponse, QuickTaskMeta,
-    RawCheckpoint, StepGuide
+    RawCheckpoint, RawCheckpointList, StepGuide
 )
+from services.http_client import get_openai_client
+from services.circuit_breaker import CircuitOpenError
+from services.structured_output import create_chat_completion, loads_json_object
+from services.logger import get_logger
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
@@ -23,16 +28,13 @@ class QuickTaskService:
     """快速任务服务 - 分阶段处理"""
 
     def __init__(self):
-        self.api_key = os.getenv("SILICONFLOW_API_KEY")
-        self.base_url = os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1")
+        # Agent B 并行生成指南时的并发上限和整体超时（秒）
+        self.guide_concurrency = max(1, int(os.getenv("QUICK_TASK_GUIDE_CONCURRENCY", "4")))
+        self.guide_timeout = float(os.getenv("QUICK_TASK_GUIDE_TIMEOUT", "60"))
 
     def get_client(self) -> OpenAI:
-        """获取 OpenAI 客户端"""
-        return OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            http_client=httpx.Client(verify=False, timeout=120.0)
-        )
+        """获取 OpenAI 客户端（与 AIService 共享同一个连接池）"""
+        return get_openai_client()
 
     def generate_checkpoints(self, idea: str, time_estimate: str = None) -> Dict[str, Any]:
         """
@@ -43,12 +45,12 @@ class QuickTaskService:
             - Agent A: 提取节点框架
             - 搜索专业资料（使用 AI 内置知识）
 
-        阶段2（串行）：
+        阶段2（并行）：
             - Agent B: 为每个节点生成量化标准
         """
         import concurrent.futures
 
-        print(f"[QuickTask] 开始处理: {idea}")
+        logger.info("开始处理: %s", idea)
 
         # 阶段1：并行执行
         with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
@@ -58,7 +60,7 @@ class QuickTaskService:
             raw_checkpoints = future_nodes.result()
             professional_summaries = future_materials.result()
 
-        print(f"[QuickTask] Agent A 提取了 {len(raw_checkpoints)} 个节点")
+        logger.info("Agent A 提取了 %s 个节点", len(raw_checkpoints))
 
         # 阶段2：Agent B 生成量化标准
         checkpoints = self._agent_b_generate_standards(
@@ -67,10 +69,22 @@ class QuickTaskService:
             professional_summaries=professional_summaries
         )
 
+        result = self._build_result(idea, checkpoints, professional_summaries)
+
+        logger.info("生成完成，共 %s 个检测节点", len(checkpoints))
+        return result
+
+    def _build_result(
+        self,
+        idea: str,
+        checkpoints: List[Checkpoint],
+        professional_summaries: List[str]
+    ) -> Dict[str, Any]:
+        """组装返回给前端的结果"""
         # 计算总时间
         total_time = self._calculate_total_time(checkpoints)
 
-        result = {
+        return {
             "mode": "quick",
             "original_idea": idea,
             "estimated_total_time": total_time,
@@ -98,20 +112,36 @@ class QuickTaskService:
             }
         }
 
-        print(f"[QuickTask] 生成完成，共 {len(checkpoints)} 个检测节点")
-        return result
-
     # ==================== 阶段1：Agent A ====================
 
     def _agent_a_extract_nodes(self, idea: str) -> List[RawCheckpoint]:
         """Agent A：提取节点框架"""
         client = self.get_client()
+        prompt = self._extract_nodes_prompt(idea)
 
-        prompt = f"""你是"任务节点提取专家"，专门从"快速上手"类文章中提取任务框架。
+        try:
+            response = create_chat_completion(
+                client,
+                response_model=RawCheckpointList,
+                agent="quick_nodes",
+                model="inclusionAI/Ling-flash-2.0",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=4096
+            )
+        except CircuitOpenError as e:
+            logger.warning("%s，使用默认节点框架", e)
+            return self._get_default_checkpoints()
 
-用户想法：{idea}
+        content = response.choices[0].message.content.strip()
+        return self._parse_raw_checkpoints(content)
+
+    def _extract_nodes_prompt(self, idea: str) -> str:
+        """Agent A 提示词"""
+        # 固定的说明和格式在前、用户想法在最后，提示开头在请求之间逐字节相同（可被上游前缀缓存复用）
+        prompt = f"""你是"任务节点提取专家"，专门从"快速上手"类文章中提取任务框架。
 
-请根据这个想法，提取出完成它的任务步骤框架。
+请根据最后给出的用户想法，提取出完成它的任务步骤框架。
 
 要求：
 1. 3-8个步骤
@@ -138,34 +168,31 @@ class QuickTaskService:
   ]
 }}
 
-只返回JSON，不要有其他内容。"""
-
-        response = client.chat.completions.create(
-            model="inclusionAI/Ling-flash-2.0",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=4096
-        )
+只返回JSON，不要有其他内容。
 
-        content = response.choices[0].message.content.strip()
-        return self._parse_raw_checkpoints(content)
+用户想法：{idea}"""
+        return prompt
 
     def _parse_raw_checkpoints(self, response: str) -> List[RawCheckpoint]:
         """解析节点框架"""
-        # 提取JSON
-        if "```json" in response:
-            start = response.find("```json") + 7
-            end = response.rfind("```")
-            if end != -1:
-                response = response[start:end].strip()
-        elif "```" in response:
-            start = response.find("```") + 3
-            end = response.find("```", start)
-            if end != -1:
-                response = response[start:end].strip()
+        # 快速路径：结构化输出时响应本身就是 JSON，跳过代码块提取
+        data = loads_json_object(response)
+        if data is None:
+            # 提取JSON
+            if "```json" in response:
+                start = response.find("```json") + 7
+                end = response.rfind("```")
+                if end != -1:
+                    response = response[start:end].strip()
+            elif "```" in response:
+                start = response.find("```") + 3
+                end = response.find("```", start)
+                if end != -1:
+                    response = response[start:end].strip()
 
         try:
-            data = json.loads(response)
+            if data is None:
+                data = json.loads(response)
             if "raw_checkpoints" in data:
                 raw_checkpoints = data["raw_checkpoints"]
             else:
@@ -181,7 +208,7 @@ class QuickTaskService:
                 for i, cp in enumerate(raw_checkpoints)
             ]
         except Exception as e:
-            print(f"[ERROR] 解析节点框架失败: {e}")
+            logger.error("解析节点框架失败: %s", e)
             return self._get_default_checkpoints()
 
     def _get_default_checkpoints(self) -> List[RawCheckpoint]:
@@ -198,12 +225,30 @@ class QuickTaskService:
     def _search_professional_materials(self, idea: str) -> List[str]:
         """搜索专业教程资料（使用 AI 内置知识）"""
         client = self.get_client()
+        prompt = self._materials_prompt(idea)
 
-        prompt = f"""你是"专业知识整理专家"。
+        try:
+            response = create_chat_completion(
+                client,
+                agent="quick_materials",
+                model="inclusionAI/Ling-flash-2.0",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=2048
+            )
 
-用户想法：{idea}
+            content = response.choices[0].message.content.strip()
+            return self._parse_materials(content)
+
+        except Exception as e:
+            logger.error("搜索专业资料失败: %s", e)
+            return self._get_default_materials()
 
-请提供关于完成这个想法的专业建议，包括：
+    def _materials_prompt(self, idea: str) -> str:
+        """专业资料提示词"""
+        prompt = f"""你是"专业知识整理专家"。
+
+请提供关于完成最后给出的用户想法的专业建议，包括：
 1. 最佳实践
 2. 常见的验收标准
 3. 每个环节应该注意的关键点
@@ -212,32 +257,22 @@ class QuickTaskService:
 返回5-8条专业建议，每条50字以内。用列表格式返回，每条格式为：
 - 建议内容
 
-只返回列表，不要其他内容。"""
+只返回列表，不要其他内容。
 
-        try:
-            response = client.chat.completions.create(
-                model="inclusionAI/Ling-flash-2.0",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=2048
-            )
-
-            content = response.choices[0].message.content.strip()
-
-            # 解析列表
-            summaries = []
-            for line in content.split('\n'):
-                line = line.strip()
-                if line.startswith('-'):
-                    summaries.append(line[1:].strip())
-                elif line and '：' in line or ':' in line:
-                    summaries.append(line)
+用户想法：{idea}"""
+        return prompt
 
-            return summaries[:8] if summaries else self._get_default_materials()
+    def _parse_materials(self, content: str) -> List[str]:
+        """解析专业建议列表"""
+        summaries = []
+        for line in content.split('\n'):
+            line = line.strip()
+            if line.startswith('-'):
+                summaries.append(line[1:].strip())
+            elif line and '：' in line or ':' in line:
+                summaries.append(line)
 
-        except Exception as e:
-            print(f"[ERROR] 搜索专业资料失败: {e}")
-            return self._get_default_materials()
+        return summaries[:8] if summaries else self._get_default_materials()
 
     def _get_default_materials(self) -> List[str]:
         """默认专业资料"""
@@ -257,25 +292,57 @@ class QuickTaskService:
         raw_checkpoints: List[RawCheckpoint],
         professional_summaries: List[str]
     ) -> List[Checkpoint]:
-        """Agent B：为每个节点生成操作指南"""
-        checkpoints = []
+        """Agent B：为每个节点生成操作指南
+
+        所有节点的指南并行生成（并发数受 guide_concurrency 限制），结果保持节点原有顺序；
+        单个节点超时或失败时使用默认指南，不影响整个任务。
+        """
+        import concurrent.futures
+        import time
+
+        if not raw_checkpoints:
+            return []
 
-        for raw_cp in raw_checkpoints:
-            guide = self._ai_generate_guide_for_node(
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.guide_concurrency, len(raw_checkpoints))
+        )
+        futures = [
+            executor.submit(
+                self._ai_generate_guide_for_node,
                 idea=idea,
                 node_name=raw_cp.name,
                 professional_summaries=professional_summaries
             )
+            for raw_cp in raw_checkpoints
+        ]
 
-            checkpoints.append(Checkpoint(
-                id=raw_cp.id,
-                name=raw_cp.name,
-                step_guide=guide,
-                estimated_time=raw_cp.estimated_time,
-                depends_on=raw_cp.depends_on,
-                check_method="self",
-                status="pending"
-            ))
+        # 整个阶段共享一个截止时间，避免超时节点串行累加等待
+        deadline = time.monotonic() + self.guide_timeout
+        checkpoints = []
+        try:
+            for raw_cp, future in zip(raw_checkpoints, futures):
+                try:
+                    guide = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except concurrent.futures.TimeoutError:
+                    logger.warning("节点 %s 指南生成超时，使用默认指南", raw_cp.name)
+                    future.cancel()
+                    guide = self._get_default_guide(raw_cp.name)
+                except Exception as e:
+                    logger.error("节点 %s 指南生成失败: %s", raw_cp.name, e)
+                    guide = self._get_default_guide(raw_cp.name)
+
+                checkpoints.append(Checkpoint(
+                    id=raw_cp.id,
+                    name=raw_cp.name,
+                    step_guide=guide,
+                    estimated_time=raw_cp.estimated_time,
+                    depends_on=raw_cp.depends_on,
+                    check_method="self",
+                    status="pending"
+                ))
+        finally:
+            # 不等待超时的节点，让请求尽快返回
+            executor.shutdown(wait=False, cancel_futures=True)
 
         return checkpoints
 
@@ -287,19 +354,36 @@ class QuickTaskService:
     ) -> StepGuide:
         """AI为单个节点生成操作指南"""
         client = self.get_client()
+        prompt = self._guide_prompt(idea, node_name, professional_summaries)
 
-        materials_text = "\n".join([f"- {s}" for s in professional_summaries])
+        try:
+            response = create_chat_completion(
+                client,
+                response_model=StepGuide,
+                agent="quick_guide",
+                model="inclusionAI/Ling-flash-2.0",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=2048,
+                timeout=self.guide_timeout
+            )
 
-        prompt = f"""你是"任务执行专家"，专门为任务节点生成具体的操作指南。
+            content = response.choices[0].message.content.strip()
+            return self._parse_guide(content)
 
-用户想法：{idea}
+        except Exception as e:
+            logger.error("生成操作指南失败: %s", e)
+            return self._get_default_guide(node_name)
 
-当前节点：{node_name}
+    def _guide_prompt(self, idea: str, node_name: str, professional_summaries: List[str]) -> str:
+        """Agent B 提示词"""
+        materials_text = "\n".join([f"- {s}" for s in professional_summaries])
 
-专业参考资料：
-{materials_text}
+        # 固定的说明和格式在前，同一次拆解的各节点共享的想法和参考资料居中，节点名称在最后：
+        # 并行生成各节点指南时，除最后一行外的提示都可被上游的前缀缓存复用
+        prompt = f"""你是"任务执行专家"，专门为任务节点生成具体的操作指南。
 
-请为这个节点生成具体的操作指南，告诉用户"如何做"。
+请为最后给出的当前节点生成具体的操作指南，告诉用户"如何做"。
 
 返回JSON格式：
 {{
@@ -324,39 +408,36 @@ class QuickTaskService:
 - completion_criteria: 2-4条清晰的验收标准
 - pain_points: 2-4条实用提醒
 
-只返回JSON，不要其他内容。"""
+只返回JSON，不要其他内容。
 
-        try:
-            response = client.chat.completions.create(
-                model="inclusionAI/Ling-flash-2.0",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=2048
-            )
+用户想法：{idea}
 
-            content = response.choices[0].message.content.strip()
-            return self._parse_guide(content)
+专业参考资料：
+{materials_text}
 
-        except Exception as e:
-            print(f"[ERROR] 生成操作指南失败: {e}")
-            return self._get_default_guide(node_name)
+当前节点：{node_name}"""
+        return prompt
 
     def _parse_guide(self, response: str) -> StepGuide:
         """解析操作指南"""
-        # 提取JSON
-        if "```json" in response:
-            start = response.find("```json") + 7
-            end = response.rfind("```")
-            if end != -1:
-                response = response[start:end].strip()
-        elif "```" in response:
-            start = response.find("```") + 3
-            end = response.find("```", start)
-            if end != -1:
-                response = response[start:end].strip()
+        # 快速路径：结构化输出时响应本身就是 JSON，跳过代码块提取
+        data = loads_json_object(response)
+        if data is None:
+            # 提取JSON
+            if "```json" in response:
+                start = response.find("```json") + 7
+                end = response.rfind("```")
+                if end != -1:
+                    response = response[start:end].strip()
+            elif "```" in response:
+                start = response.find("```") + 3
+                end = response.find("```", start)
+                if end != -1:
+                    response = response[start:end].strip()
 
         try:
-            data = json.loads(response)
+            if data is None:
+                data = json.loads(response)
             return StepGuide(
                 description=data.get("description", ""),
                 steps=data.get("steps", []),
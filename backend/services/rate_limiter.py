@@ -0,0 +1,346 @@
+"""
+上游 LLM 调用限流 - 进程内所有线程共享的令牌桶和并发上限
+
+每个模型一组限制（请求数/分钟、token 数/分钟、同时进行的调用数），调用在发出之前排队获取许可，
+而不是等上游返回 429 后各线程各自 sleep 重试：
+- 令牌桶采用预留方式：获取许可时立即扣减，余额不足时计算需要等待的时间，先到先得
+- 上游返回 429 时按 Retry-After（或带抖动的指数退避）暂停该模型的所有调用
+- 调用完成后按实际 usage 修正预扣的 token 数；流式调用在读完（或出错、关闭）时才归还许可
+- 额度按整个部署配置，每个 worker 进程取其中的 1/LLM_RATE_LIMIT_WORKERS（默认读取 gunicorn 的 WEB_CONCURRENCY）
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 默认额度（整个部署合计，按账户的实际额度调整）；DEFAULT 对应其他模型，不限制
+DEFAULT_LIMITS = {
+    "ANALYSIS": {"RPM": 1000, "TPM": 50000, "CONCURRENCY": 16},
+    "GENERATION": {"RPM": 500, "TPM": 100000, "CONCURRENCY": 8},
+    "DEFAULT": {"RPM": 0, "TPM": 0, "CONCURRENCY": 0},
+}
+
+
+# 获得许可时的回调（对冲请求据此从放行开始计时），按线程/协程上下文隔离
+_admission_listener: ContextVar[Optional[Callable[[], None]]] = ContextVar("llm_admission_listener", default=None)
+
+
+@contextmanager
+def admission_listener(callback: Callable[[], None]):
+    """当前上下文中的调用每次获得限流许可时调用 callback()"""
+    token = _admission_listener.set(callback)
+    try:
+        yield
+    finally:
+        _admission_listener.reset(token)
+
+
+def _notify_admitted():
+    listener = _admission_listener.get()
+    if listener is not None:
+        listener()
+
+
+def model_env_suffix(model: str) -> str:
+    """模型对应的配置后缀：MODEL_ANALYSIS → ANALYSIS，MODEL_GENERATION → GENERATION，其他 → DEFAULT"""
+    if model == os.getenv("MODEL_ANALYSIS", "inclusionAI/Ling-flash-2.0"):
+        return "ANALYSIS"
+    if model == os.getenv("MODEL_GENERATION", "moonshotai/Kimi-K2-Thinking"):
+        return "GENERATION"
+    return "DEFAULT"
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """带完全抖动的指数退避（attempt 从 0 开始），避免多个线程同时重试"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def estimate_request_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+    """粗略估计一次调用消耗的 token 数（预留用，完成后按实际 usage 修正）
+
+    提示词以中文为主，按约 2 个字符 1 个 token 估算；输出按 max_tokens 的四分之一预留。
+    """
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 2 + (max_tokens or 0) // 4
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从 429 响应头中读取 Retry-After（支持 retry-after-ms、秒数和 HTTP 日期）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _TokenBucket:
+    """按分钟速率匀速补充的令牌桶（调用方需持有锁）"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """扣减 amount，返回余额补足前需要等待的秒数"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # 单次超过桶容量时按容量计，避免永远等不到
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Permit:
+    """一次调用的许可；调用结束后 release，并可按实际 token 用量修正"""
+
+    def __init__(self, limiter: "_ModelLimiter", reserved_tokens: int, waited: float):
+        self._limiter = limiter
+        self.reserved_tokens = reserved_tokens
+        self.waited = waited
+        self._released = False
+
+    def release(self, used_tokens: Optional[int] = None):
+        if not self._released:
+            self._released = True
+            self._limiter.release(self, used_tokens)
+
+
+class _ModelLimiter:
+    """单个模型的限流状态"""
+
+    def __init__(self, model: str, rpm: int, tpm: int, concurrency: int):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._requests = _TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = _TokenBucket(tpm) if tpm > 0 else None
+        self._active = 0
+        self._blocked_until = 0.0
+        self._consecutive_throttles = 0
+        self._counters = {
+            "admitted": 0,
+            "delayed": 0,          # 需要排队等待的调用
+            "throttled": 0,        # 上游返回 429 的次数
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+        }
+        self._waiting = 0
+
+    # ---------- 获取许可 ----------
+
+    def _reserve(self, tokens: int) -> float:
+        """预留速率额度，返回需要等待的秒数（调用方需持有锁）"""
+        now = time.monotonic()
+        wait = max(0.0, self._blocked_until - now)
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.reserve(tokens, now))
+        return wait
+
+    def _admit(self, tokens: int, waited: float) -> Permit:
+        """计入统计（调用方需持有锁）"""
+        self._active += 1
+        self._counters["admitted"] += 1
+        if waited > 0.001:
+            self._counters["delayed"] += 1
+            self._counters["wait_total_s"] += waited
+            self._counters["wait_max_s"] = max(self._counters["wait_max_s"], waited)
+        return Permit(self, tokens, waited)
+
+    def acquire(self, tokens: int) -> Permit:
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+            wait = self._reserve(tokens)
+        try:
+            while wait > 0:
+                time.sleep(wait)
+                # 等待期间可能又收到 429，需要继续等到暂停结束
+                with self._lock:
+                    wait = self._blocked_until - time.monotonic()
+            with self._lock:
+                while self.concurrency > 0 and self._active >= self.concurrency:
+                    self._slot_freed.wait()
+                return self._admit(tokens, time.monotonic() - start)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    async def acquire_async(self, tokens: int) -> Permit:
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+            wait = self._reserve(tokens)
+        try:
+            while True:
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                with self._lock:
+                    wait = self._blocked_until - time.monotonic()
+                    if wait > 0:
+                        continue
+                    if self.concurrency <= 0 or self._active < self.concurrency:
+                        return self._admit(tokens, time.monotonic() - start)
+                # 并发名额已满：短暂让出事件循环后重试
+                wait = 0.05
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self, permit: Permit, used_tokens: Optional[int]):
+        with self._lock:
+            self._active -= 1
+            self._slot_freed.notify()
+            if used_tokens is not None and self._tokens is not None:
+                # 按实际用量修正预扣（多退少补）
+                diff = permit.reserved_tokens - used_tokens
+                if diff > 0:
+                    self._tokens.refund(diff)
+                else:
+                    self._tokens.reserve(-diff, time.monotonic())
+            if used_tokens is not None:
+                self._consecutive_throttles = 0
+
+    def congested(self) -> bool:
+        """是否有调用在排队、并发名额已满或处于 429 暂停中"""
+        with self._lock:
+            return (self._waiting > 0
+                    or (self.concurrency > 0 and self._active >= self.concurrency)
+                    or self._blocked_until > time.monotonic())
+
+    # ---------- 429 处理 ----------
+
+    def penalize(self, retry_after: Optional[float]) -> float:
+        """上游限流：暂停该模型的所有调用，返回暂停秒数"""
+        with self._lock:
+            self._counters["throttled"] += 1
+            if retry_after is None:
+                retry_after = backoff_delay(self._consecutive_throttles, base=2.0)
+            self._consecutive_throttles += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        return retry_after
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "waiting": self._waiting,
+                "blocked_for_s": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+            })
+        stats["wait_avg_s"] = round(stats["wait_total_s"] / stats["delayed"], 4) if stats["delayed"] else 0.0
+        stats["wait_total_s"] = round(stats["wait_total_s"], 4)
+        stats["wait_max_s"] = round(stats["wait_max_s"], 4)
+        return stats
+
+
+class RateLimiter:
+    """按模型管理限流器
+
+    MODEL_ANALYSIS 和 MODEL_GENERATION 分别读取 LLM_*_ANALYSIS / LLM_*_GENERATION 的配置，
+    其他模型读取 LLM_*_DEFAULT；值为 0 表示不限制。配置的是整个部署的额度，
+    限流状态保存在进程内，每个 worker 按 workers 平分（至少 1）。
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.workers = max(1, int(os.getenv("LLM_RATE_LIMIT_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"))
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelLimiter] = {}
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        limiter = self._models.get(model)
+        if limiter is None:
+            with self._lock:
+                limiter = self._models.get(model)
+                if limiter is None:
+                    suffix = model_env_suffix(model)
+                    limits = []
+                    for name in ("RPM", "TPM", "CONCURRENCY"):
+                        total = int(os.getenv(f"LLM_{name}_{suffix}", str(DEFAULT_LIMITS[suffix][name])))
+                        limits.append(max(1, total // self.workers) if self.enabled and total > 0 else 0)
+                    limiter = _ModelLimiter(model, *limits)
+                    self._models[model] = limiter
+        return limiter
+
+    def acquire(self, model: str, tokens: int) -> Permit:
+        """阻塞直到允许向上游发送该调用"""
+        permit = self._limiter(model).acquire(tokens)
+        _notify_admitted()
+        return permit
+
+    async def acquire_async(self, model: str, tokens: int) -> Permit:
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        permit = await self._limiter(model).acquire_async(tokens)
+        _notify_admitted()
+        return permit
+
+    def congested(self, model: str) -> bool:
+        """该模型再发请求是否需要排队（有调用在等待、并发已满或被上游限流暂停）"""
+        return self._limiter(model).congested()
+
+    def penalize(self, model: str, retry_after: Optional[float] = None) -> float:
+        """上游返回 429：按 Retry-After 暂停该模型的所有调用"""
+        delay = self._limiter(model).penalize(retry_after)
+        logger.warning("模型 %s 被上游限流，暂停 %.1f 秒", model, delay)
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = list(self._models.values())
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "models": {limiter.model: limiter.get_stats() for limiter in limiters},
+        }
+
+
+# 单例
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """获取限流器单例"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -0,0 +1,123 @@
+"""
+请求合并（single-flight）- 同一时刻完全相同的 LLM 请求只向上游发送一次
+
+第一个到达的调用者（leader）真正发起请求，其余相同请求等待并共享它的结果或异常。
+asyncio 版服务使用 ado：同一事件循环中的相同请求共享一个任务，统计与同步调用合并。
+"""
+import asyncio
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Call:
+    """一次进行中的上游调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按 key 合并并发的相同调用"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counters = {
+            "leader_calls": 0,   # 实际发往上游的调用
+            "deduplicated": 0,   # 被合并、直接共享结果的调用
+        }
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """执行 fn；若相同 key 的调用正在进行，则等待并共享其结果"""
+        if not self.enabled:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._counters["deduplicated"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["leader_calls"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.debug("合并了 %s 个相同的 LLM 请求", call.waiters)
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """do 的异步版本：同一事件循环中相同 key 的协程共享一个任务
+
+        用 shield 等待，某个调用方被取消时不影响共享同一任务的其他调用方。
+        """
+        if not self.enabled:
+            return await fn()
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            # 任务只能在创建它的事件循环中等待
+            if task is not None and task.get_loop() is loop:
+                self._counters["deduplicated"] += 1
+            else:
+                task = loop.create_task(fn())
+                self._tasks[key] = task
+                self._counters["leader_calls"] += 1
+                task.add_done_callback(lambda done: self._forget_task(key, done))
+        return await asyncio.shield(task)
+
+    def _forget_task(self, key: str, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._calls) + len(self._tasks)
+        total = stats["leader_calls"] + stats["deduplicated"]
+        stats["dedup_ratio"] = round(stats["deduplicated"] / total, 4) if total else 0.0
+        stats["enabled"] = self.enabled
+        return stats
+
+
+# 单例
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """获取请求合并单例"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
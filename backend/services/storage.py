@@ -0,0 +1,223 @@
+"""
+项目存储 - 可插拔的持久化后端
+
+- sqlite（默认）：WAL 模式，多个 gunicorn worker 进程共享同一个数据库文件，重启不丢数据
+- memory：进程内字典，用于测试或本地调试
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 记录是普通的 JSON 字典，必须包含 created_at 字段（用于排序和索引）；
+# 可选的 status 字段单独建索引，按状态计数和清理时不需要解析记录本身
+Record = Dict[str, Any]
+
+
+class MemoryStore:
+    """内存存储（单进程）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._data: Dict[str, Record] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Record]:
+        with self._lock:
+            record = self._data.get(key)
+            # 返回副本，与 SQLite 后端的语义保持一致：修改需要通过 put/update 写回
+            return copy.deepcopy(record) if record is not None else None
+
+    def put(self, key: str, record: Record):
+        with self._lock:
+            self._data[key] = copy.deepcopy(record)
+
+    def update(self, key: str, mutator: Callable[[Record], Any]) -> Optional[Record]:
+        """原子地读-改-写，记录不存在时返回 None"""
+        with self._lock:
+            record = self._data.get(key)
+            if record is None:
+                return None
+            record = copy.deepcopy(record)
+            mutator(record)
+            self._data[key] = record
+            return copy.deepcopy(record)
+
+    def list(self, statuses: Optional[Iterable[str]] = None) -> List[Tuple[str, Record]]:
+        """按 created_at 升序列出记录（statuses 不为空时只列出这些状态的记录）"""
+        statuses = set(statuses) if statuses is not None else None
+        with self._lock:
+            items = [(key, copy.deepcopy(record)) for key, record in self._data.items()
+                     if statuses is None or record.get("status") in statuses]
+        return sorted(items, key=lambda item: item[1].get("created_at", ""))
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def count_by_status(self) -> Dict[str, int]:
+        """各 status 的记录数"""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for record in self._data.values():
+                status = record.get("status")
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def delete_oldest(self, statuses: Iterable[str], keep: int) -> int:
+        """删除这些状态中除最新 keep 条以外的记录，返回删除的条数"""
+        statuses = set(statuses)
+        with self._lock:
+            keys = sorted((record.get("created_at", ""), key) for key, record in self._data.items()
+                          if record.get("status") in statuses)
+            stale = keys[:max(0, len(keys) - keep)]
+            for _, key in stale:
+                del self._data[key]
+        return len(stale)
+
+
+class SQLiteStore:
+    """SQLite 存储（WAL 模式，支持多进程并发读写）
+
+    每个集合一张表：id 主键 + created_at 索引 + (status, created_at) 索引，记录本身以 JSON 文本存储。
+    连接按线程（和进程）缓存，gunicorn fork 之后会自动重新建立连接。
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "id TEXT PRIMARY KEY, "
+            "created_at TEXT NOT NULL, "
+            "updated_at TEXT, "
+            "status TEXT, "
+            "data TEXT NOT NULL)"
+        )
+        # 旧版本创建的表没有 status 列：补上并从记录中回填
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+        if "status" not in columns:
+            conn.execute(f"ALTER TABLE {name} ADD COLUMN status TEXT")
+            conn.execute(f"UPDATE {name} SET status = json_extract(data, '$.status')")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_created_at ON {name}(created_at)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_status ON {name}(status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        # isolation_level=None：自动提交，需要事务时显式 BEGIN
+        conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Record]:
+        row = self._connect().execute(
+            f"SELECT data FROM {self.name} WHERE id = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, record: Record):
+        self._connect().execute(
+            f"INSERT OR REPLACE INTO {self.name} (id, created_at, updated_at, status, data) VALUES (?, ?, ?, ?, ?)",
+            (key, record.get("created_at", ""), record.get("updated_at"), record.get("status"),
+             json.dumps(record, ensure_ascii=False))
+        )
+
+    def update(self, key: str, mutator: Callable[[Record], Any]) -> Optional[Record]:
+        """原子地读-改-写（BEGIN IMMEDIATE 保证跨进程互斥），记录不存在时返回 None"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT data FROM {self.name} WHERE id = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            record = json.loads(row[0])
+            mutator(record)
+            conn.execute(
+                f"UPDATE {self.name} SET updated_at = ?, status = ?, data = ? WHERE id = ?",
+                (record.get("updated_at"), record.get("status"), json.dumps(record, ensure_ascii=False), key)
+            )
+            conn.execute("COMMIT")
+            return record
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list(self, statuses: Optional[Iterable[str]] = None) -> List[Tuple[str, Record]]:
+        """按 created_at 升序列出记录（statuses 不为空时只列出这些状态的记录，走索引）"""
+        if statuses is None:
+            rows = self._connect().execute(
+                f"SELECT id, data FROM {self.name} ORDER BY created_at"
+            ).fetchall()
+        else:
+            statuses = list(statuses)
+            rows = self._connect().execute(
+                f"SELECT id, data FROM {self.name} WHERE status IN ({', '.join('?' * len(statuses))}) "
+                "ORDER BY created_at", statuses
+            ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def delete(self, key: str) -> bool:
+        cursor = self._connect().execute(f"DELETE FROM {self.name} WHERE id = ?", (key,))
+        return cursor.rowcount > 0
+
+    def count_by_status(self) -> Dict[str, int]:
+        """各 status 的记录数（只读索引，不解析记录）"""
+        rows = self._connect().execute(
+            f"SELECT status, COUNT(*) FROM {self.name} GROUP BY status"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def delete_oldest(self, statuses: Iterable[str], keep: int) -> int:
+        """删除这些状态中除最新 keep 条以外的记录，返回删除的条数"""
+        statuses = list(statuses)
+        placeholders = ", ".join("?" * len(statuses))
+        cursor = self._connect().execute(
+            f"DELETE FROM {self.name} WHERE id IN ("
+            f"SELECT id FROM {self.name} WHERE status IN ({placeholders}) "
+            "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (*statuses, max(0, keep))
+        )
+        return cursor.rowcount
+
+
+def create_store(name: str, backend: Optional[str] = None, path: Optional[str] = None):
+    """按配置创建存储
+
+    Args:
+        name: 集合名（同时作为 SQLite 表名）
+        backend: sqlite / memory，默认读取 STORAGE_BACKEND
+        path: SQLite 文件路径，默认读取 STORAGE_PATH
+    """
+    backend = (backend or os.getenv("STORAGE_BACKEND", "sqlite")).lower()
+    if backend == "memory":
+        return MemoryStore(name)
+    if backend == "sqlite":
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "app.db")
+        return SQLiteStore(name, path or os.getenv("STORAGE_PATH", default_path))
+    raise ValueError(f"未知的存储后端: {backend}")
+
+
+# 单例
+_stores: Dict[str, Any] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name: str):
+    """获取指定集合的存储单例（projects / quick_tasks）"""
+    if name not in _stores:
+        with _stores_lock:
+            if name not in _stores:
+                _stores[name] = create_store(name)
+    return _stores[name]
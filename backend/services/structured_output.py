@@ -0,0 +1,364 @@
+"""
+结构化输出 - 让模型直接返回符合 schema 的 JSON
+
+调用时根据 models/schema.py 中的 pydantic 模型生成 response_format：
+- json_schema：按 schema 约束解码（模型支持时优先使用）
+- json_object：JSON 模式，只保证输出是合法 JSON 对象
+
+LLM_STRUCTURED_OUTPUT=auto 时先尝试 json_schema，某个模型返回 400 且错误信息指向 response_format
+（或不支持的参数）时自动降级为 json_object，再失败则对该模型关闭；降级状态按模型记录，进程内只探测一次。
+其他原因的 400（如提示词过长）直接抛出，不降级也不重发。
+
+所有调用在发出前都经过 services/circuit_breaker.py 的熔断检查和 services/rate_limiter.py 的限流许可，
+调用结果记录到 services/metrics.py。
+"""
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Type
+
+from openai import BadRequestError, RateLimitError
+from pydantic import BaseModel
+
+from services.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from services.metrics import get_llm_metrics
+from services.rate_limiter import estimate_request_tokens, get_rate_limiter, retry_after_seconds
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 降级顺序
+_MODES = ("json_schema", "json_object")
+
+# 400 的错误信息中出现这些内容时才认为是模型不支持 response_format
+_UNSUPPORTED_MARKERS = ("response_format", "json_schema", "json_object", "unsupported parameter", "unknown parameter")
+
+
+@lru_cache(maxsize=None)
+def _json_schema_for(response_model: Type[BaseModel]) -> Dict[str, Any]:
+    return {
+        "name": response_model.__name__,
+        "schema": response_model.model_json_schema(),
+        # 模型里有可选字段和字典类型，不使用严格模式
+        "strict": False,
+    }
+
+
+def loads_json_object(content: Optional[str]) -> Optional[Dict[str, Any]]:
+    """快速路径：响应本身就是 JSON 对象时直接解析，否则返回 None（交给代码块提取和修复）"""
+    if not content:
+        return None
+    content = content.strip()
+    if not content.startswith("{"):
+        return None
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class StructuredOutput:
+    """按模型记录可用的结构化输出方式"""
+
+    def __init__(self):
+        mode = os.getenv("LLM_STRUCTURED_OUTPUT", "auto").lower()
+        if mode == "auto":
+            mode = "json_schema"
+        self.default_mode = mode if mode in _MODES else None
+        self._lock = threading.Lock()
+        self._model_modes: Dict[str, Optional[str]] = {}
+        self._counters = {
+            "structured_requests": 0,   # 附带 response_format 的请求
+            "downgrades": 0,            # 模型不支持而降级的次数
+        }
+
+    def response_format(self, model: str, response_model: Type[BaseModel]) -> Optional[Dict[str, Any]]:
+        """该模型当前可用的 response_format；不支持时返回 None"""
+        with self._lock:
+            mode = self._model_modes.get(model, self.default_mode)
+        if mode == "json_schema":
+            return {"type": "json_schema", "json_schema": _json_schema_for(response_model)}
+        if mode == "json_object":
+            return {"type": "json_object"}
+        return None
+
+    def downgrade(self, model: str, failed_mode: str):
+        """模型拒绝了 failed_mode，降级到下一种方式（最后一级为不附带 response_format）"""
+        with self._lock:
+            current = self._model_modes.get(model, self.default_mode)
+            if current != failed_mode:
+                # 其他线程已经降级过
+                return
+            index = _MODES.index(failed_mode)
+            next_mode = _MODES[index + 1] if index + 1 < len(_MODES) else None
+            self._model_modes[model] = next_mode
+            self._counters["downgrades"] += 1
+        logger.warning("模型 %s 不支持 %s，降级为 %s", model, failed_mode, next_mode or '普通文本')
+
+    def record_request(self):
+        with self._lock:
+            self._counters["structured_requests"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["models"] = {model: mode or "off" for model, mode in self._model_modes.items()}
+        stats["default_mode"] = self.default_mode or "off"
+        return stats
+
+
+def _usage_tokens(response) -> Optional[int]:
+    """响应中的实际 token 用量（流式响应没有 usage，返回 None）"""
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class _GuardedStream:
+    """包装流式响应：读完、出错或关闭时才调用 on_done(error, used_tokens, usage)
+
+    on_done 只调用一次；used_tokens 优先取最后一段的 usage，没有时按提示词估算值加输出长度（约 2 个字符 1 个 token）估算，
+    输出同时计入 content 和思考模型的 reasoning_content。调用方提前停止读取（break、close）不算出错。
+    """
+
+    def __init__(self, stream, prompt_tokens: int, on_done: Callable[[Optional[BaseException], int, Any], None]):
+        self._stream = stream
+        self._prompt_tokens = prompt_tokens
+        self._on_done = on_done
+        self._output_chars = 0
+        self._usage = None
+        self._done = False
+
+    def _observe(self, chunk):
+        if chunk.choices:
+            delta = chunk.choices[0].delta
+            self._output_chars += len(getattr(delta, "content", None) or "")
+            self._output_chars += len(getattr(delta, "reasoning_content", None) or "")
+        self._usage = getattr(chunk, "usage", None) or self._usage
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if self._done:
+            return
+        self._done = True
+        used_tokens = getattr(self._usage, "total_tokens", None) or self._prompt_tokens + self._output_chars // 2
+        self._on_done(error, used_tokens, self._usage)
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except GeneratorExit:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._finish()
+
+    def __del__(self):
+        # 兜底：流对象没有读完也没有关闭就被丢弃时归还许可
+        self._finish()
+
+
+class _AsyncGuardedStream(_GuardedStream):
+    """_GuardedStream 的异步版本"""
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except GeneratorExit:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()
+
+
+def _is_unsupported_format(error: BadRequestError) -> bool:
+    """400 是否由 response_format 引起（按错误消息和响应体判断）"""
+    body = getattr(error, "body", None)
+    text = f"{getattr(error, 'message', '')} {json.dumps(body, ensure_ascii=False) if body else ''}".lower()
+    return any(marker in text for marker in _UNSUPPORTED_MARKERS)
+
+
+def _create(client, response_model: Optional[Type[BaseModel]], kwargs: Dict[str, Any]):
+    if response_model is None:
+        return client.chat.completions.create(**kwargs)
+
+    support = get_structured_output()
+    model = kwargs["model"]
+    while True:
+        response_format = support.response_format(model, response_model)
+        if response_format is None:
+            return client.chat.completions.create(**kwargs)
+        try:
+            response = client.chat.completions.create(response_format=response_format, **kwargs)
+            support.record_request()
+            return response
+        except BadRequestError as e:
+            if not _is_unsupported_format(e):
+                raise
+            support.downgrade(model, response_format["type"])
+
+
+async def _acreate(client, response_model: Optional[Type[BaseModel]], kwargs: Dict[str, Any]):
+    if response_model is None:
+        return await client.chat.completions.create(**kwargs)
+
+    support = get_structured_output()
+    model = kwargs["model"]
+    while True:
+        response_format = support.response_format(model, response_model)
+        if response_format is None:
+            return await client.chat.completions.create(**kwargs)
+        try:
+            response = await client.chat.completions.create(response_format=response_format, **kwargs)
+            support.record_request()
+            return response
+        except BadRequestError as e:
+            if not _is_unsupported_format(e):
+                raise
+            support.downgrade(model, response_format["type"])
+
+
+def create_chat_completion(
+    client,
+    response_model: Optional[Type[BaseModel]] = None,
+    agent: Optional[str] = None,
+    attempt: int = 1,
+    **kwargs
+):
+    """调用 chat.completions.create；指定 response_model 时附带 response_format
+
+    模型处于熔断状态时直接抛出 CircuitOpenError；否则先获取该模型的限流许可，
+    上游返回 429 时按 Retry-After 暂停该模型的所有调用后再抛出。
+    模型不支持当前的 response_format（返回 400 且错误信息指向它）时自动降级后重发，不消耗调用方的重试次数。
+    流式调用返回包装后的流对象，读完、出错或关闭时才归还许可（按实际输出长度修正预扣的 token），
+    并把整个流的耗时和中途的错误上报给熔断器和指标。
+    agent 和 attempt 只用于指标标签（见 services/metrics.py），不会发送给上游。
+    """
+    breaker = get_circuit_breaker()
+    limiter = get_rate_limiter()
+    metrics = get_llm_metrics()
+    model = kwargs["model"]
+    try:
+        probe = breaker.before_call(model)
+    except CircuitOpenError as e:
+        metrics.record(agent, model, attempt, 0.0, e)
+        raise
+    try:
+        permit = limiter.acquire(model, estimate_request_tokens(kwargs["messages"], kwargs.get("max_tokens")))
+    except BaseException as e:
+        # 排队期间被取消：归还探测名额
+        breaker.after_call(model, probe, e, 0.0)
+        raise
+    start = time.monotonic()
+
+    def finish(error: Optional[BaseException], used_tokens: Optional[int], usage: Any):
+        latency = time.monotonic() - start
+        breaker.after_call(model, probe, error, latency)
+        permit.release(used_tokens)
+        metrics.record(agent, model, attempt, latency, error, usage)
+
+    try:
+        response = _create(client, response_model, kwargs)
+    except BaseException as e:
+        if isinstance(e, RateLimitError):
+            limiter.penalize(model, retry_after_seconds(e))
+        finish(e, None, None)
+        raise
+    if kwargs.get("stream"):
+        # 流式调用：读完（或中途出错、关闭）时才上报熔断和指标、归还许可，耗时按整个流计算
+        return _GuardedStream(response, estimate_request_tokens(kwargs["messages"], None), finish)
+    finish(None, _usage_tokens(response), getattr(response, "usage", None))
+    return response
+
+
+async def acreate_chat_completion(
+    client,
+    response_model: Optional[Type[BaseModel]] = None,
+    agent: Optional[str] = None,
+    attempt: int = 1,
+    **kwargs
+):
+    """create_chat_completion 的异步版本（client 为 AsyncOpenAI），排队等待时不阻塞事件循环"""
+    breaker = get_circuit_breaker()
+    limiter = get_rate_limiter()
+    metrics = get_llm_metrics()
+    model = kwargs["model"]
+    try:
+        probe = breaker.before_call(model)
+    except CircuitOpenError as e:
+        metrics.record(agent, model, attempt, 0.0, e)
+        raise
+    try:
+        permit = await limiter.acquire_async(model, estimate_request_tokens(kwargs["messages"], kwargs.get("max_tokens")))
+    except BaseException as e:
+        # 排队期间被取消：归还探测名额
+        breaker.after_call(model, probe, e, 0.0)
+        raise
+    start = time.monotonic()
+
+    def finish(error: Optional[BaseException], used_tokens: Optional[int], usage: Any):
+        latency = time.monotonic() - start
+        breaker.after_call(model, probe, error, latency)
+        permit.release(used_tokens)
+        metrics.record(agent, model, attempt, latency, error, usage)
+
+    try:
+        response = await _acreate(client, response_model, kwargs)
+    except BaseException as e:
+        if isinstance(e, RateLimitError):
+            limiter.penalize(model, retry_after_seconds(e))
+        finish(e, None, None)
+        raise
+    if kwargs.get("stream"):
+        # 流式调用：读完（或中途出错、关闭）时才上报熔断和指标、归还许可，耗时按整个流计算
+        return _AsyncGuardedStream(response, estimate_request_tokens(kwargs["messages"], None), finish)
+    finish(None, _usage_tokens(response), getattr(response, "usage", None))
+    return response
+
+
+# 单例
+_structured_output = None
+_structured_output_lock = threading.Lock()
+
+
+def get_structured_output() -> StructuredOutput:
+    """获取结构化输出单例"""
+    global _structured_output
+    if _structured_output is None:
+        with _structured_output_lock:
+            if _structured_output is None:
+                _structured_output = StructuredOutput()
+    return _structured_output
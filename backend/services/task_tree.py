@@ -0,0 +1,233 @@
+"""
+任务树工具 - 按周次/月次定位和替换已保存的任务（前端格式）
+
+前端格式的任务树：
+- monthly: {"第1个月": [task]}
+- weekly:  {"第1周": [task]}
+- daily:   {"第1个月-第1周": {"1月5日": [task]}}
+
+周次和月次从 key 中的"第N周"/"第N个月"解析，与 key 的其余部分（如"第1周 - 入门"）无关。
+"""
+import re
+import copy
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+_WEEK_RE = re.compile(r"第\s*(\d+)\s*周")
+_MONTH_RE = re.compile(r"第\s*(\d+)\s*个?月")
+
+
+def week_number(key: str) -> Optional[int]:
+    """key 中的周次，如 "第1个月-第3周" → 3；没有周次返回 None"""
+    match = _WEEK_RE.search(key)
+    return int(match.group(1)) if match else None
+
+
+def month_number(key: str) -> Optional[int]:
+    """key 中的月次，如 "第2个月" → 2；没有月次返回 None"""
+    match = _MONTH_RE.search(key)
+    return int(match.group(1)) if match else None
+
+
+def month_of_week(week: int) -> int:
+    """周次所属的月次（每月按 4 周计算，与拆解结果的 daily key 一致）"""
+    return (week - 1) // 4 + 1
+
+
+def plan_weeks(tasks: Dict[str, Any]) -> List[int]:
+    """任务树中出现的全部周次"""
+    weeks = set()
+    for section in ("weekly", "daily"):
+        for key in (tasks.get(section) or {}):
+            number = week_number(key)
+            if number is not None:
+                weeks.add(number)
+    return sorted(weeks)
+
+
+def _entry_title(entry: Any) -> str:
+    if isinstance(entry, list) and entry and isinstance(entry[0], dict):
+        return entry[0].get("title", "")
+    if isinstance(entry, dict):
+        return entry.get("goal") or entry.get("title", "")
+    return ""
+
+
+def plan_outline(tasks: Dict[str, Any]) -> str:
+    """月/周两级的目标摘要，每行一个条目"""
+    lines = []
+    for section in ("monthly", "weekly"):
+        for key, entry in (tasks.get(section) or {}).items():
+            lines.append(f"- {key}: {_entry_title(entry)}")
+    return "\n".join(lines)
+
+
+def _replace_numbered(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    number_of: Callable[[str], Optional[int]],
+    numbers: Set[int],
+    merge_entry: Callable[[Any, Any], Any] = None
+) -> Dict[str, Any]:
+    """用 new 中编号属于 numbers 的条目替换 old 中同编号的条目，保持 old 的顺序
+
+    new 中编号不在 numbers 内的条目被忽略；old 中没有的编号追加到末尾。
+    """
+    replacements: Dict[int, tuple] = {}
+    for key, entry in new.items():
+        number = number_of(key)
+        if number in numbers and number not in replacements:
+            replacements[number] = (key, entry)
+
+    merged = {}
+    used = set()
+    for key, entry in old.items():
+        number = number_of(key)
+        if number in replacements:
+            if number not in used:
+                new_key, new_entry = replacements[number]
+                merged[new_key] = merge_entry(entry, new_entry) if merge_entry else new_entry
+                used.add(number)
+            continue
+        merged[key] = entry
+    for number in sorted(set(replacements) - used):
+        new_key, new_entry = replacements[number]
+        merged[new_key] = new_entry
+    return merged
+
+
+def _keep_dates(old_days: Any, new_days: Any) -> Any:
+    """新的一周日任务沿用原来的日期 key（按顺序对应），多出的天保留新 key"""
+    if not isinstance(old_days, dict) or not isinstance(new_days, dict):
+        return new_days
+    old_keys = list(old_days)
+    rekeyed = {}
+    for index, (key, day_tasks) in enumerate(new_days.items()):
+        rekeyed[old_keys[index] if index < len(old_keys) else key] = day_tasks
+    return rekeyed
+
+
+def merge_weeks(tasks: Dict[str, Any], delta: Dict[str, Any], weeks: Iterable[int]) -> Dict[str, Any]:
+    """把 delta 中指定周次（及其所属月份）的任务合并进 tasks，其余条目保持不变
+
+    daily 中替换的周沿用原来的日期，避免重新生成的那几周与其他周的日期错位。
+    返回新的任务树，不修改传入的 tasks。
+    """
+    weeks = set(weeks)
+    months = {month_of_week(week) for week in weeks}
+    merged = dict(tasks)
+    merged["monthly"] = _replace_numbered(tasks.get("monthly") or {}, delta.get("monthly") or {}, month_number, months)
+    merged["weekly"] = _replace_numbered(tasks.get("weekly") or {}, delta.get("weekly") or {}, week_number, weeks)
+    merged["daily"] = _replace_numbered(
+        tasks.get("daily") or {}, delta.get("daily") or {}, week_number, weeks, merge_entry=_keep_dates
+    )
+    return merged
+
+
+# ---------- 补丁（重新生成时只输出改动） ----------
+
+class PatchError(ValueError):
+    """补丁无法应用到任务树"""
+
+
+# 补丁可以修改的任务字段（id 由补丁的 id/after 决定，不能通过 task 修改）
+PATCH_FIELDS = ("title", "description", "output", "estimated_hours")
+
+
+def _task_lists(tasks: Dict[str, Any]) -> Iterable[tuple]:
+    """遍历任务树中的每个任务列表：(位置描述, 列表)"""
+    for section in ("monthly", "weekly"):
+        for key, entry in (tasks.get(section) or {}).items():
+            if isinstance(entry, list):
+                yield key, entry
+    for week_key, days in (tasks.get("daily") or {}).items():
+        if isinstance(days, dict):
+            for date, day_tasks in days.items():
+                if isinstance(day_tasks, list):
+                    yield f"{week_key} {date}", day_tasks
+        elif isinstance(days, list):
+            yield week_key, days
+
+
+def _task_index(tasks: Dict[str, Any]) -> Dict[str, tuple]:
+    """任务 id → (所在列表, 位置)"""
+    index = {}
+    for _, task_list in _task_lists(tasks):
+        for position, task in enumerate(task_list):
+            if isinstance(task, dict) and task.get("id"):
+                index.setdefault(task["id"], (task_list, position))
+    return index
+
+
+def plan_listing(tasks: Dict[str, Any]) -> str:
+    """带 id 的完整任务清单（供模型引用任务 id），每行一个任务"""
+    lines = []
+    for location, task_list in _task_lists(tasks):
+        for task in task_list:
+            if not isinstance(task, dict) or not task.get("id"):
+                continue
+            line = f"[{task['id']}] {location} | {task.get('title', '')}"
+            detail = task.get("output") or task.get("description")
+            if detail:
+                line += f" | {detail}"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _patch_fields(op: Dict[str, Any], required: bool) -> Dict[str, Any]:
+    task = op.get("task")
+    if not isinstance(task, dict):
+        raise PatchError(f"{op.get('op')} 操作缺少 task")
+    fields = {field: task[field] for field in PATCH_FIELDS if task.get(field) not in (None, "")}
+    if required and not fields.get("title"):
+        raise PatchError("add 操作的 task 缺少 title")
+    if not fields:
+        raise PatchError(f"{op.get('op')} 操作没有可修改的字段")
+    return fields
+
+
+def apply_patch(tasks: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把补丁操作应用到任务树，返回新的任务树（不修改传入的 tasks）
+
+    操作按顺序执行，任一操作无效时抛出 PatchError，不产生部分修改：
+    - {"op": "replace", "id": 任务id, "task": {要修改的字段}}：只修改给出的字段
+    - {"op": "remove", "id": 任务id}
+    - {"op": "add", "after": 任务id, "task": {...}}：插入到该任务所在列表中、该任务之后
+    """
+    if not isinstance(ops, list):
+        raise PatchError("ops 必须是数组")
+    patched = copy.deepcopy(tasks)
+    index = _task_index(patched)
+    added = 0
+    for op in ops:
+        if not isinstance(op, dict):
+            raise PatchError(f"无效的操作: {op!r}")
+        kind = op.get("op")
+        if kind in ("replace", "remove"):
+            task_id = op.get("id")
+            if task_id not in index:
+                raise PatchError(f"{kind} 的任务不存在: {task_id}")
+            task_list, _ = index[task_id]
+            task = next(t for t in task_list if isinstance(t, dict) and t.get("id") == task_id)
+            if kind == "replace":
+                task.update(_patch_fields(op, required=False))
+            else:
+                task_list.remove(task)
+                del index[task_id]
+        elif kind == "add":
+            anchor = op.get("after")
+            if anchor not in index:
+                raise PatchError(f"add 的插入位置不存在: {anchor}")
+            fields = _patch_fields(op, required=True)
+            task_list, _ = index[anchor]
+            position = next(i for i, t in enumerate(task_list) if isinstance(t, dict) and t.get("id") == anchor)
+            added += 1
+            task_id = f"{anchor}-new{added}"
+            while task_id in index:
+                added += 1
+                task_id = f"{anchor}-new{added}"
+            new_task = {"id": task_id, "description": "", **fields}
+            task_list.insert(position + 1, new_task)
+            index[task_id] = (task_list, position + 1)
+        else:
+            raise PatchError(f"未知的操作类型: {kind}")
+    return patched
@@ -0,0 +1,231 @@
+"""
+输出 token 预算 - 按 Agent 和计划周期设置每次调用的 max_tokens 和超时
+
+max_tokens 过大时限流器按它预留 token，并发调用互相挤占；过小时输出被截断。这里按 Agent 的输出形态估算：
+- 分析类 Agent 只输出一行标签，补充问题输出几个问题，预算是固定值
+- 拆解类 Agent 的输出随计划周期线性增长：基础部分 + 每周目标 + 每天任务
+- 思考模型的推理过程也计入 max_tokens，额外加上推理预算；计划越长推理越多，推理预算同样按周数增长
+估算值乘以安全系数后向上取整，不超过原来的固定上限（思考模型 16384，其他 8192）；
+超时 = 下限 + 预算的输出长度 / 输出速度，不超过原来的上限（600 / 120 秒）。下限按模型区分
+（思考模型 300 秒，其他 60 秒），首字延迟和排队较长时短输出的 Agent 也不会过早超时。
+
+发送前在本地统计提示词 token 数（安装了 tiktoken 时精确计数，否则按 2 字符/token 估算，与限流器一致），
+调用完成后把预算与 usage 中的实际用量记入统计（健康检查中的 llm_token_budget），
+输出因达到 max_tokens 被截断时由调用方按上限重新请求。
+"""
+import math
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 各 Agent 的输出 token 估算：(基础, 每周, 每天)
+# 按格式化后的 JSON 估计：一天的任务（标题、描述、时长、产出）约 80 token，一周的目标约 100 token
+AGENT_OUTPUT_TOKENS = {
+    "task_type": (150, 0, 0),
+    "experience_level": (150, 0, 0),
+    "time_span": (150, 0, 0),
+    "analysis_fused": (400, 0, 0),
+    "questions": (800, 0, 0),
+    "regenerate_scope": (300, 0, 0),
+    "regenerate_patch": (800, 40, 0),
+    "breakdown": (400, 100, 80),
+    "regenerate": (400, 100, 80),
+    "regenerate_delta": (400, 100, 80),
+    "breakdown_skeleton": (400, 100, 0),
+    "breakdown_month": (200, 20, 80),
+}
+
+
+class OutputTruncatedError(RuntimeError):
+    """输出达到 max_tokens 被截断，且调用方要求完整输出（例如补丁：截断的操作列表不能部分应用）"""
+
+
+def is_thinking_model(model: str) -> bool:
+    return "thinking" in model.lower()
+
+
+class TokenBudget(NamedTuple):
+    """一次调用的预算"""
+    max_tokens: int
+    timeout: float
+    # 上限（输出被截断时按它重新请求）
+    cap: int
+    prompt_tokens: int
+    # 估算的输出 token 数（未乘安全系数，不含推理预算）；未知 Agent 为 None
+    expected: Optional[int]
+
+
+class _AgentStats:
+    __slots__ = ("calls", "budget", "used", "truncated", "max_used", "prompt_local", "prompt_actual")
+
+    def __init__(self):
+        self.calls = 0
+        self.budget = 0
+        self.used = 0
+        self.truncated = 0
+        self.max_used = 0
+        self.prompt_local = 0
+        self.prompt_actual = 0
+
+
+class TokenBudgeter:
+    """估算 max_tokens / 超时，并统计预算与实际用量"""
+
+    def __init__(self):
+        # false 时所有调用使用原来的固定值
+        self.enabled = os.getenv("LLM_TOKEN_BUDGET", "true").lower() == "true"
+        self.safety = float(os.getenv("LLM_TOKEN_BUDGET_SAFETY", "1.5"))
+        # 思考模型的推理预算（计入 max_tokens）：基础部分 + 每周增加的部分
+        self.thinking_tokens = int(os.getenv("LLM_TOKEN_BUDGET_THINKING", "6144"))
+        self.thinking_tokens_per_week = int(os.getenv("LLM_TOKEN_BUDGET_THINKING_PER_WEEK", "256"))
+        # 计算超时用的输出速度（token/秒，按偏慢的情况估计）和超时下限（秒）
+        self.tokens_per_second = float(os.getenv("LLM_TOKEN_BUDGET_TPS", "20"))
+        self.min_timeout = float(os.getenv("LLM_TOKEN_BUDGET_MIN_TIMEOUT", "60"))
+        self.min_timeout_thinking = float(os.getenv("LLM_TOKEN_BUDGET_MIN_TIMEOUT_THINKING", "300"))
+        self._encoder = self._load_encoder()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _AgentStats] = {}
+
+    @staticmethod
+    def _load_encoder():
+        """tiktoken 可选：安装了就精确计数"""
+        try:
+            import tiktoken
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+    def count_prompt_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """本地统计提示词 token 数（每条消息另加 4 个 token 的格式开销）"""
+        if self._encoder is not None:
+            return sum(len(self._encoder.encode(m.get("content") or "")) + 4 for m in messages)
+        return sum(len(m.get("content") or "") for m in messages) // 2 + 4 * len(messages)
+
+    def default_limits(self, model: str) -> tuple:
+        """原来的固定值：(max_tokens, 超时)"""
+        if is_thinking_model(model):
+            return 16384, 600.0
+        return 8192, 120.0
+
+    def thinking_allowance(self, weeks: int = 0) -> int:
+        """思考模型的推理预算（随计划周数增长）"""
+        return self.thinking_tokens + self.thinking_tokens_per_week * max(0, weeks)
+
+    def min_timeout_for(self, model: str) -> float:
+        """超时下限"""
+        return self.min_timeout_thinking if is_thinking_model(model) else self.min_timeout
+
+    def plan(self, agent: Optional[str], model: str, messages: List[Dict[str, str]],
+             weeks: int = 0, days: Optional[int] = None) -> TokenBudget:
+        """一次调用的预算
+
+        Args:
+            agent: Agent 名称（决定输出形态）
+            model: 模型
+            messages: 消息列表（用于本地统计提示词 token 数）
+            weeks: 本次输出覆盖的周数（拆解类 Agent）
+            days: 本次输出覆盖的天数，默认每周 7 天
+        """
+        cap, max_timeout = self.default_limits(model)
+        prompt_tokens = self.count_prompt_tokens(messages)
+        shape = AGENT_OUTPUT_TOKENS.get(agent or "")
+        if not self.enabled or shape is None:
+            return TokenBudget(cap, max_timeout, cap, prompt_tokens, None)
+
+        base, per_week, per_day = shape
+        days = weeks * 7 if days is None else days
+        expected = base + per_week * weeks + per_day * days
+        budget = expected * self.safety
+        if is_thinking_model(model):
+            budget += self.thinking_allowance(weeks)
+        # 向上取整到 256 的整数倍
+        max_tokens = min(cap, int(math.ceil(budget / 256) * 256))
+        if expected * self.safety > cap:
+            logger.warning(
+                "%s 预估输出 %s token，超过上限 %s，可能被截断（较长的计划可使用 BREAKDOWN_MODE=map_reduce）",
+                agent, int(expected * self.safety), cap
+            )
+        timeout = min(max_timeout, self.min_timeout_for(model) + max_tokens / self.tokens_per_second)
+        return TokenBudget(max_tokens, timeout, cap, prompt_tokens, expected)
+
+    def record(self, agent: Optional[str], model: str, budget: TokenBudget, usage: Any = None,
+               finish_reason: Optional[str] = None, completion_tokens: Optional[int] = None):
+        """记录预算与实际用量
+
+        completion_tokens: 上游没有返回 usage 时（流式调用）由调用方按输出长度估算的 token 数
+        """
+        if usage is not None:
+            completion_tokens = getattr(usage, "completion_tokens", None) or completion_tokens
+        prompt_actual = getattr(usage, "prompt_tokens", None) if usage is not None else None
+        truncated = finish_reason == "length"
+
+        name = agent or "unknown"
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _AgentStats()
+            stats.calls += 1
+            stats.budget += budget.max_tokens
+            stats.used += completion_tokens or 0
+            stats.max_used = max(stats.max_used, completion_tokens or 0)
+            stats.truncated += truncated
+            if prompt_actual:
+                stats.prompt_local += budget.prompt_tokens
+                stats.prompt_actual += prompt_actual
+
+        fields = {
+            "agent": name,
+            "model": model,
+            "max_tokens": budget.max_tokens,
+            "completion_tokens": completion_tokens,
+            "prompt_tokens_local": budget.prompt_tokens,
+            "prompt_tokens": prompt_actual,
+            "finish_reason": finish_reason,
+        }
+        if truncated:
+            logger.warning("%s 输出达到 max_tokens=%s 被截断", name, budget.max_tokens, extra=fields)
+        else:
+            logger.debug("token 预算 %s: %s / %s", name, completion_tokens, budget.max_tokens, extra=fields)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """按 Agent 汇总：平均预算、平均/最大实际输出、利用率、截断次数、本地提示词计数的偏差"""
+        with self._lock:
+            items = list(self._stats.items())
+        agents = {}
+        for name, stats in sorted(items):
+            agents[name] = {
+                "calls": stats.calls,
+                "avg_max_tokens": round(stats.budget / stats.calls),
+                "avg_completion_tokens": round(stats.used / stats.calls),
+                "max_completion_tokens": stats.max_used,
+                "utilization": round(stats.used / stats.budget, 3) if stats.budget else 0.0,
+                "truncated": stats.truncated,
+                "prompt_estimate_ratio": (
+                    round(stats.prompt_local / stats.prompt_actual, 3) if stats.prompt_actual else None
+                ),
+            }
+        return {
+            "enabled": self.enabled,
+            "tokenizer": "tiktoken" if self._encoder is not None else "chars/2",
+            "safety": self.safety,
+            "agents": agents,
+        }
+
+
+# 单例
+_token_budgeter = None
+_token_budgeter_lock = threading.Lock()
+
+
+def get_token_budgeter() -> TokenBudgeter:
+    """获取 token 预算单例"""
+    global _token_budgeter
+    if _token_budgeter is None:
+        with _token_budgeter_lock:
+            if _token_budgeter is None:
+                _token_budgeter = TokenBudgeter()
+    return _token_budgeter
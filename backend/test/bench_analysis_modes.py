@@ -0,0 +1,123 @@
+"""
+分析阶段基准测试：独立调用（separate） vs 融合调用（fused）
+
+对同一组目标分别用两种模式运行分析阶段，对比端到端耗时、上游调用次数和 token 用量。
+运行时会关闭响应缓存和请求合并，保证每次都真实请求上游。
+
+用法：
+    python -m test.bench_analysis_modes
+    python -m test.bench_analysis_modes --rounds 3
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import concurrent.futures
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入服务之前设置，保证每次调用都真实请求上游
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["LLM_COALESCE_ENABLED"] = "false"
+
+from services.ai_service import AIService
+
+
+TEST_CASES = [
+    {"goal": "一个月内完成博物馆网页开发", "experience": "beginner", "deadline": "", "daily_hours": "2"},
+    {"goal": "三个月学会吉他弹唱", "experience": "beginner", "deadline": "", "daily_hours": "1"},
+    {"goal": "半年减肥10公斤", "experience": "intermediate", "deadline": "", "daily_hours": "1"},
+    {"goal": "一年内通过CPA考试", "experience": "intermediate", "deadline": "", "daily_hours": "3"},
+    {"goal": "开发一个React Native记账APP", "experience": "expert", "deadline": "", "daily_hours": "2"},
+]
+
+
+class UsageRecorder:
+    """包装 chat.completions.create，记录每次调用的 token 用量"""
+
+    def __init__(self, client):
+        self._create = client.chat.completions.create
+        self._lock = threading.Lock()
+        self.reset()
+        client.chat.completions.create = self.create
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def create(self, *args, **kwargs):
+        response = self._create(*args, **kwargs)
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.calls += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+        return response
+
+
+def run_analysis(service: AIService, form_data: dict) -> dict:
+    """只运行分析阶段（与 iter_task_breakdown 第一阶段一致）"""
+    if service.analysis_mode == "fused":
+        return service._agent_analysis_fused(form_data)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {
+            "task_type": executor.submit(service._agent_task_type, form_data),
+            "experience_level": executor.submit(service._agent_experience, form_data),
+            "time_span": executor.submit(service._agent_time_span, form_data),
+        }
+        return {field: future.result() for field, future in futures.items()}
+
+
+def bench_mode(service: AIService, recorder: UsageRecorder, mode: str, rounds: int) -> dict:
+    """对一种模式跑完所有用例"""
+    service.analysis_mode = mode
+    recorder.reset()
+    latencies = []
+    for _ in range(rounds):
+        for case in TEST_CASES:
+            start = time.perf_counter()
+            result = run_analysis(service, case)
+            latencies.append(time.perf_counter() - start)
+            print(f"  [{mode}] {case['goal']}: {result}")
+    latencies.sort()
+    runs = len(latencies)
+    return {
+        "mode": mode,
+        "runs": runs,
+        "avg_s": sum(latencies) / runs,
+        "p50_s": latencies[runs // 2],
+        "max_s": latencies[-1],
+        "calls_per_run": recorder.calls / runs,
+        "prompt_tokens_per_run": recorder.prompt_tokens / runs,
+        "completion_tokens_per_run": recorder.completion_tokens / runs,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="分析阶段 separate / fused 模式对比")
+    parser.add_argument("--rounds", type=int, default=1, help="每个用例重复次数")
+    args = parser.parse_args()
+
+    service = AIService()
+    recorder = UsageRecorder(service.client)
+
+    results = []
+    for mode in ("separate", "fused"):
+        print(f"\n{'='*50}\n模式: {mode}\n{'='*50}")
+        results.append(bench_mode(service, recorder, mode, args.rounds))
+
+    print("\n" + "=" * 80)
+    print(f"{'模式':<10} {'次数':>4} {'平均(s)':>8} {'P50(s)':>8} {'最大(s)':>8} "
+          f"{'调用/次':>8} {'输入tok/次':>10} {'输出tok/次':>10}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['runs']:>4} {r['avg_s']:>8.2f} {r['p50_s']:>8.2f} {r['max_s']:>8.2f} "
+              f"{r['calls_per_run']:>8.1f} {r['prompt_tokens_per_run']:>10.0f} {r['completion_tokens_per_run']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+并发容量基准测试：线程版 AIService vs asyncio 版 AsyncAIService
+
+用模拟的上游（固定延迟、不发真实请求）同时运行大量拆解请求，对比总耗时、吞吐量和峰值线程数。
+线程版模拟 gunicorn 的 N 个工作线程，每个请求内部再由 Agent 依赖图开线程；
+asyncio 版所有请求在同一个事件循环中并发。
+
+用法：
+    python -m test.bench_async_capacity
+    python -m test.bench_async_capacity --plans 500 --latency-ms 800 --threads 64
+"""
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入服务之前设置：模拟上游不需要真实的 Key，也不应命中缓存、合并或被限流额度拖慢
+os.environ.setdefault("SILICONFLOW_API_KEY", "bench")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["LLM_COALESCE_ENABLED"] = "false"
+os.environ["LLM_RATE_LIMIT_ENABLED"] = "false"
+os.environ["LLM_STRUCTURED_OUTPUT"] = "off"
+# 拆解过程中的调试日志很多，基准测试期间只保留警告
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from services.ai_service import AIService
+from services.async_ai_service import AsyncAIService
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    BREAKDOWN_RESPONSE = json.dumps(json.load(f), ensure_ascii=False)
+QUESTIONS_RESPONSE = json.dumps([
+    {"id": "q1", "question": "你更喜欢哪种学习方式？", "type": "single", "options": ["视频", "书籍", "实操"]}
+], ensure_ascii=False)
+
+
+def fake_content(messages: list) -> str:
+    """按请求内容返回对应 Agent 的模拟输出"""
+    if messages[0]["role"] == "system":
+        return BREAKDOWN_RESPONSE
+    if "补充问题" in messages[0]["content"]:
+        return QUESTIONS_RESPONSE
+    return "技能学习类 - 模拟分析结果"
+
+
+def fake_response(messages: list):
+    message = types.SimpleNamespace(content=fake_content(messages))
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+class FakeCompletions:
+    """同步模拟上游：阻塞等待固定延迟"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create(self, messages, **kwargs):
+        time.sleep(self.latency)
+        return fake_response(messages)
+
+
+class FakeAsyncCompletions:
+    """异步模拟上游：等待期间不占用线程"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def create(self, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return fake_response(messages)
+
+
+def make_form(index: int) -> dict:
+    # 每个请求的目标不同，避免被请求合并
+    return {"goal": f"三个月学会吉他弹唱 #{index}", "experience": "beginner", "deadline": "", "daily_hours": "1"}
+
+
+class ThreadSampler:
+    """后台采样进程内线程数，记录峰值"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_threaded(plans: int, latency: float, threads: int) -> dict:
+    service = AIService()
+    service.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions(latency)))
+
+    start = time.perf_counter()
+    with ThreadSampler() as sampler:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(service.generate_task_breakdown, [make_form(i) for i in range(plans)]))
+    elapsed = time.perf_counter() - start
+    return {"name": f"threaded({threads})", "plans": len(results), "elapsed_s": elapsed, "peak_threads": sampler.peak}
+
+
+def bench_async(plans: int, latency: float) -> dict:
+    service = AsyncAIService(AIService())
+    service.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeAsyncCompletions(latency)))
+
+    async def run():
+        return await asyncio.gather(*(service.generate_task_breakdown(make_form(i)) for i in range(plans)))
+
+    start = time.perf_counter()
+    with ThreadSampler() as sampler:
+        results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return {"name": "asyncio", "plans": len(results), "elapsed_s": elapsed, "peak_threads": sampler.peak}
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="线程版 vs asyncio 版并发容量对比（模拟上游）")
+    parser.add_argument("--plans", type=int, default=200, help="同时发起的拆解请求数")
+    parser.add_argument("--latency-ms", type=float, default=500, help="模拟的上游单次调用延迟（毫秒）")
+    parser.add_argument("--threads", type=int, default=32, help="线程版的工作线程数（相当于 gunicorn 线程数）")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    # 拆解过程中的调试输出很多，基准测试期间屏蔽
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        results = [
+            bench_threaded(args.plans, latency, args.threads),
+            bench_async(args.plans, latency),
+        ]
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    print(f"{args.plans} 个并发拆解请求，上游延迟 {args.latency_ms:.0f}ms")
+    print("=" * 60)
+    print(f"{'实现':<14} {'请求数':>6} {'总耗时(s)':>10} {'吞吐(个/s)':>10} {'峰值线程':>8}")
+    for r in results:
+        print(f"{r['name']:<14} {r['plans']:>6} {r['elapsed_s']:>10.2f} "
+              f"{r['plans'] / r['elapsed_s']:>10.1f} {r['peak_threads']:>8}")
+
+
+if __name__ == "__main__":
+    main()
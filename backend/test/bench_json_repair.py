@@ -0,0 +1,164 @@
+"""
+截断 JSON 修复基准测试
+
+用测试目录中真实的拆解结果构造截断语料（在不同位置截断，模拟 max_tokens 截断），
+对比旧的括号计数修复与新的单次扫描修复：修复成功率、保留的条目数和耗时。
+
+用法：
+    python -m test.bench_json_repair
+    python -m test.bench_json_repair --cuts 500 --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_repair import repair_json
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def legacy_fix_truncated_json(json_str: str):
+    """旧版 _fix_truncated_json：按 str.count 补括号，失败后逐行扫描再尝试"""
+    if not json_str or len(json_str.strip()) < 10:
+        return None
+    json_str = json_str.strip()
+    open_braces = json_str.count('{') - json_str.count('}')
+    open_brackets = json_str.count('[') - json_str.count(']')
+    if open_braces > 0 or open_brackets > 0:
+        fixed = json_str + '}' * open_braces + ']' * open_brackets
+        try:
+            json.loads(fixed)
+            return fixed
+        except ValueError:
+            pass
+
+    fixed_lines = []
+    depth = 0
+    in_string = False
+    escape_next = False
+    for line in json_str.split('\n'):
+        for char in line:
+            if escape_next:
+                escape_next = False
+            elif char == '\\' and in_string:
+                escape_next = True
+            elif char == '"':
+                in_string = not in_string
+            elif not in_string:
+                if char in '{[':
+                    depth += 1
+                elif char in '}]':
+                    depth -= 1
+        fixed_lines.append(line)
+        if depth == 0 and (line.rstrip().endswith('}') or line.rstrip().endswith(']')):
+            break
+    fixed = '\n'.join(fixed_lines)
+    if not fixed.rstrip().endswith('}'):
+        fixed += '\n}'
+    try:
+        json.loads(fixed)
+        return fixed
+    except ValueError:
+        return None
+
+
+def load_documents() -> list:
+    """真实的 Agent 6 输出（tasks.json 与集成测试保存的初始/优化结果）"""
+    docs = []
+    with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+        docs.append(json.load(f))
+    with open(os.path.join(TEST_DIR, "test_agent4_6_case1_result.json"), "r", encoding="utf-8") as f:
+        case = json.load(f)
+    docs.extend([case["initial_tasks"], case["optimized_tasks"]])
+    return docs
+
+
+def build_corpus(docs: list, cuts: int) -> list:
+    """每个文档按紧凑/缩进两种格式序列化，在均匀分布的位置截断"""
+    corpus = []
+    for doc in docs:
+        for indent in (None, 2):
+            text = json.dumps(doc, ensure_ascii=False, indent=indent)
+            step = max(1, len(text) // cuts)
+            for cut in range(step, len(text), step):
+                corpus.append(text[:cut])
+    return corpus
+
+
+def count_entries(result) -> int:
+    """统计修复结果中保留的 monthly/weekly/daily 条目数（daily 按天计）"""
+    if not isinstance(result, dict):
+        return 0
+    total = 0
+    for section in ("monthly", "weekly", "daily"):
+        entries = result.get(section)
+        if not isinstance(entries, dict):
+            continue
+        for value in entries.values():
+            total += len(value) if section == "daily" and isinstance(value, dict) else 1
+    return total
+
+
+def bench(name: str, fix, corpus: list, repeat: int) -> dict:
+    """对整个语料运行修复 + 解析，统计成功率、保留条目数和耗时"""
+    succeeded = 0
+    entries = 0
+    for text in corpus:
+        fixed = fix(text)
+        if fixed is None:
+            continue
+        try:
+            result = json.loads(fixed)
+        except ValueError:
+            continue
+        succeeded += 1
+        entries += count_entries(result)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fixed = fix(text)
+            if fixed is not None:
+                try:
+                    json.loads(fixed)
+                except ValueError:
+                    pass
+    elapsed = time.perf_counter() - start
+
+    return {
+        "name": name,
+        "samples": len(corpus),
+        "success_rate": succeeded / len(corpus),
+        "entries": entries,
+        "avg_us": elapsed / (repeat * len(corpus)) * 1e6,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="截断 JSON 修复：旧实现 vs 单次扫描")
+    parser.add_argument("--cuts", type=int, default=200, help="每个文档的截断位置数")
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复次数")
+    args = parser.parse_args()
+
+    corpus = build_corpus(load_documents(), args.cuts)
+    print(f"语料: {len(corpus)} 个截断样本，平均 {sum(map(len, corpus)) // len(corpus)} 字符")
+
+    results = [
+        bench("legacy", legacy_fix_truncated_json, corpus, args.repeat),
+        bench("single-pass", repair_json, corpus, args.repeat),
+    ]
+
+    print("\n" + "=" * 60)
+    print(f"{'实现':<12} {'样本':>6} {'成功率':>8} {'保留条目':>10} {'平均(us)':>10}")
+    for r in results:
+        print(f"{r['name']:<12} {r['samples']:>6} {r['success_rate']:>8.1%} {r['entries']:>10} {r['avg_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+日志开销基准测试：不同日志配置下 POST /api/breakdown 的单次请求耗时
+
+用零延迟的模拟上游跑完整的请求路径（Flask 路由 → 多 Agent 拆解 → 解析 → 保存），
+日志写到 /dev/null，只比较日志本身带来的开销：
+- DEBUG + 同步写出：调试输出全部格式化并在请求线程中写出
+- DEBUG + 队列写出：格式化和写出移到后台线程
+- DEBUG + 10% 采样
+- INFO（生产默认）：调试日志在调用处直接返回，参数不会被格式化
+- WARNING
+
+用法：
+    python -m test.bench_logging
+    python -m test.bench_logging --requests 500
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import statistics
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入服务之前设置：模拟上游不需要真实的 Key，也不应命中缓存、合并或被限流额度拖慢
+os.environ.setdefault("SILICONFLOW_API_KEY", "bench")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["LLM_COALESCE_ENABLED"] = "false"
+os.environ["LLM_RATE_LIMIT_ENABLED"] = "false"
+os.environ["LLM_STRUCTURED_OUTPUT"] = "off"
+os.environ["STORAGE_BACKEND"] = "memory"
+
+from app import app
+from services.ai_service import get_ai_service
+from services.logger import setup_logging, shutdown_logging
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    BREAKDOWN_RESPONSE = json.dumps(json.load(f), ensure_ascii=False)
+QUESTIONS_RESPONSE = json.dumps([
+    {"id": "q1", "question": "你更喜欢哪种学习方式？", "type": "single", "options": ["视频", "书籍", "实操"]}
+], ensure_ascii=False)
+
+CONFIGS = [
+    ("DEBUG 同步", {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "false", "LOG_DEBUG_SAMPLE_RATE": "1"}),
+    ("DEBUG 队列", {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "true", "LOG_DEBUG_SAMPLE_RATE": "1"}),
+    ("DEBUG 采样10%", {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "true", "LOG_DEBUG_SAMPLE_RATE": "0.1"}),
+    ("INFO 队列", {"LOG_LEVEL": "INFO", "LOG_ASYNC": "true", "LOG_DEBUG_SAMPLE_RATE": "1"}),
+    ("WARNING 队列", {"LOG_LEVEL": "WARNING", "LOG_ASYNC": "true", "LOG_DEBUG_SAMPLE_RATE": "1"}),
+]
+
+
+def fake_content(messages: list) -> str:
+    """按请求内容返回对应 Agent 的模拟输出"""
+    if messages[0]["role"] == "system":
+        return BREAKDOWN_RESPONSE
+    if "补充问题" in messages[0]["content"]:
+        return QUESTIONS_RESPONSE
+    return "技能学习类 - 模拟分析结果"
+
+
+class FakeCompletions:
+    """零延迟的模拟上游"""
+
+    def create(self, messages, **kwargs):
+        message = types.SimpleNamespace(content=fake_content(messages))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def bench_config(client, env: dict, requests: int) -> dict:
+    os.environ.update(env)
+    setup_logging(force=True)
+
+    latencies = []
+    for i in range(requests):
+        form = {"goal": f"三个月学会吉他弹唱 #{i}", "experience": "beginner", "deadline": "", "daily_hours": "1"}
+        start = time.perf_counter()
+        response = client.post("/api/breakdown", json={"form_data": form})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    # 队列中剩余日志的写出时间单独统计，不计入请求耗时
+    drain_start = time.perf_counter()
+    shutdown_logging()
+    drain = time.perf_counter() - drain_start
+
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "drain_ms": drain * 1000,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="不同日志配置下的请求开销对比（模拟上游）")
+    parser.add_argument("--requests", type=int, default=200, help="每种配置的请求数")
+    args = parser.parse_args()
+
+    service = get_ai_service()
+    service.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions()))
+    client = app.test_client()
+
+    # 日志处理器在配置时绑定 sys.stdout，先切到 /dev/null 再逐个配置
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    results = []
+    try:
+        # 预热：导入、连接池、正则编译等一次性开销
+        bench_config(client, CONFIGS[-1][1], 5)
+        for name, env in CONFIGS:
+            results.append((name, bench_config(client, env, args.requests)))
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    baseline = results[-1][1]["mean_ms"]
+    print(f"每种配置 {args.requests} 个请求，上游零延迟")
+    print("=" * 64)
+    print(f"{'配置':<14} {'平均(ms)':>10} {'P95(ms)':>10} {'相对WARNING':>12} {'队列写出(ms)':>12}")
+    for name, r in results:
+        print(f"{name:<14} {r['mean_ms']:>10.2f} {r['p95_ms']:>10.2f} "
+              f"{r['mean_ms'] / baseline:>11.2f}x {r['drain_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+提示词前缀共享基准：统计各 Agent 的请求之间可被上游前缀缓存（prompt caching）复用的比例
+
+上游的前缀缓存只复用与之前请求逐字节相同的开头部分，一旦出现用户数据、日期等每次不同的内容，
+后面的部分都无法复用。本工具对一批请求按 Agent 分组，计算每个请求与同组之前的请求的最长公共前缀：
+- 共享比例 = 公共前缀字符数 / 请求总字符数（同组第一个请求不计入，它只能写入缓存）
+- 可缓存 token = 公共前缀按 2 字符/token 估算（与限流器的预估一致），向下取整到 --block 的整数倍
+
+请求来源：
+- 默认：用提示词构建函数对内置的几组目标生成请求（拆解、按月展开、补充问题、快速任务的节点/资料/指南）
+- --fixtures：读取录制的真实请求（LLM_REPLAY_DIR，默认 test/fixtures/llm），按模型和首条消息的开头分组
+
+--live 时对每组请求实测首字延迟（TTFT）：先发送一次预热缓存，再分别发送原请求（前缀可复用）
+和在开头加了随机前缀的同一请求（前缀不可复用），两者之差即前缀缓存带来的 TTFT 收益；
+上游在 usage 中返回 cached_tokens 时一并统计。
+
+用法：
+    python -m test.bench_prompt_prefix
+    python -m test.bench_prompt_prefix --fixtures
+    python -m test.bench_prompt_prefix --live --repeat 3
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SILICONFLOW_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from services.ai_service import AIService
+from services.quick_task_service import QuickTaskService
+from services.llm_replay import DEFAULT_FIXTURE_DIR, FixtureStore
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEST_CASES = [
+    {"goal": "一个月内完成博物馆网页开发", "experience": "beginner", "deadline": "", "daily_hours": "2"},
+    {"goal": "三个月学会吉他弹唱", "experience": "beginner", "deadline": "", "daily_hours": "1"},
+    {"goal": "半年减肥10公斤", "experience": "intermediate", "deadline": "", "daily_hours": "1"},
+    {"goal": "一年内通过CPA考试", "experience": "intermediate", "deadline": "", "daily_hours": "3"},
+    {"goal": "开发一个React Native记账APP", "experience": "expert", "deadline": "", "daily_hours": "2"},
+]
+ANALYSIS = {"task_type": "技能学习类 - 模拟分析结果", "experience_level": "初学者", "time_span": "中期(3个月)"}
+QUICK_IDEAS = ["周末给家里的猫做一个纸箱城堡", "用 Python 写一个批量重命名照片的脚本", "准备一次10分钟的读书分享"]
+QUICK_NODES = ["准备材料", "动手制作", "检查与收尾"]
+QUICK_MATERIALS = ["先列清单再动手，避免返工", "每一步完成后对照验收标准检查"]
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    SKELETON = json.load(f)
+SKELETON["monthly"]["第2个月"] = dict(next(iter(SKELETON["monthly"].values())), weeks=["第5周"])
+SKELETON["weekly"]["第5周"] = next(iter(SKELETON["weekly"].values()))
+
+
+def builtin_corpus() -> dict:
+    """用提示词构建函数生成的请求，按 Agent 分组"""
+    service = AIService()
+    quick = QuickTaskService()
+    groups = {}
+
+    def add(agent, messages):
+        groups.setdefault(agent, []).append({"model": agent, "messages": messages})
+
+    for form in TEST_CASES:
+        add("breakdown", [{"role": "system", "content": service._get_breakdown_system_prompt()},
+                          {"role": "user", "content": service._build_breakdown_prompt(form, ANALYSIS)}])
+        add("questions", [{"role": "user", "content": service._questions_prompt(form, ANALYSIS)}])
+        add("breakdown_skeleton", service._skeleton_messages(form, ANALYSIS))
+        for month_key, week_keys in service._month_groups(SKELETON):
+            add("breakdown_month", service._month_messages(form, ANALYSIS, SKELETON, month_key, week_keys))
+    for idea in QUICK_IDEAS:
+        add("quick_nodes", [{"role": "user", "content": quick._extract_nodes_prompt(idea)}])
+        add("quick_materials", [{"role": "user", "content": quick._materials_prompt(idea)}])
+        for node in QUICK_NODES:
+            add("quick_guide", [{"role": "user", "content": quick._guide_prompt(idea, node, QUICK_MATERIALS)}])
+    return groups
+
+
+def fixture_corpus(directory: str) -> dict:
+    """录制的真实请求，按模型和首条消息的开头分组（同一 Agent 的提示词开头相同）"""
+    store = FixtureStore(directory)
+    fixtures = sorted(store, key=lambda fixture: fixture.get("recorded_at", ""))
+    groups = {}
+    for fixture in fixtures:
+        request = fixture["request"]
+        head = request["messages"][0]["content"][:16].replace("\n", " ")
+        groups.setdefault(f"{request['model']} | {head}", []).append(request)
+    return groups
+
+
+def serialize(messages: list) -> str:
+    """按对话模板的顺序拼接消息（角色标记 + 内容），前缀缓存按这个顺序匹配"""
+    return "".join(f"<|{m['role']}|>{m['content']}" for m in messages)
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def prefix_share(requests: list, block: int) -> dict:
+    """同组请求与之前请求的最长公共前缀统计"""
+    texts = [serialize(request["messages"]) for request in requests]
+    shared = total = cacheable = 0
+    for i in range(1, len(texts)):
+        prefix = max(common_prefix_len(texts[i], previous) for previous in texts[:i])
+        shared += prefix
+        total += len(texts[i])
+        cacheable += (prefix // 2) // block * block
+    reused = max(len(texts) - 1, 1)
+    return {
+        "requests": len(texts),
+        "avg_chars": statistics.mean(len(text) for text in texts),
+        "share": shared / total if total else 0.0,
+        "cacheable_tokens": cacheable / reused,
+    }
+
+
+def measure_ttft(client, model: str, messages: list, max_tokens: int = 16) -> tuple:
+    """流式请求的首字延迟和上游报告的 cached_tokens（未报告时为 None）"""
+    start = time.perf_counter()
+    first = None
+    cached = None
+    kwargs = {"model": model, "messages": messages, "max_tokens": max_tokens, "stream": True}
+    try:
+        stream = client.chat.completions.create(stream_options={"include_usage": True}, **kwargs)
+    except Exception:
+        stream = client.chat.completions.create(**kwargs)
+    for chunk in stream:
+        if first is None and chunk.choices and chunk.choices[0].delta.content:
+            first = time.perf_counter() - start
+        usage = getattr(chunk, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None) if usage else None
+        if details is not None and getattr(details, "cached_tokens", None) is not None:
+            cached = details.cached_tokens
+    return first if first is not None else time.perf_counter() - start, cached
+
+
+def bench_live(client, model: str, requests: list, repeat: int) -> dict:
+    """预热后对比前缀可复用和不可复用时的 TTFT"""
+    warm_ttft, cold_ttft, cached = [], [], []
+    measure_ttft(client, model, requests[0]["messages"])
+    for _ in range(repeat):
+        for request in requests:
+            ttft, tokens = measure_ttft(client, model, request["messages"])
+            warm_ttft.append(ttft)
+            if tokens is not None:
+                cached.append(tokens)
+            busted = [dict(request["messages"][0], content=f"[{uuid.uuid4().hex}]\n" + request["messages"][0]["content"])]
+            cold_ttft.append(measure_ttft(client, model, busted + request["messages"][1:])[0])
+    return {
+        "warm_ms": statistics.median(warm_ttft) * 1000,
+        "cold_ms": statistics.median(cold_ttft) * 1000,
+        "cached_tokens": statistics.mean(cached) if cached else None,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="提示词前缀共享比例与前缀缓存的 TTFT 收益")
+    parser.add_argument("--fixtures", action="store_true", help="使用录制的真实请求（LLM_REPLAY_DIR）")
+    parser.add_argument("--dir", default=None, help="fixture 目录（默认 LLM_REPLAY_DIR 或 test/fixtures/llm）")
+    parser.add_argument("--block", type=int, default=64, help="上游缓存的粒度（token）")
+    parser.add_argument("--live", action="store_true", help="对配置的上游实测 TTFT")
+    parser.add_argument("--model", default=None, help="--live 时使用的模型（默认生成模型）")
+    parser.add_argument("--repeat", type=int, default=1, help="--live 时每个请求的测量次数")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        directory = args.dir or os.getenv("LLM_REPLAY_DIR") or DEFAULT_FIXTURE_DIR
+        groups = fixture_corpus(directory)
+        source = f"录制的请求（{directory}）"
+    else:
+        groups = builtin_corpus()
+        source = "内置用例"
+    if not groups:
+        print(f"没有可用的请求：{source}")
+        return
+
+    service = AIService() if args.live else None
+    print(f"请求来源：{source}，缓存粒度 {args.block} token")
+    print("=" * 96)
+    header = f"{'分组':<28} {'请求数':>6} {'平均字符':>8} {'共享比例':>8} {'可缓存tok/次':>12}"
+    if args.live:
+        header += f" {'TTFT复用(ms)':>12} {'TTFT不复用(ms)':>14} {'cached_tokens':>13}"
+    print(header)
+    total_shared = total_chars = 0
+    for name, requests in groups.items():
+        stats = prefix_share(requests, args.block)
+        total_shared += stats["share"] * stats["avg_chars"] * (stats["requests"] - 1)
+        total_chars += stats["avg_chars"] * (stats["requests"] - 1)
+        row = (f"{name[:28]:<28} {stats['requests']:>6} {stats['avg_chars']:>8.0f} "
+               f"{stats['share']:>8.0%} {stats['cacheable_tokens']:>12.0f}")
+        if args.live and len(requests) > 1:
+            model = args.model or (requests[0]["model"] if args.fixtures else service.model_generation)
+            live = bench_live(service.client, model, requests, args.repeat)
+            cached = f"{live['cached_tokens']:.0f}" if live["cached_tokens"] is not None else "-"
+            row += f" {live['warm_ms']:>12.0f} {live['cold_ms']:>14.0f} {cached:>13}"
+        print(row)
+    if total_chars:
+        print(f"\n整体共享比例（按字符加权）：{total_shared / total_chars:.0%}")
+
+
+if __name__ == "__main__":
+    main()
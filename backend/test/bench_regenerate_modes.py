@@ -0,0 +1,233 @@
+"""
+重新生成基准测试：整体重新生成（full） vs 增量（delta） vs 补丁（patch）
+
+对同一份已有计划和同一条补充信息，分别用三种 REGENERATE_MODE 运行 regenerate_with_answers，
+对比上游调用次数、输入/输出 token 和耗时。另外跑一次补丁无法应用（引用了不存在的任务 id）的情况，
+展示回退到整体重新生成的代价。
+
+默认使用模拟上游：按请求内容返回对应的输出（计划按 test/tasks.json 的 4 周内容循环扩展到 --weeks 周），
+token 按 2 字符/token 估算（与限流器的预估一致），上游耗时按 首字延迟 + 输出token / 输出速度 计算，
+不实际等待；本地耗时（解析、合并、应用补丁）实测。
+
+--live 时使用配置的上游（真实 API，或 LLM_REPLAY_MODE=replay 回放录制的响应），耗时为实测的端到端耗时。
+
+用法：
+    python -m test.bench_regenerate_modes
+    python -m test.bench_regenerate_modes --weeks 24 --tps 30
+    python -m test.bench_regenerate_modes --live
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import threading
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入服务之前设置：每次调用都真实请求上游；模拟上游不支持结构化输出参数
+os.environ.setdefault("SILICONFLOW_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["LLM_COALESCE_ENABLED"] = "false"
+
+from services.ai_service import AIService
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    BASE_PLAN = json.load(f)
+QUESTIONS_RESPONSE = json.dumps([
+    {"id": "q2", "question": "你希望网站使用什么配色风格？", "type": "single", "options": ["简约", "复古", "现代"]}
+], ensure_ascii=False)
+
+FORM_DATA = {"goal": "完成一个包含4个页面的博物馆网站", "experience": "beginner", "deadline": "", "daily_hours": "2"}
+ANALYSIS = {"task_type": "项目交付类", "experience_level": "beginner", "time_span": "3个月"}
+QUESTIONS = [{"id": "q1", "question": "你每周哪几天没有空？", "type": "text", "options": None}]
+ANSWERS = {"q1": "第2周要出差，只有周末有时间"}
+# 补充信息影响到的周（模拟上游的影响范围判断、增量和补丁输出都只改这一周）
+AFFECTED_WEEK = 2
+
+
+def build_plan(weeks: int) -> dict:
+    """Agent6 格式的计划：按 tasks.json 的 4 周内容循环扩展到指定周数"""
+    base_weeks = list(BASE_PLAN["weekly"].values())
+    base_days = list(BASE_PLAN["daily"].values())
+    base_month = next(iter(BASE_PLAN["monthly"].values()))
+    plan = {"project_name": BASE_PLAN["project_name"], "overview": BASE_PLAN["overview"],
+            "monthly": {}, "weekly": {}, "daily": {}}
+    for week in range(1, weeks + 1):
+        month = (week - 1) // 4 + 1
+        month_key = f"第{month}个月"
+        if month_key not in plan["monthly"]:
+            plan["monthly"][month_key] = dict(base_month, weeks=[])
+        plan["monthly"][month_key]["weeks"].append(f"第{week}周")
+        plan["weekly"][f"第{week}周"] = base_weeks[(week - 1) % len(base_weeks)]
+        plan["daily"][f"第{week}周"] = base_days[(week - 1) % len(base_days)]
+    return plan
+
+
+def affected_plan(plan: dict) -> dict:
+    """增量输出：只包含受影响的周及其所属月份"""
+    week_key = f"第{AFFECTED_WEEK}周"
+    month_key = f"第{(AFFECTED_WEEK - 1) // 4 + 1}个月"
+    days = {day: dict(task, hours=1) for day, task in plan["daily"][week_key].items()}
+    return {
+        "monthly": {month_key: plan["monthly"][month_key]},
+        "weekly": {week_key: dict(plan["weekly"][week_key], focus="出差期间以阅读和周末集中实践为主")},
+        "daily": {week_key: days},
+    }
+
+
+def patch_ops(valid: bool = True) -> dict:
+    """补丁输出：调整受影响那一周的周目标和几天的日任务"""
+    week_key = f"第{AFFECTED_WEEK}周"
+    ops = [
+        {"op": "replace", "id": f"w-{week_key}", "task": {"description": "产出：页面线框图 + 首页实现"}},
+        {"op": "replace", "id": f"d-{week_key}-Day2", "task": {"estimated_hours": 0.5, "title": "阅读布局相关文档"}},
+        {"op": "remove", "id": f"d-{week_key}-Day3"},
+        {"op": "add", "after": f"d-{week_key}-Day6", "task": {"title": "周末集中实现首页", "estimated_hours": 4}},
+    ]
+    if not valid:
+        ops[0]["id"] = "w-第99周"
+    return {"ops": ops, "reason": "第2周出差，工作日减少任务量，集中到周末"}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 2
+
+
+class SimulatedUpstream:
+    """按请求内容返回对应 Agent 输出的模拟上游，记录模拟的上游耗时"""
+
+    def __init__(self, plan: dict, ttft: float, tps: float):
+        self.plan = plan
+        self.ttft = ttft
+        self.tps = tps
+        self.patch_valid = True
+        self.upstream_s = 0.0
+
+    def content(self, messages: list) -> str:
+        prompt = messages[-1]["content"]
+        if "会影响已有任务计划中的哪些周" in prompt:
+            return json.dumps({"weeks": [f"第{AFFECTED_WEEK}周"], "reason": "出差只影响这一周"}, ensure_ascii=False)
+        if "只重新生成任务计划中受影响的部分" in prompt:
+            return json.dumps(affected_plan(self.plan), ensure_ascii=False)
+        if "只输出需要改动的任务" in prompt:
+            return json.dumps(patch_ops(self.patch_valid), ensure_ascii=False)
+        if prompt.startswith("你是补充问题生成器"):
+            return QUESTIONS_RESPONSE
+        return json.dumps(self.plan, ensure_ascii=False)
+
+    def create(self, messages, **kwargs):
+        content = self.content(messages)
+        usage = types.SimpleNamespace(
+            prompt_tokens=estimate_tokens("".join(m["content"] for m in messages)),
+            completion_tokens=estimate_tokens(content),
+        )
+        self.upstream_s += self.ttft + usage.completion_tokens / self.tps
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+class UsageRecorder:
+    """包装 chat.completions.create，记录每次调用的 token 用量"""
+
+    def __init__(self, client):
+        self._create = client.chat.completions.create
+        self._lock = threading.Lock()
+        self.reset()
+        client.chat.completions.create = self.create
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def create(self, *args, **kwargs):
+        response = self._create(*args, **kwargs)
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.calls += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+        return response
+
+
+def bench_mode(service: AIService, recorder: UsageRecorder, upstream, previous_tasks: dict,
+               mode: str, rounds: int) -> dict:
+    """对一种模式重复运行重新生成"""
+    service.regenerate_mode = mode
+    recorder.reset()
+    if upstream:
+        upstream.upstream_s = 0.0
+    elapsed = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = service.regenerate_with_answers(
+            FORM_DATA, ANSWERS, previous_tasks, ANALYSIS, QUESTIONS, previous_answers={}
+        )
+        elapsed += time.perf_counter() - start
+        assert result["tasks"]["daily"], "重新生成的计划为空"
+    return {
+        "calls": recorder.calls / rounds,
+        "prompt_tokens": recorder.prompt_tokens / rounds,
+        "completion_tokens": recorder.completion_tokens / rounds,
+        "local_ms": elapsed / rounds * 1000,
+        "upstream_s": upstream.upstream_s / rounds if upstream else None,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="重新生成 full / delta / patch 模式对比")
+    parser.add_argument("--weeks", type=int, default=12, help="已有计划的周数")
+    parser.add_argument("--rounds", type=int, default=5, help="每种模式重复次数")
+    parser.add_argument("--ttft", type=float, default=0.8, help="模拟上游的首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=40, help="模拟上游的输出速度（token/秒）")
+    parser.add_argument("--live", action="store_true", help="使用配置的上游（真实 API 或 LLM_REPLAY_MODE 回放）")
+    args = parser.parse_args()
+
+    if not args.live:
+        os.environ["LLM_STRUCTURED_OUTPUT"] = "off"
+        # 模拟上游不实际等待，也不应被默认的限流额度拖慢（否则排队时间会算进本地耗时）
+        os.environ["LLM_RATE_LIMIT_ENABLED"] = "false"
+    service = AIService()
+    upstream = None
+    if not args.live:
+        upstream = SimulatedUpstream(build_plan(args.weeks), args.ttft, args.tps)
+        service.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=upstream))
+    recorder = UsageRecorder(service.client)
+
+    previous_tasks = service._convert_agent6_format(build_plan(args.weeks))
+    runs = [("full", "full"), ("delta", "delta"), ("patch", "patch")]
+    results = [(name, bench_mode(service, recorder, upstream, previous_tasks, mode, args.rounds))
+               for name, mode in runs]
+    if upstream:
+        upstream.patch_valid = False
+        results.append(("patch(回退)", bench_mode(service, recorder, upstream, previous_tasks, "patch", args.rounds)))
+
+    source = "配置的上游" if args.live else f"模拟上游（首字 {args.ttft}s，{args.tps:.0f} token/s）"
+    print(f"已有计划 {args.weeks} 周，补充信息影响第{AFFECTED_WEEK}周，每种模式 {args.rounds} 次，{source}")
+    print("=" * 84)
+    baseline = results[0][1]
+    if args.live:
+        print(f"{'模式':<12} {'调用/次':>8} {'输入tok/次':>11} {'输出tok/次':>11} {'耗时(s)':>9} {'输出节省':>9}")
+    else:
+        print(f"{'模式':<12} {'调用/次':>8} {'输入tok/次':>11} {'输出tok/次':>11} {'上游(s)':>9} "
+              f"{'本地(ms)':>9} {'输出节省':>9}")
+    for name, r in results:
+        saved = 1 - r["completion_tokens"] / baseline["completion_tokens"] if baseline["completion_tokens"] else 0
+        row = f"{name:<12} {r['calls']:>8.1f} {r['prompt_tokens']:>11.0f} {r['completion_tokens']:>11.0f} "
+        if args.live:
+            row += f"{r['local_ms'] / 1000:>9.2f} {saved:>8.0%}"
+        else:
+            row += f"{r['upstream_s']:>9.2f} {r['local_ms']:>9.2f} {saved:>8.0%}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
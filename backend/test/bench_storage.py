@@ -0,0 +1,144 @@
+"""
+项目存储基准测试
+
+模拟多个 gunicorn worker 进程并发读写项目存储，统计读/写吞吐量。
+
+用法：
+    python -m test.bench_storage
+    python -m test.bench_storage --workers 8 --ops 2000 --read-ratio 0.8
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.storage import create_store
+
+
+def make_project() -> dict:
+    """构造一个接近真实大小的项目记录（4周 × 7天的任务）"""
+    daily = {
+        f"第1个月-第{w}周": {
+            f"1月{d}日": [{
+                "id": f"d-第{w}周-Day{d}",
+                "title": "建项目结构",
+                "description": "创建pages/css/js/img文件夹，建4个html文件并互相链接",
+                "output": "产出：项目骨架完成",
+                "estimated_hours": 1
+            }]
+            for d in range(1, 8)
+        }
+        for w in range(1, 5)
+    }
+    return {
+        "form_data": {"goal": "一个月内完成博物馆网页开发", "daily_hours": "2"},
+        "analysis": {"task_type": "项目开发类 - 网页开发"},
+        "tasks": {"yearly": [], "quarterly": {}, "monthly": {}, "weekly": {}, "daily": daily},
+        "follow_up_questions": [],
+        "answers": {},
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat()
+    }
+
+
+def worker(backend: str, path: str, ops: int, read_ratio: float, seed_ids: list, queue):
+    """单个 worker 进程：按比例混合执行读写"""
+    import random
+    store = create_store("projects", backend=backend, path=path)
+    record = make_project()
+    ids = list(seed_ids)
+    if backend == "memory":
+        # 内存存储是进程私有的，需要在本进程内预先写入种子数据
+        for project_id in ids:
+            store.put(project_id, record)
+    reads = writes = 0
+    read_time = write_time = 0.0
+
+    for _ in range(ops):
+        if ids and random.random() < read_ratio:
+            start = time.perf_counter()
+            store.get(random.choice(ids))
+            read_time += time.perf_counter() - start
+            reads += 1
+        else:
+            project_id = str(uuid.uuid4())
+            start = time.perf_counter()
+            store.put(project_id, record)
+            write_time += time.perf_counter() - start
+            writes += 1
+            ids.append(project_id)
+
+    queue.put((reads, read_time, writes, write_time))
+
+
+def run(backend: str, workers: int, ops: int, read_ratio: float) -> dict:
+    """运行一轮基准测试"""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    store = create_store("projects", backend=backend, path=path)
+    seed_ids = []
+    for _ in range(50):
+        project_id = str(uuid.uuid4())
+        store.put(project_id, make_project())
+        seed_ids.append(project_id)
+
+    # memory 后端不能跨进程共享，用单进程多轮模拟
+    if backend == "memory":
+        workers = 1
+        ops = ops * 4
+
+    queue = multiprocessing.Queue()
+    start = time.perf_counter()
+    procs = [
+        multiprocessing.Process(target=worker, args=(backend, path, ops, read_ratio, seed_ids, queue))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    reads = sum(r[0] for r in results)
+    writes = sum(r[2] for r in results)
+    read_time = sum(r[1] for r in results)
+    write_time = sum(r[3] for r in results)
+    return {
+        "backend": backend,
+        "workers": workers,
+        "reads": reads,
+        "writes": writes,
+        "elapsed_s": elapsed,
+        "total_ops_per_s": (reads + writes) / elapsed,
+        "read_avg_ms": read_time / reads * 1000 if reads else 0,
+        "write_avg_ms": write_time / writes * 1000 if writes else 0,
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="项目存储基准测试")
+    parser.add_argument("--workers", type=int, default=4, help="并发 worker 进程数")
+    parser.add_argument("--ops", type=int, default=1000, help="每个 worker 的操作次数")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="读操作占比")
+    args = parser.parse_args()
+
+    print("\n" + "=" * 70)
+    print(f"项目存储基准测试: {args.workers} workers × {args.ops} ops, 读占比 {args.read_ratio}")
+    print("=" * 70)
+    print(f"{'后端':<8} {'进程':>4} {'读次数':>8} {'写次数':>8} {'总吞吐(ops/s)':>14} {'读均值(ms)':>10} {'写均值(ms)':>10}")
+    for backend in ("memory", "sqlite"):
+        r = run(backend, args.workers, args.ops, args.read_ratio)
+        print(f"{r['backend']:<8} {r['workers']:>4} {r['reads']:>8} {r['writes']:>8} "
+              f"{r['total_ops_per_s']:>14.0f} {r['read_avg_ms']:>10.3f} {r['write_avg_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+录制离线测试用的 LLM fixture（写入 LLM_REPLAY_DIR，默认 test/fixtures/llm）
+
+按固定的几个场景运行完整流程，每次上游调用写入一个 fixture：
+- breakdown：4 周计划的拆解（Agent 1、2 分析 → 补充问题 → 任务拆解）
+- regenerate_patch：在上面的计划上按补充信息重新生成（REGENERATE_MODE=patch）
+- 6 周计划（截止日期为录制当天之后 43 天）的拆解和补丁模式重新生成，用于检查输出预算随周数增长后不被截断
+
+默认调用配置的上游（真实 API），用于定期重新录制；--simulated 时使用本地模拟上游：
+输出按请求内容返回（计划来自 test/tasks.json，补丁和补充问题与 bench_regenerate_modes 相同），
+token 用量按 2 字符/token 估算，思考模型另加推理 token（1024 + 输出 token / 2），耗时不做模拟。
+仓库中的 fixture 由 --simulated 录制。
+
+用法：
+    python -m test.record_fixtures --simulated
+    LLM_REPLAY_DIR=/tmp/llm python -m test.record_fixtures
+"""
+import os
+import sys
+import time
+import types
+import argparse
+from datetime import date, timedelta
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 必须在导入服务之前设置：每次调用都真实发出（不命中缓存、不合并），并写入 fixture
+os.environ.setdefault("SILICONFLOW_API_KEY", "record")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["LLM_REPLAY_MODE"] = "record"
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["LLM_COALESCE_ENABLED"] = "false"
+
+from openai.types.chat import ChatCompletion
+
+from services.ai_service import AIService
+from services.llm_replay import ReplayClient, get_llm_recorder
+from services.token_budget import is_thinking_model
+from test.bench_regenerate_modes import (
+    ANALYSIS,
+    ANSWERS,
+    FORM_DATA,
+    QUESTIONS,
+    SimulatedUpstream,
+    build_plan,
+)
+
+TASK_TYPE_RESPONSE = "项目交付类 - 在限定时间内完成一个可上线的网站"
+EXPERIENCE_RESPONSE = "beginner - 学过基础课程，缺少完整项目经验"
+# 较长周期的计划：剩余 42 天以上，按 6 周拆解
+LONG_WEEKS = 6
+LONG_GOAL = "六周内完成一个包含在线预约功能的博物馆网站"
+
+
+def long_form_data() -> dict:
+    """6 周计划的表单（截止日期相对今天计算）"""
+    deadline = (date.today() + timedelta(days=LONG_WEEKS * 7 + 1)).strftime("%Y-%m-%d")
+    return dict(FORM_DATA, goal=LONG_GOAL, deadline=deadline)
+
+
+class RecordingUpstream(SimulatedUpstream):
+    """模拟上游：在 SimulatedUpstream 的基础上补充分析 Agent 的输出，返回带 usage 的 ChatCompletion"""
+
+    def content(self, messages: list) -> str:
+        prompt = messages[-1]["content"]
+        if prompt.startswith("分析以下目标属于哪种任务类型"):
+            return TASK_TYPE_RESPONSE
+        if prompt.startswith("根据用户的目标和自评经验"):
+            return EXPERIENCE_RESPONSE
+        return super().content(messages)
+
+    def create(self, messages, model, **kwargs):
+        content = self.content(messages)
+        prompt_tokens = len("".join(m["content"] for m in messages)) // 2
+        output_tokens = len(content) // 2
+        reasoning_tokens = 1024 + output_tokens // 2 if is_thinking_model(model) else 0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens + reasoning_tokens,
+            "total_tokens": prompt_tokens + output_tokens + reasoning_tokens,
+        }
+        if reasoning_tokens:
+            usage["completion_tokens_details"] = {"reasoning_tokens": reasoning_tokens}
+        return ChatCompletion.model_validate({
+            "id": f"sim-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+
+def record_breakdown(service: AIService, form_data: dict) -> dict:
+    """场景一：拆解"""
+    service.regenerate_mode = "full"
+    result = service.generate_task_breakdown(form_data)
+    print(f"breakdown: {len(result['tasks']['weekly'])} 周，{len(result['follow_up_questions'])} 个补充问题")
+    return result
+
+
+def record_regenerate_patch(service: AIService, form_data: dict, tasks: dict):
+    """场景二：补丁模式重新生成"""
+    service.regenerate_mode = "patch"
+    result = service.regenerate_with_answers(form_data, ANSWERS, tasks, ANALYSIS, QUESTIONS, previous_answers={})
+    print(f"regenerate_patch: {len(result['tasks']['weekly'])} 周")
+
+
+def simulated_client(recorder, weeks: int) -> ReplayClient:
+    """经过录制包装的模拟上游（计划为指定周数）"""
+    upstream = RecordingUpstream(build_plan(weeks), ttft=0.0, tps=1.0)
+    return ReplayClient(recorder, types.SimpleNamespace(chat=types.SimpleNamespace(completions=upstream)))
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="录制离线测试用的 LLM fixture")
+    parser.add_argument("--simulated", action="store_true", help="使用本地模拟上游（仓库中的 fixture 由此生成）")
+    args = parser.parse_args()
+
+    service = AIService()
+    recorder = get_llm_recorder()
+    for form_data, weeks in ((FORM_DATA, 4), (long_form_data(), LONG_WEEKS)):
+        if args.simulated:
+            service.client = simulated_client(recorder, weeks)
+        result = record_breakdown(service, form_data)
+        record_regenerate_patch(service, form_data, result["tasks"])
+    print(f"已写入 {recorder.get_stats()['recorded']} 个 fixture: {recorder.store.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,22 @@
 """
 import sys
 import os
+import unittest
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# 离线测试：LLM_REPLAY_MODE=replay 下回放 test/fixtures/llm，不调用真实 API，结果确定
+OFFLINE_TEST_MODULES = [
+    "test_task_tree",
+    "test_json_parsing",
+    "test_llm_guards",
+    "test_time_span_local",
+    "test_replay_pipeline",
+    "test_token_budget",
+    "test_job_service",
+]
+
 
 def print_menu():
     """打印菜单"""
@@ -21,12 +33,24 @@ def print_menu():
     print("4. 测试 Agent 4: 补充问题生成")
     print("5. 测试 Agent 5: 任务拆解")
     print("6. 测试完整流程 (所有 Agents)")
+    print("7. 离线测试 (回放录制的 LLM 输出，不联网)")
     print("0. 退出")
     print("="*50)
 
 
+def run_offline_tests() -> bool:
+    """运行全部离线测试，返回是否全部通过"""
+    os.environ["LLM_REPLAY_MODE"] = "replay"
+    suite = unittest.defaultTestLoader.loadTestsFromNames(f"test.{name}" for name in OFFLINE_TEST_MODULES)
+    return unittest.TextTestRunner(verbosity=2).run(suite).wasSuccessful()
+
+
 def run_test(choice: str):
     """运行指定测试"""
+    if choice == "7":
+        run_offline_tests()
+        return
+
     test_modules = {
         "1": "test_agent1_task_type",
         "2": "test_agent2_experience",
@@ -64,12 +88,15 @@ def main():
     if len(sys.argv) > 1:
         # 命令行参数模式
         choice = sys.argv[1]
+        if choice == "7":
+            # 以退出码反映结果，便于在 CI 中运行
+            sys.exit(0 if run_offline_tests() else 1)
         run_test(choice)
     else:
         # 交互模式
         while True:
             print_menu()
-            choice = input("\n请选择要运行的测试 (0-6): ").strip()
+            choice = input("\n请选择要运行的测试 (0-7): ").strip()
 
             if choice == "0":
                 print("退出")
@@ -0,0 +1,191 @@
+"""
+本地 OpenAI 兼容的模拟上游 - 不依赖网络地压测完整链路（包括 HTTP 连接池）
+
+提供 POST /v1/chat/completions（支持 stream=true 的 SSE）和 GET /v1/models：
+- 响应来自 services/llm_replay.py 录制的 fixture（LLM_REPLAY_DIR，默认 test/fixtures/llm），
+  请求找不到完全一致的 fixture 时使用消息前缀最相近的一条
+- 没有任何可用的 fixture 时返回拆解流程的内置模拟输出（test/tasks.json 中的拆解结果、固定的补充问题和分析结果），
+  快速任务的节点和指南需要先录制 fixture
+- 延迟按 --latency 模拟：recorded 使用录制的耗时，数字为固定秒数
+- 请求的 max_tokens 小于录制的输出 token 数时截断输出，finish_reason 为 length（与回放模式相同）
+
+用法：
+    python -m test.stub_llm_server --port 8808 --latency 0.5
+    # 另一个终端中把服务指向模拟上游
+    SILICONFLOW_BASE_URL=http://127.0.0.1:8808/v1 SILICONFLOW_API_KEY=stub python app.py
+
+在基准测试中也可以直接在进程内启动：
+    server, base_url = start_stub_server(latency="0.2")
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_replay import (
+    DEFAULT_FIXTURE_DIR,
+    FixtureStore,
+    LatencyModel,
+    chunk_payloads,
+    completion_payload,
+    fixture_key,
+)
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    BREAKDOWN_RESPONSE = json.dumps(json.load(f), ensure_ascii=False)
+QUESTIONS_RESPONSE = json.dumps([
+    {"id": "q1", "question": "你更喜欢哪种学习方式？", "type": "single", "options": ["视频", "书籍", "实操"]}
+], ensure_ascii=False)
+
+
+def canned_content(messages: list) -> str:
+    """没有 fixture 时按请求内容返回对应 Agent 的模拟输出"""
+    if messages[0]["role"] == "system":
+        return BREAKDOWN_RESPONSE
+    if "补充问题" in messages[0]["content"]:
+        return QUESTIONS_RESPONSE
+    return "技能学习类 - 模拟分析结果"
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """持有 fixture 和延迟配置的 HTTP 服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address, fixture_dir: str, latency: LatencyModel, strict: bool = False):
+        super().__init__(address, StubHandler)
+        self.store = FixtureStore(fixture_dir)
+        self.latency = latency
+        self.strict = strict
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "hits": 0, "nearest": 0, "canned": 0}
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def resolve(self, request: dict):
+        """请求 → fixture；strict 模式下找不到完全一致的 fixture 返回 None"""
+        key = fixture_key(request)
+        fixture = self.store.get(key)
+        if fixture is not None:
+            self.count("hits")
+            return fixture
+        if self.strict:
+            return None
+        fixture = self.store.nearest(key, request)
+        if fixture is not None:
+            self.count("nearest")
+            return fixture
+        self.count("canned")
+        return {
+            "key": key,
+            "request": request,
+            "response": {"content": canned_content(request["messages"]), "finish_reason": "stop", "usage": None},
+            "latency_s": 0.0,
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubLLMServer
+
+    def log_message(self, format, *args):
+        # 压测时每个请求一行访问日志会淹没输出
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = self.server.store.models()
+            self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.counters)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count("requests")
+
+        fixture = self.server.resolve(request)
+        if fixture is None:
+            self._send_json(404, {"error": {"message": "没有与请求匹配的 fixture", "type": "not_found"}})
+            return
+
+        model = request.get("model", "stub")
+        if not request.get("stream"):
+            _, total = self.server.latency.delays(fixture)
+            if total > 0:
+                time.sleep(total)
+            self._send_json(200, completion_payload(fixture, model, request.get("max_tokens")))
+            return
+
+        chunks = chunk_payloads(fixture, model, request.get("max_tokens"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk, delay in zip(chunks, self.server.latency.stream_schedule(fixture, len(chunks))):
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, fixture_dir: str = None,
+                      latency: str = "recorded", scale: float = 1.0, strict: bool = False):
+    """在后台线程中启动模拟上游，返回 (server, base_url)；用完调用 server.shutdown()"""
+    server = StubLLMServer((host, port), fixture_dir or os.getenv("LLM_REPLAY_DIR") or DEFAULT_FIXTURE_DIR,
+                           LatencyModel(latency, scale), strict)
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容的模拟上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--dir", default=None, help="fixture 目录（默认 LLM_REPLAY_DIR 或 test/fixtures/llm）")
+    parser.add_argument("--latency", default="recorded", help="recorded 使用录制的耗时，数字为固定延迟（秒）")
+    parser.add_argument("--scale", type=float, default=1.0, help="延迟倍数")
+    parser.add_argument("--strict", action="store_true", help="只返回完全匹配的 fixture，否则 404")
+    args = parser.parse_args()
+
+    server = StubLLMServer((args.host, args.port), args.dir or os.getenv("LLM_REPLAY_DIR") or DEFAULT_FIXTURE_DIR,
+                           LatencyModel(args.latency, args.scale), args.strict)
+    print(f"模拟上游已启动: http://{args.host}:{args.port}/v1 （fixture {len(server.store)} 个，目录 {server.store.directory}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
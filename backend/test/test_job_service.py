@@ -0,0 +1,144 @@
+"""
+测试后台任务服务（services/job_service.py）和共享存储（services/storage.py）
+
+- 存储按 status 索引计数、清理和筛选，不读取任务结果；旧版本的表自动补上 status 列
+- 执行任务的 worker 退出后（心跳超过租约），任务被标记为失败，轮询和订阅方不会一直等待
+- 心跳线程让运行时间超过租约的任务保持有效
+
+使用临时目录中的 SQLite 文件，不依赖网络；与其他离线测试一样在 LLM_REPLAY_MODE=replay 下运行。
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from services.job_service import FAILED, QUEUED, RUNNING, SUCCEEDED, Job, JobService
+from services.storage import create_store
+
+
+def record(key: str, status: str, created_at: str) -> dict:
+    return {"id": key, "status": status, "created_at": created_at, "result": {"tasks": "x" * 100}}
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "app.db")
+
+
+class TestStatusIndex(StoreTestCase):
+    """按 status 计数、清理和筛选"""
+
+    def stores(self):
+        return [create_store("jobs", "memory"), create_store("jobs", "sqlite", self.path)]
+
+    def test_count_delete_list(self):
+        for store in self.stores():
+            with self.subTest(store=type(store).__name__):
+                for i, status in enumerate(["succeeded", "failed", "running", "succeeded", "queued", "cancelled"]):
+                    store.put(f"j{i}", record(f"j{i}", status, f"2026-01-01T00:00:0{i}"))
+                store.update("j2", lambda r: r.update(status="succeeded"))
+                self.assertEqual(store.count_by_status(),
+                                 {"succeeded": 3, "failed": 1, "queued": 1, "cancelled": 1})
+                # 已结束的任务只保留最新的 2 个
+                self.assertEqual(store.delete_oldest(("succeeded", "failed", "cancelled"), 2), 3)
+                self.assertEqual([key for key, _ in store.list()], ["j3", "j4", "j5"])
+                self.assertEqual([key for key, _ in store.list(("queued", "running"))], ["j4"])
+
+    def test_counts_without_decoding_records(self):
+        store = create_store("jobs", "sqlite", self.path)
+        store.put("j1", record("j1", "succeeded", "2026-01-01T00:00:01"))
+        with mock.patch("services.storage.json.loads", side_effect=AssertionError("不应解析记录")):
+            self.assertEqual(store.count_by_status(), {"succeeded": 1})
+            self.assertEqual(store.delete_oldest(("succeeded",), 0), 1)
+
+    def test_migrates_table_without_status(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, created_at TEXT NOT NULL, updated_at TEXT, data TEXT NOT NULL)")
+        conn.execute("INSERT INTO jobs VALUES (?, ?, NULL, ?)",
+                     ("j1", "2026-01-01", json.dumps(record("j1", "running", "2026-01-01"))))
+        conn.commit()
+        conn.close()
+        store = create_store("jobs", "sqlite", self.path)
+        self.assertEqual(store.count_by_status(), {"running": 1})
+
+
+class TestJobLease(StoreTestCase):
+    """心跳与租约"""
+
+    def service(self, **env) -> JobService:
+        with mock.patch.dict(os.environ, env):
+            service = JobService()
+        service._store = create_store("jobs", "sqlite", self.path)
+        return service
+
+    def orphan(self, service: JobService, status: str, heartbeat_age: float) -> Job:
+        """其他 worker 提交的任务：记录在共享存储中，本进程没有对应的 future"""
+        job = Job("breakdown")
+        job.status = status
+        job.heartbeat_at = time.time() - heartbeat_age
+        service._store.put(job.id, job.to_record())
+        return job
+
+    def test_dead_worker_job_fails(self):
+        service = self.service(JOB_HEARTBEAT_INTERVAL="10", JOB_LEASE_TIMEOUT="60")
+        running = self.orphan(service, RUNNING, 61)
+        queued = self.orphan(service, QUEUED, 61)
+        alive = self.orphan(service, RUNNING, 5)
+
+        job = service.get(running.id)
+        self.assertEqual(job.status, FAILED)
+        self.assertIn("心跳", job.error)
+        # 订阅方收到版本变化后结束等待
+        self.assertEqual(service.wait_for_update(running.id, 0, timeout=5).status, FAILED)
+        self.assertEqual(service.get(alive.id).status, RUNNING)
+
+        # 巡检处理没有被查询过的任务
+        service._expire_stale()
+        self.assertEqual(service.get_stats()["jobs"][FAILED], 2)
+        self.assertEqual(service.get(queued.id).status, FAILED)
+
+    def test_heartbeat_keeps_long_job_alive(self):
+        service = self.service(JOB_HEARTBEAT_INTERVAL="0.05", JOB_LEASE_TIMEOUT="0.2")
+        job = service.submit("breakdown", lambda job: time.sleep(0.5) or "完成")
+        # 另一个 worker 查询：运行时间已超过租约，但心跳仍在更新
+        observer = self.service(JOB_HEARTBEAT_INTERVAL="0.05", JOB_LEASE_TIMEOUT="0.2")
+        time.sleep(0.35)
+        self.assertEqual(observer.get(job.id).status, RUNNING)
+        deadline = time.monotonic() + 5
+        while not service.get(job.id).finished and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual((service.get(job.id).status, service.get(job.id).result), (SUCCEEDED, "完成"))
+
+    def test_expired_job_stays_failed(self):
+        service = self.service(JOB_HEARTBEAT_INTERVAL="10", JOB_LEASE_TIMEOUT="60")
+        job = self.orphan(service, QUEUED, 61)
+        self.assertEqual(service.get(job.id).status, FAILED)
+        # 失去心跳的 worker 恢复后不再执行，也不会覆盖失败状态
+        called = []
+        service._run(job.id, lambda job: called.append(job), None)
+        self.assertEqual(called, [])
+        self.assertEqual(service.get(job.id).status, FAILED)
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+测试模型输出的 JSON 解析：截断修复（services/json_repair.py）和流式增量解析（services/json_stream.py）
+
+纯本地逻辑，不调用模型；与其他离线测试一样在 LLM_REPLAY_MODE=replay 下运行。
+"""
+import os
+import sys
+import json
+import unittest
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from services.json_repair import parse_truncated_json, repair_json
+from services.json_stream import IncrementalJSONParser
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    TASKS_TEXT = f.read()
+TASKS = json.loads(TASKS_TEXT)
+
+
+class TestJSONRepair(unittest.TestCase):
+    """截断 JSON 修复"""
+
+    def test_truncated_outputs(self):
+        cases = [
+            ('{"a": [1, 2,', {"a": [1, 2]}),
+            # 截断在字符串值中间：保留已生成的文本
+            ('{"title": "学习HT', {"title": "学习HT"}),
+            # 截断在键或不完整的字面量：退回到上一个完整的值
+            ('{"a": 1, "b', {"a": 1}),
+            ('{"a": 1, "b": tru', {"a": 1}),
+            ('[1, 2.', [1]),
+            # 不完整的 \u 转义被丢弃
+            ('{"s": "a\\u4e2', {"s": "a"}),
+            # 代码块标记之后的 JSON
+            ('```json\n{"a": {"b": ["x"', {"a": {"b": ["x"]}}),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(parse_truncated_json(text), expected)
+
+    def test_complete_json_unchanged(self):
+        self.assertEqual(parse_truncated_json(TASKS_TEXT), TASKS)
+
+    def test_truncated_plan_keeps_closed_entries(self):
+        cut = TASKS_TEXT.index('"第3周"', TASKS_TEXT.index('"weekly"'))
+        data = parse_truncated_json(TASKS_TEXT[:cut + 3])
+        self.assertEqual(list(data["weekly"]), ["第1周", "第2周"])
+        self.assertEqual(data["monthly"], TASKS["monthly"])
+
+    def test_unrepairable(self):
+        self.assertIsNone(repair_json(""))
+        self.assertIsNone(repair_json("没有 JSON"))
+        with self.assertRaises(ValueError):
+            parse_truncated_json("没有 JSON")
+
+
+class TestIncrementalParser(unittest.TestCase):
+    """流式增量解析"""
+
+    def parse(self, text: str, chunk_size: int):
+        parser = IncrementalJSONParser()
+        entries = []
+        for i in range(0, len(text), chunk_size):
+            entries.extend(parser.feed(text[i:i + chunk_size]))
+        return parser, entries
+
+    def test_entries_match_full_parse(self):
+        expected = [(section, key, value) for section in ("monthly", "weekly", "daily")
+                    for key, value in TASKS[section].items()]
+        for chunk_size in (1, 7, 64, len(TASKS_TEXT)):
+            with self.subTest(chunk_size=chunk_size):
+                parser, entries = self.parse(TASKS_TEXT, chunk_size)
+                self.assertEqual(entries, expected)
+                self.assertTrue(parser.done)
+                self.assertEqual(parser.meta["project_name"], TASKS["project_name"])
+                self.assertEqual(parser.entries, len(expected))
+
+    def test_skips_code_fence(self):
+        _, entries = self.parse("```json\n" + TASKS_TEXT + "\n```", 16)
+        self.assertEqual(len(entries), len(TASKS["monthly"]) + len(TASKS["weekly"]) + len(TASKS["daily"]))
+
+    def test_truncated_stream_keeps_closed_entries(self):
+        cut = TASKS_TEXT.index('"第3周"', TASKS_TEXT.index('"weekly"'))
+        parser, entries = self.parse(TASKS_TEXT[:cut + 10], 32)
+        self.assertEqual([(section, key) for section, key, _ in entries],
+                         [("monthly", "第1个月"), ("weekly", "第1周"), ("weekly", "第2周")])
+        self.assertFalse(parser.done)
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+测试 LLM 调用前后的保护机制：请求合并（services/single_flight.py）、熔断（services/circuit_breaker.py）、
+令牌桶限流（services/rate_limiter.py）、对冲请求（services/hedging.py），以及流式调用读完后才归还限流许可、上报熔断结果（services/structured_output.py）
+
+熔断和令牌桶直接传入/替换时钟，不依赖真实等待（对冲请求只用零点几秒的真实等待）；与其他离线测试一样在 LLM_REPLAY_MODE=replay 下运行。
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from services.hedging import Hedger
+from services.rate_limiter import RateLimiter, _ModelLimiter, _TokenBucket, retry_after_seconds
+from services.single_flight import SingleFlight
+from services.structured_output import create_chat_completion
+
+REQUEST = httpx.Request("POST", "http://upstream/v1/chat/completions")
+
+
+def status_error(cls, status: int, headers: dict = None):
+    return cls("upstream error", response=httpx.Response(status, request=REQUEST, headers=headers), body=None)
+
+
+class FakeStream:
+    """按给定的文本段产出 chunk 的流式响应，error 不为空时在最后一段之后抛出"""
+
+    def __init__(self, parts, error: Exception = None):
+        self.parts = parts
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part), finish_reason=None)],
+                                  usage=None)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(stream):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream)))
+
+
+class TestSingleFlight(unittest.TestCase):
+    """并发的相同请求只调用一次"""
+
+    def run_concurrently(self, flight: SingleFlight, key: str, fn, callers: int = 5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_result(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "结果"
+
+        # 第一个调用进入 fn 之后再放行，确保其余调用都在等待同一次调用
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(flight, "k", fn)
+        self.assertEqual((results, errors, len(calls)), (["结果"] * 5, [], 1))
+        stats = flight.get_stats()
+        self.assertEqual((stats["leader_calls"], stats["deduplicated"], stats["in_flight"]), (1, 4, 0))
+
+    def test_async_calls_share_task(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "结果"
+
+        async def run():
+            first = asyncio.ensure_future(flight.ado("k", fn))
+            await asyncio.sleep(0)
+            # 一个调用方被取消不影响其他调用方
+            first.cancel()
+            return await asyncio.gather(*(flight.ado("k", fn) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(run()), ["结果"] * 3)
+        # 另一个事件循环中的相同请求重新发起
+        self.assertEqual(asyncio.run(flight.ado("k", fn)), "结果")
+        stats = flight.get_stats()
+        self.assertEqual((len(calls), stats["leader_calls"], stats["deduplicated"], stats["in_flight"]), (2, 2, 3, 0))
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError("上游错误")
+
+        threading.Timer(0.2, release.set).start()
+        results, errors = self.run_concurrently(flight, "k", fail, callers=3)
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ["上游错误"] * 3)
+        # 调用结束后不保留结果，下一次重新调用
+        self.assertEqual(flight.do("k", lambda: "重试成功"), "重试成功")
+
+    def test_different_keys_not_merged(self):
+        flight = SingleFlight()
+        self.assertEqual([flight.do(key, lambda key=key: key) for key in "abc"], ["a", "b", "c"])
+        self.assertEqual(flight.get_stats()["deduplicated"], 0)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """按模型熔断：连续失败 → 熔断 → 冷却后探测 → 恢复或重新熔断"""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("services.circuit_breaker.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 各模型的慢调用阈值在首次调用时读取，环境变量需要在整个测试期间生效
+        env = mock.patch.dict(os.environ, {"LLM_BREAKER_ENABLED": "true", "LLM_BREAKER_FAILURES": "3",
+                                           "LLM_BREAKER_COOLDOWN": "30", "LLM_BREAKER_PROBES": "1",
+                                           "LLM_BREAKER_SLOW_DEFAULT": "10"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.breaker = CircuitBreaker()
+
+    def call(self, error=None, latency: float = 1.0):
+        probe = self.breaker.before_call("m")
+        self.breaker.after_call("m", probe, error, latency)
+
+    def state(self) -> str:
+        return self.breaker.get_stats()["models"]["m"]["state"]
+
+    def test_opens_after_consecutive_failures(self):
+        self.call(status_error(InternalServerError, 500))
+        self.call(APIConnectionError(request=REQUEST))
+        self.call()  # 成功调用清零连续失败次数
+        for _ in range(3):
+            self.call(status_error(InternalServerError, 503))
+        self.assertEqual(self.state(), OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call("m")
+        self.assertEqual(self.breaker.get_stats()["models"]["m"]["rejected"], 1)
+
+    def test_client_errors_do_not_count(self):
+        for _ in range(5):
+            self.call(status_error(RateLimitError, 429))
+        self.assertEqual(self.state(), CLOSED)
+
+    def test_slow_calls_count(self):
+        for _ in range(3):
+            self.call(latency=11.0)
+        self.assertEqual(self.state(), OPEN)
+
+    def test_probe_recovers_or_reopens(self):
+        for _ in range(3):
+            self.call(APIConnectionError(request=REQUEST))
+        self.now += 31
+        # 冷却结束：只放行一个探测请求
+        probe = self.breaker.before_call("m")
+        self.assertTrue(probe)
+        self.assertEqual(self.state(), HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call("m")
+        # 探测失败：重新熔断
+        self.breaker.after_call("m", probe, APIConnectionError(request=REQUEST), 1.0)
+        self.assertEqual(self.state(), OPEN)
+        self.now += 31
+        self.call()
+        self.assertEqual(self.state(), CLOSED)
+        self.assertFalse(self.breaker.before_call("m"))
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {"LLM_BREAKER_ENABLED": "false"}):
+            breaker = CircuitBreaker()
+        for _ in range(10):
+            breaker.after_call("m", breaker.before_call("m"), APIConnectionError(request=REQUEST), 1.0)
+        self.assertEqual(breaker.get_stats()["models"], {})
+
+
+class TestRateLimiter(unittest.TestCase):
+    """令牌桶限流"""
+
+    def test_token_bucket(self):
+        bucket = _TokenBucket(60)  # 每秒补充 1 个
+        now = bucket.updated
+        self.assertEqual(bucket.reserve(60, now), 0.0)
+        # 桶已空：再要 3 个需要等 3 秒
+        self.assertAlmostEqual(bucket.reserve(3, now), 3.0)
+        # 2 秒后补充了 2 个，仍欠 1 个
+        self.assertAlmostEqual(bucket.reserve(0, now + 2), 1.0)
+        # 单次超过容量时按容量计，不会永远等待
+        bucket = _TokenBucket(60)
+        self.assertEqual(bucket.reserve(1000, bucket.updated), 0.0)
+
+    def test_refund(self):
+        bucket = _TokenBucket(100)
+        bucket.reserve(80, bucket.updated)
+        bucket.refund(50)
+        self.assertAlmostEqual(bucket.level, 70.0)
+        bucket.refund(1000)
+        self.assertAlmostEqual(bucket.level, 100.0)
+
+    def test_tpm_adjusts_to_actual_usage(self):
+        limiter = _ModelLimiter("m", rpm=0, tpm=6000, concurrency=0)
+        permit = limiter.acquire(5000)
+        permit.release(used_tokens=1000)
+        # 预扣 5000，实际用了 1000：退回 4000
+        self.assertAlmostEqual(limiter._tokens.level, 5000, delta=5)
+        permit.release(used_tokens=0)  # 重复 release 无效
+        self.assertEqual(limiter.get_stats()["active"], 0)
+
+    def test_concurrency_limit(self):
+        limiter = _ModelLimiter("m", rpm=0, tpm=0, concurrency=1)
+        first = limiter.acquire(10)
+        acquired = threading.Event()
+
+        def second():
+            limiter.acquire(10).release()
+            acquired.set()
+
+        thread = threading.Thread(target=second)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        first.release()
+        self.assertTrue(acquired.wait(2))
+        thread.join()
+
+    def test_penalize_blocks_model(self):
+        limiter = _ModelLimiter("m", rpm=0, tpm=0, concurrency=0)
+        self.assertEqual(limiter.penalize(0.2), 0.2)
+        start = time.monotonic()
+        limiter.acquire(1).release()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(limiter.get_stats()["throttled"], 1)
+
+    def test_stream_holds_permit_until_finished(self):
+        with mock.patch.dict(os.environ, {"LLM_RATE_LIMIT_WORKERS": "1", "LLM_TPM_DEFAULT": "6000",
+                                          "LLM_CONCURRENCY_DEFAULT": "1"}):
+            limiter = RateLimiter()
+            model = "stream-permit-model"
+            limiter.penalize(model, 0.0)
+        stream = FakeStream(["一二三四"] * 50)
+        with mock.patch("services.structured_output.get_rate_limiter", return_value=limiter):
+            response = create_chat_completion(fake_client(stream), model=model, max_tokens=4000, stream=True,
+                                              messages=[{"role": "user", "content": "x" * 200}])
+            # 流对象已返回但尚未读完：许可仍被占用
+            self.assertEqual(limiter.get_stats()["models"][model]["active"], 1)
+            with response:
+                self.assertEqual(sum(len(chunk.choices[0].delta.content) for chunk in response), 200)
+        state = limiter._limiter(model)
+        self.assertEqual((state.get_stats()["active"], state._consecutive_throttles, stream.closed), (0, 0, True))
+        # 预扣 100 + 1000，实际约 100 + 200 / 2：多扣的退回
+        self.assertAlmostEqual(state._tokens.level, 6000 - 200, delta=5)
+
+    def test_stream_closed_early_releases_permit(self):
+        with mock.patch.dict(os.environ, {"LLM_RATE_LIMIT_WORKERS": "1", "LLM_CONCURRENCY_DEFAULT": "1"}):
+            limiter = RateLimiter()
+            model = "stream-close-model"
+            limiter._limiter(model)
+        with mock.patch("services.structured_output.get_rate_limiter", return_value=limiter):
+            with create_chat_completion(fake_client(FakeStream(["a", "b", "c"])), model=model, stream=True,
+                                        messages=[{"role": "user", "content": "x"}]) as response:
+                for _ in response:
+                    break
+        self.assertEqual(limiter.get_stats()["models"][model]["active"], 0)
+
+    def test_stream_outcome_reported_when_finished(self):
+        with mock.patch.dict(os.environ, {"LLM_BREAKER_ENABLED": "true", "LLM_BREAKER_FAILURES": "2"}):
+            breaker = CircuitBreaker()
+        model = "stream-breaker-model"
+        with mock.patch("services.structured_output.get_circuit_breaker", return_value=breaker):
+            for failures in range(2):
+                response = create_chat_completion(
+                    fake_client(FakeStream(["a", "b"], APIConnectionError(request=REQUEST))),
+                    model=model, stream=True, messages=[{"role": "user", "content": "x"}]
+                )
+                # 建立流时还没有结果
+                self.assertEqual(breaker.get_stats()["models"][model]["failures"], failures)
+                with self.assertRaises(APIConnectionError):
+                    with response:
+                        list(response)
+            # 流中途断开计为上游失败，连续两次后熔断
+            self.assertEqual(breaker.get_stats()["models"][model]["state"], OPEN)
+            with self.assertRaises(CircuitOpenError):
+                create_chat_completion(fake_client(FakeStream([])), model=model, stream=True,
+                                       messages=[{"role": "user", "content": "x"}])
+
+    def test_limits_divided_per_worker(self):
+        with mock.patch.dict(os.environ, {"LLM_RATE_LIMIT_WORKERS": "4", "LLM_RPM_DEFAULT": "100",
+                                          "LLM_TPM_DEFAULT": "0", "LLM_CONCURRENCY_DEFAULT": "2"}):
+            limiter = RateLimiter()
+            stats = limiter._limiter("m").get_stats()
+        self.assertEqual((stats["rpm"], stats["tpm"], stats["concurrency"]), (25, 0, 1))
+
+    def test_retry_after_header(self):
+        self.assertEqual(retry_after_seconds(status_error(RateLimitError, 429, {"retry-after": "7"})), 7.0)
+        self.assertIsNone(retry_after_seconds(status_error(RateLimitError, 429)))
+
+
+class TestHedger(unittest.TestCase):
+    """对冲请求从限流放行后开始计时，限流排队时不对冲"""
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"LLM_HEDGE_ENABLED": "true", "LLM_HEDGE_DEFAULT_DELAY": "0.1",
+                                          "LLM_HEDGE_MIN_DELAY": "0", "LLM_HEDGE_MAX_RATE": "1",
+                                          "LLM_RATE_LIMIT_WORKERS": "1", "LLM_CONCURRENCY_DEFAULT": "2"}):
+            self.hedger = Hedger()
+            self.limiter = RateLimiter()
+            self.limiter._limiter("m")
+        patcher = mock.patch("services.hedging.get_rate_limiter", return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def upstream(self, durations):
+        """第 n 次调用先取得许可，再耗时 durations[n] 秒"""
+        def fn(model):
+            index = len(self.calls)
+            self.calls.append(model)
+            permit = self.limiter.acquire(model, 1)
+            try:
+                time.sleep(durations[index])
+            finally:
+                permit.release(1)
+            return index
+        return fn
+
+    def test_queue_wait_not_hedged(self):
+        self.limiter.penalize("m", 0.3)
+        start = time.monotonic()
+        self.assertEqual(self.hedger.call("m", self.upstream([0.02])), 0)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+        stats = self.hedger.get_stats()
+        self.assertEqual((stats["calls"], stats["hedged"]), (1, 0))
+        # 延迟统计不含排队时间
+        self.assertLess(stats["models"]["m"]["p95_s"], 0.1)
+
+    def test_slow_call_hedged(self):
+        self.assertEqual(self.hedger.call("m", self.upstream([0.5, 0.01])), 1)
+        stats = self.hedger.get_stats()
+        self.assertEqual((stats["hedged"], stats["hedge_wins"]), (1, 1))
+
+    def test_congested_model_not_hedged(self):
+        # 另一个调用占用了一个并发名额，原请求占用另一个：对冲需要排队
+        held = self.limiter.acquire("m", 1)
+        self.addCleanup(held.release)
+        self.assertEqual(self.hedger.call("m", self.upstream([0.3])), 0)
+        stats = self.hedger.get_stats()
+        self.assertEqual((stats["hedged"], stats["congested"], self.calls), (0, 1, ["m"]))
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
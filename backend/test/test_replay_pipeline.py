@@ -0,0 +1,149 @@
+"""
+测试完整流程的离线回放：任务拆解（线程版和 asyncio 版，asyncio 版按事件循环使用各自的客户端）和补丁模式重新生成（包括补丁输出被截断时的整体重新生成）
+
+LLM 调用全部从 test/fixtures/llm 回放（fixture 由 python -m test.record_fixtures --simulated 录制），
+不发出网络请求。提示词中包含当天日期，回放按同一模型下消息前缀最相近的 fixture 匹配。
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["ANALYSIS_MODE"] = "separate"
+os.environ["TIME_SPAN_MODE"] = "local"
+os.environ["BREAKDOWN_MODE"] = "single"
+os.environ["LLM_STREAMING"] = "false"
+
+from services.ai_service import AIService
+from services.async_ai_service import AsyncAIService
+from services.http_client import HTTPClientPool
+from services.llm_replay import FixtureStore, LLMRecorder, ReplayClient, get_llm_recorder
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FORM_DATA = {"goal": "完成一个包含4个页面的博物馆网站", "experience": "beginner", "deadline": "", "daily_hours": "2"}
+ANALYSIS = {"task_type": "项目交付类", "experience_level": "beginner", "time_span": "3个月"}
+QUESTIONS = [{"id": "q1", "question": "你每周哪几天没有空？", "type": "text", "options": None}]
+ANSWERS = {"q1": "第2周要出差，只有周末有时间"}
+
+with open(os.path.join(TEST_DIR, "tasks.json"), "r", encoding="utf-8") as f:
+    RECORDED_PLAN = json.load(f)
+
+
+class TestReplayPipeline(unittest.TestCase):
+    """回放录制的 LLM 输出运行完整流程"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recorder = get_llm_recorder()
+        if not len(cls.recorder.store):
+            raise unittest.SkipTest(f"没有 LLM fixture: {cls.recorder.store.directory}")
+
+    def setUp(self):
+        self.before = self.recorder.get_stats()
+
+    def assert_replayed(self, calls: int):
+        stats = self.recorder.get_stats()
+        replayed = (stats["hits"] - self.before["hits"]) + (stats["nearest"] - self.before["nearest"])
+        self.assertEqual(stats["misses"], self.before["misses"])
+        self.assertEqual(replayed, calls)
+
+    def assert_breakdown(self, result: dict):
+        tasks = result["tasks"]
+        self.assertEqual(list(tasks["weekly"]), list(RECORDED_PLAN["weekly"]))
+        self.assertEqual(len(tasks["daily"]), len(RECORDED_PLAN["daily"]))
+        first_week = next(iter(tasks["weekly"].values()))[0]
+        self.assertEqual(first_week["title"], RECORDED_PLAN["weekly"]["第1周"]["goal"])
+        self.assertEqual([q["id"] for q in result["follow_up_questions"]], ["q2"])
+        self.assertTrue(result["analysis"]["task_type"].startswith("项目交付类"))
+
+    def test_breakdown(self):
+        result = AIService().generate_task_breakdown(FORM_DATA)
+        self.assert_breakdown(result)
+        # 任务类型、经验水平、补充问题、任务拆解；时间跨度由本地规则计算
+        self.assert_replayed(4)
+
+    def test_breakdown_async(self):
+        result = asyncio.run(AsyncAIService().generate_task_breakdown(FORM_DATA))
+        self.assert_breakdown(result)
+        self.assert_replayed(4)
+
+    def test_async_clients_per_event_loop(self):
+        pool = HTTPClientPool()
+
+        async def clients():
+            return pool.get_async_openai_client(), pool.get_async_openai_client()
+
+        first, second = asyncio.run(clients()), asyncio.run(clients())
+        self.assertIs(first[0], first[1])
+        # 每个事件循环使用自己的客户端，不复用绑定在已关闭循环上的连接
+        self.assertIsNot(first[0], second[0])
+
+    def test_regenerate_patch(self):
+        service = AIService()
+        service.regenerate_mode = "patch"
+        previous = service._convert_agent6_format(RECORDED_PLAN)
+        result = service.regenerate_with_answers(FORM_DATA, ANSWERS, previous, ANALYSIS, QUESTIONS, previous_answers={})
+        tasks = result["tasks"]
+        # 录制的补丁只改第2周：周目标的描述、第2天的任务，删除第3天，在第6天之后新增一个任务
+        self.assertEqual(tasks["weekly"]["第2周"][0]["description"], "产出：页面线框图 + 首页实现")
+        week2 = [task for days in tasks["daily"].values() for day in days.values() for task in day
+                 if task["id"].startswith("d-第2周-")]
+        ids = [task["id"] for task in week2]
+        self.assertNotIn("d-第2周-Day3", ids)
+        self.assertIn("d-第2周-Day6-new1", ids)
+        self.assertEqual(tasks["weekly"]["第1周"], previous["weekly"]["第1周"])
+        # 补丁和补充问题
+        self.assert_replayed(2)
+
+    def test_truncated_patch_falls_back_to_full(self):
+        # 补丁输出在第二个操作的标题中间被截断，按上限重新请求后仍被截断
+        with tempfile.TemporaryDirectory() as directory:
+            store = FixtureStore(directory)
+            truncated = None
+            for fixture in self.recorder.store:
+                if fixture["request"]["messages"][-1]["content"].startswith("请根据用户的补充信息调整已有任务计划"):
+                    content = fixture["response"]["content"]
+                    truncated = content[:content.index("阅读布局相关文档") + 4]
+                    fixture = dict(fixture, response=dict(fixture["response"], content=truncated, finish_reason="length"))
+                store.save(fixture)
+            with mock.patch.dict(os.environ, {"LLM_REPLAY_DIR": directory}):
+                recorder = LLMRecorder()
+            service = AIService()
+            service.client = ReplayClient(recorder)
+            service.regenerate_mode = "patch"
+            previous = service._convert_agent6_format(RECORDED_PLAN)
+            full = {"weekly": {}, "daily": {}}
+            with mock.patch.object(service, "_regenerate_full", return_value=full) as regenerate_full:
+                result = service.regenerate_with_answers(FORM_DATA, ANSWERS, previous, ANALYSIS, QUESTIONS, previous_answers={})
+
+        # 截断修复会得到前两个操作和被截断的标题，补丁不能这样部分应用
+        repaired = service._loads_json_output(truncated)
+        self.assertEqual([op["op"] for op in repaired["ops"]], ["replace", "replace"])
+        self.assertEqual(repaired["ops"][1]["task"]["title"], "阅读布局")
+        regenerate_full.assert_called_once()
+        self.assertIs(result["tasks"], full)
+        # 补丁、按上限重新请求的补丁、补充问题
+        stats = recorder.get_stats()
+        self.assertEqual((stats["hits"] + stats["nearest"], stats["misses"]), (3, 0))
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
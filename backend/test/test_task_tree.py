@@ -0,0 +1,154 @@
+"""
+测试任务树工具（services/task_tree.py）：周次/月次解析、增量合并（merge_weeks）、补丁应用（apply_patch）
+
+纯本地逻辑，不调用模型；与其他离线测试一样在 LLM_REPLAY_MODE=replay 下运行。
+"""
+import os
+import sys
+import copy
+import unittest
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from services.task_tree import PatchError, apply_patch, merge_weeks, month_number, plan_weeks, week_number
+
+
+def task(task_id: str, title: str, **fields) -> dict:
+    return {"id": task_id, "title": title, "description": "", "estimated_hours": 1, **fields}
+
+
+def sample_plan() -> dict:
+    """前端格式的 2 周计划"""
+    return {
+        "monthly": {"第1个月": [task("m-第1个月", "完成网站")]},
+        "weekly": {
+            "第1周": [task("w-第1周", "设计")],
+            "第2周": [task("w-第2周", "首页")],
+        },
+        "daily": {
+            "第1个月-第1周": {
+                "1月5日": [task("d-第1周-Day1", "画线框图", output="线框图")],
+                "1月6日": [task("d-第1周-Day2", "定配色", output="配色表")],
+            },
+            "第1个月-第2周": {
+                "1月12日": [task("d-第2周-Day1", "搭页面", output="首页骨架")],
+                "1月13日": [task("d-第2周-Day2", "写样式", output="首页样式")],
+            },
+        },
+    }
+
+
+class TestKeyNumbers(unittest.TestCase):
+    """周次/月次解析"""
+
+    def test_week_number(self):
+        self.assertEqual(week_number("第3周"), 3)
+        self.assertEqual(week_number("第1个月-第12周"), 12)
+        self.assertEqual(week_number("第 2 周 - 入门"), 2)
+        self.assertIsNone(week_number("第1个月"))
+
+    def test_month_number(self):
+        self.assertEqual(month_number("第2个月"), 2)
+        self.assertEqual(month_number("第10月"), 10)
+        self.assertIsNone(month_number("第3周"))
+
+    def test_plan_weeks(self):
+        self.assertEqual(plan_weeks(sample_plan()), [1, 2])
+
+
+class TestMergeWeeks(unittest.TestCase):
+    """增量重新生成的合并"""
+
+    def test_replaces_only_given_weeks(self):
+        plan = sample_plan()
+        delta = {
+            "weekly": {"第2周": [task("w-第2周", "首页（周末集中）")], "第1周": [task("w-第1周", "不应替换")]},
+            "daily": {"第1个月-第2周": {"2月1日": [task("d-第2周-Day1", "周末搭页面")]}},
+        }
+        merged = merge_weeks(plan, delta, [2])
+        self.assertEqual(merged["weekly"]["第1周"][0]["title"], "设计")
+        self.assertEqual(merged["weekly"]["第2周"][0]["title"], "首页（周末集中）")
+        # 替换的周沿用原来的日期
+        self.assertEqual(list(merged["daily"]["第1个月-第2周"]), ["1月12日"])
+        self.assertEqual(merged["daily"]["第1个月-第2周"]["1月12日"][0]["title"], "周末搭页面")
+        # 第1周和月度目标不变，周的顺序不变
+        self.assertEqual(merged["daily"]["第1个月-第1周"], plan["daily"]["第1个月-第1周"])
+        self.assertEqual(merged["monthly"], plan["monthly"])
+        self.assertEqual(list(merged["weekly"]), ["第1周", "第2周"])
+
+    def test_does_not_modify_input(self):
+        plan = sample_plan()
+        original = copy.deepcopy(plan)
+        merge_weeks(plan, {"weekly": {"第1周": [task("w-第1周", "新")]}}, [1])
+        self.assertEqual(plan, original)
+
+    def test_appends_new_week(self):
+        merged = merge_weeks(sample_plan(), {"weekly": {"第3周": [task("w-第3周", "上线")]}}, [3])
+        self.assertEqual(list(merged["weekly"]), ["第1周", "第2周", "第3周"])
+
+
+class TestApplyPatch(unittest.TestCase):
+    """补丁模式重新生成的补丁应用"""
+
+    def test_replace_remove_add(self):
+        plan = sample_plan()
+        patched = apply_patch(plan, [
+            {"op": "replace", "id": "w-第2周", "task": {"description": "产出：首页"}},
+            {"op": "remove", "id": "d-第1周-Day2"},
+            {"op": "add", "after": "d-第2周-Day2", "task": {"title": "周末集中实现", "estimated_hours": 4}},
+        ])
+        week = patched["weekly"]["第2周"][0]
+        self.assertEqual((week["title"], week["description"]), ("首页", "产出：首页"))
+        self.assertEqual(patched["daily"]["第1个月-第1周"]["1月6日"], [])
+        added = patched["daily"]["第1个月-第2周"]["1月13日"]
+        self.assertEqual([t["id"] for t in added], ["d-第2周-Day2", "d-第2周-Day2-new1"])
+        self.assertEqual(added[1], {"id": "d-第2周-Day2-new1", "description": "", "title": "周末集中实现",
+                                    "estimated_hours": 4})
+        # 原计划不变
+        self.assertEqual(plan, sample_plan())
+
+    def test_new_ids_are_unique(self):
+        patched = apply_patch(sample_plan(), [
+            {"op": "add", "after": "w-第1周", "task": {"title": "A"}},
+            {"op": "add", "after": "w-第1周", "task": {"title": "B"}},
+        ])
+        self.assertEqual([t["id"] for t in patched["weekly"]["第1周"]],
+                         ["w-第1周", "w-第1周-new2", "w-第1周-new1"])
+
+    def test_ignores_unknown_fields(self):
+        patched = apply_patch(sample_plan(), [
+            {"op": "replace", "id": "m-第1个月", "task": {"title": "上线网站", "id": "hacked", "extra": 1}},
+        ])
+        self.assertEqual(patched["monthly"]["第1个月"][0]["id"], "m-第1个月")
+        self.assertNotIn("extra", patched["monthly"]["第1个月"][0])
+
+    def test_invalid_ops(self):
+        invalid = [
+            "not a list",
+            [{"op": "replace", "id": "w-第9周", "task": {"title": "x"}}],
+            [{"op": "remove", "id": "w-第1周"}, {"op": "remove", "id": "w-第1周"}],
+            [{"op": "add", "after": "w-第1周", "task": {"description": "缺少标题"}}],
+            [{"op": "replace", "id": "w-第1周", "task": {}}],
+            [{"op": "replace", "id": "w-第1周"}],
+            [{"op": "move", "id": "w-第1周"}],
+        ]
+        for ops in invalid:
+            with self.subTest(ops=ops):
+                with self.assertRaises(PatchError):
+                    apply_patch(sample_plan(), ops)
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
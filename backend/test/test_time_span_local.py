@@ -0,0 +1,83 @@
+"""
+测试 Agent 3 的本地时间跨度规则（AIService._local_time_span）
+
+按剩余天数计算标签，不调用模型；截止日期按今天的相对日期生成，结果与运行日期无关。
+与其他离线测试一样在 LLM_REPLAY_MODE=replay 下运行。
+"""
+import os
+import sys
+import unittest
+from datetime import date, timedelta
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["TIME_SPAN_MODE"] = "local"
+os.environ["TIME_SPAN_LLM_FALLBACK"] = "false"
+
+from services.ai_service import AIService
+from services.llm_replay import get_llm_recorder
+
+
+def deadline_in(days: int) -> dict:
+    return {"goal": "测试目标", "deadline": (date.today() + timedelta(days=days)).strftime("%Y-%m-%d")}
+
+
+class TestLocalTimeSpan(unittest.TestCase):
+    """本地时间跨度规则"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.service = AIService()
+
+    def test_by_days_left(self):
+        cases = [
+            (0, "短期(1天) - 使用日度拆解"),
+            (7, "短期(7天) - 使用日度拆解"),
+            (8, "短期(8天) - 使用周度+日度两层拆解"),
+            (29, "短期(29天) - 使用周度+日度两层拆解"),
+            (30, "中期(1个月) - 使用月度+周度+日度三层拆解"),
+            (90, "中期(3个月) - 使用月度+周度+日度三层拆解"),
+            (179, "中期(6个月) - 使用月度+周度+日度三层拆解"),
+            (180, "长期(6个月) - 使用年度+月度+周度+日度四层拆解"),
+            (365, "长期(1年) - 使用年度+月度+周度+日度四层拆解"),
+            (540, "长期(1年6个月) - 使用年度+月度+周度+日度四层拆解"),
+        ]
+        for days, expected in cases:
+            with self.subTest(days=days):
+                self.assertEqual(self.service._local_time_span(deadline_in(days)), (expected, False))
+
+    def test_ambiguous(self):
+        cases = [
+            ({"goal": "测试目标"}, "中期(无固定期限)"),
+            ({"goal": "测试目标", "deadline": "下个月"}, "中期(截止日期未知)"),
+            (deadline_in(-3), "短期(已过截止日期)"),
+        ]
+        for form_data, prefix in cases:
+            with self.subTest(form_data=form_data):
+                label, ambiguous = self.service._local_time_span(form_data)
+                self.assertTrue(label.startswith(prefix), label)
+                self.assertTrue(ambiguous)
+
+    def test_agent_does_not_call_model(self):
+        recorder = get_llm_recorder()
+        before = recorder.get_stats()
+        label = self.service._agent_time_span(deadline_in(60))
+        after = recorder.get_stats()
+        self.assertEqual(label, "中期(2个月) - 使用月度+周度+日度三层拆解")
+        self.assertEqual((after["hits"], after["nearest"], after["misses"]),
+                         (before["hits"], before["nearest"], before["misses"]))
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+测试输出 token 预算（services/token_budget.py）：推理预算随周数增长、超时下限，以及回放时不因预算被截断
+
+回放 test/fixtures/llm 中 4 周和 6 周计划的拆解和补丁模式重新生成（fixture 由 python -m test.record_fixtures --simulated 录制），
+回放按请求的 max_tokens 截断超出的输出（finish_reason=length）。分别使用按 Agent 估算的预算和原来的固定值
+（LLM_TOKEN_BUDGET=false）运行，截断次数和上游调用次数应当相同。
+"""
+import os
+import sys
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线运行：不发出网络请求，LLM 调用从 test/fixtures/llm 回放
+os.environ["LLM_REPLAY_MODE"] = "replay"
+os.environ.setdefault("LLM_REPLAY_LATENCY", "0")
+os.environ.setdefault("SILICONFLOW_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["ANALYSIS_MODE"] = "separate"
+os.environ["TIME_SPAN_MODE"] = "local"
+os.environ["BREAKDOWN_MODE"] = "single"
+os.environ["LLM_STREAMING"] = "false"
+
+from services.ai_service import AIService
+from services.llm_replay import completion_payload, get_llm_recorder
+from services.token_budget import TokenBudgeter
+
+THINKING_MODEL = "moonshotai/Kimi-K2-Thinking"
+FAST_MODEL = "inclusionAI/Ling-flash-2.0"
+MESSAGES = [{"role": "user", "content": "拆解任务"}]
+
+# 与 test/record_fixtures.py 录制的场景一致
+FORM_DATA = {"goal": "完成一个包含4个页面的博物馆网站", "experience": "beginner", "deadline": "", "daily_hours": "2"}
+LONG_GOAL = "六周内完成一个包含在线预约功能的博物馆网站"
+ANALYSIS = {"task_type": "项目交付类", "experience_level": "beginner", "time_span": "3个月"}
+QUESTIONS = [{"id": "q1", "question": "你每周哪几天没有空？", "type": "text", "options": None}]
+ANSWERS = {"q1": "第2周要出差，只有周末有时间"}
+
+
+def long_form_data() -> dict:
+    deadline = (date.today() + timedelta(days=43)).strftime("%Y-%m-%d")
+    return dict(FORM_DATA, goal=LONG_GOAL, deadline=deadline)
+
+
+def budgeter(**env) -> TokenBudgeter:
+    """按给定的环境变量创建预算器（其余 LLM_TOKEN_BUDGET_* 使用默认值）"""
+    cleared = {key: value for key, value in os.environ.items() if not key.startswith("LLM_TOKEN_BUDGET")}
+    with mock.patch.dict(os.environ, dict(cleared, **env), clear=True):
+        return TokenBudgeter()
+
+
+class TestPlan(unittest.TestCase):
+    """预算和超时的计算"""
+
+    def test_thinking_allowance_grows_with_weeks(self):
+        budget = budgeter()
+        plans = [budget.plan("regenerate_patch", THINKING_MODEL, MESSAGES, weeks) for weeks in (4, 6, 12)]
+        self.assertEqual([plan.max_tokens for plan in plans], [8704, 9472, 11264])
+        self.assertEqual(budget.thinking_allowance(12) - budget.thinking_allowance(4), 8 * 256)
+        # 非思考模型没有推理预算
+        fast = budget.plan("regenerate_patch", FAST_MODEL, MESSAGES, 12)
+        self.assertEqual(fast.max_tokens, 2048)
+
+    def test_thinking_allowance_configurable(self):
+        budget = budgeter(LLM_TOKEN_BUDGET_THINKING="4096", LLM_TOKEN_BUDGET_THINKING_PER_WEEK="0")
+        plans = [budget.plan("regenerate_patch", THINKING_MODEL, MESSAGES, weeks) for weeks in (4, 12)]
+        self.assertEqual([plan.max_tokens for plan in plans], [5632, 6144])
+
+    def test_capped_at_default_limits(self):
+        budget = budgeter()
+        plan = budget.plan("breakdown", THINKING_MODEL, MESSAGES, 26)
+        self.assertEqual((plan.max_tokens, plan.timeout, plan.cap), (16384, 600.0, 16384))
+
+    def test_timeout_floor(self):
+        budget = budgeter()
+        # 分析类 Agent 的输出很短，超时仍不低于下限
+        self.assertEqual(budget.plan("task_type", FAST_MODEL, MESSAGES).timeout, 60 + 256 / 20)
+        self.assertGreaterEqual(budget.plan("questions", THINKING_MODEL, MESSAGES).timeout, 300)
+        self.assertEqual(budget.plan("breakdown", FAST_MODEL, MESSAGES, 12).timeout, 120.0)
+        budget = budgeter(LLM_TOKEN_BUDGET_MIN_TIMEOUT="90", LLM_TOKEN_BUDGET_MIN_TIMEOUT_THINKING="400",
+                          LLM_TOKEN_BUDGET_THINKING="0")
+        self.assertEqual(budget.plan("task_type", FAST_MODEL, MESSAGES).timeout, 90 + 256 / 20)
+        self.assertEqual(budget.plan("questions", THINKING_MODEL, MESSAGES).timeout, 400 + 1280 / 20)
+
+    def test_disabled_uses_default_limits(self):
+        budget = budgeter(LLM_TOKEN_BUDGET="false")
+        plan = budget.plan("task_type", FAST_MODEL, MESSAGES)
+        self.assertEqual((plan.max_tokens, plan.timeout), (8192, 120.0))
+
+
+class TestReplayTruncation(unittest.TestCase):
+    """回放按请求的 max_tokens 截断输出"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recorder = get_llm_recorder()
+        if not len(cls.recorder.store):
+            raise unittest.SkipTest(f"没有 LLM fixture: {cls.recorder.store.directory}")
+
+    def breakdown_fixture(self) -> dict:
+        fixtures = [f for f in self.recorder.store if f["request"]["messages"][-1]["content"].startswith("请将下面的需求拆解")]
+        return min(fixtures, key=lambda f: f["response"]["usage"]["completion_tokens"])
+
+    def test_payload(self):
+        fixture = self.breakdown_fixture()
+        usage = fixture["response"]["usage"]
+        self.assertEqual(completion_payload(fixture, THINKING_MODEL, usage["completion_tokens"])["choices"][0],
+                         {"index": 0, "message": {"role": "assistant", "content": fixture["response"]["content"]},
+                          "finish_reason": "stop"})
+        # 推理 token 之外只剩一半的输出
+        reasoning = usage["completion_tokens_details"]["reasoning_tokens"]
+        max_tokens = reasoning + (usage["completion_tokens"] - reasoning) // 2
+        payload = completion_payload(fixture, THINKING_MODEL, max_tokens)
+        content = payload["choices"][0]["message"]["content"]
+        self.assertEqual(payload["choices"][0]["finish_reason"], "length")
+        self.assertEqual(payload["usage"]["completion_tokens"], max_tokens)
+        self.assertTrue(fixture["response"]["content"].startswith(content))
+        self.assertAlmostEqual(len(content) / len(fixture["response"]["content"]), 0.5, delta=0.01)
+
+    def test_truncated_call_retried_at_cap(self):
+        service = AIService()
+        # 没有推理预算和安全余量：拆解（和补充问题）的输出被截断，各按上限重新请求一次
+        service.token_budget = budgeter(LLM_TOKEN_BUDGET_SAFETY="1", LLM_TOKEN_BUDGET_THINKING="0",
+                                        LLM_TOKEN_BUDGET_THINKING_PER_WEEK="0")
+        before = self.recorder.get_stats()
+        result = service.generate_task_breakdown(FORM_DATA)
+        after = self.recorder.get_stats()
+        self.assertEqual(len(result["tasks"]["weekly"]), 4)
+        agents = service.token_budget.get_stats()["agents"]
+        truncated = sum(stats["truncated"] for stats in agents.values())
+        self.assertEqual(agents["breakdown"]["truncated"], 1)
+        self.assertEqual((after["hits"] + after["nearest"]) - (before["hits"] + before["nearest"]), 4 + truncated)
+
+
+class TestHorizonReplay(unittest.TestCase):
+    """4 周和 6 周计划：按 Agent 估算的预算与固定值相比不增加截断和重新请求"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recorder = get_llm_recorder()
+        if not len(cls.recorder.store):
+            raise unittest.SkipTest(f"没有 LLM fixture: {cls.recorder.store.directory}")
+
+    def run_scenario(self, form_data: dict, weeks: int, token_budget: TokenBudgeter) -> tuple:
+        """拆解后按补充信息补丁重新生成，返回 (上游调用次数, 各 Agent 的截断次数)"""
+        service = AIService()
+        service.token_budget = token_budget
+        before = self.recorder.get_stats()
+        result = service.generate_task_breakdown(form_data)
+        self.assertEqual(len(result["tasks"]["weekly"]), weeks)
+        service.regenerate_mode = "patch"
+        service.regenerate_with_answers(form_data, ANSWERS, result["tasks"], ANALYSIS, QUESTIONS, previous_answers={})
+        after = self.recorder.get_stats()
+        self.assertEqual(after["misses"], before["misses"])
+        calls = (after["hits"] + after["nearest"]) - (before["hits"] + before["nearest"])
+        truncated = {name: stats["truncated"] for name, stats in token_budget.get_stats()["agents"].items()}
+        return calls, truncated
+
+    def test_no_extra_truncation(self):
+        for form_data, weeks in ((FORM_DATA, 4), (long_form_data(), 6)):
+            with self.subTest(weeks=weeks):
+                budgeted = budgeter()
+                calls, truncated = self.run_scenario(form_data, weeks, budgeted)
+                fixed_calls, fixed_truncated = self.run_scenario(form_data, weeks, budgeter(LLM_TOKEN_BUDGET="false"))
+                # 任务类型、经验水平、补充问题、任务拆解、补丁、补充问题
+                self.assertEqual(calls, 6)
+                self.assertEqual((calls, truncated), (fixed_calls, fixed_truncated))
+                self.assertEqual(set(truncated.values()), {0})
+                agents = budgeted.get_stats()["agents"]
+                self.assertLess(agents["breakdown"]["avg_max_tokens"], 16384)
+
+
+def main():
+    """主函数"""
+    unittest.main(module=__name__, argv=[sys.argv[0]], exit=False, verbosity=2)
+
+
+if __name__ == "__main__":
+    main()